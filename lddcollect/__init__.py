@@ -1,42 +1,51 @@
 """ Tools for listing files needed to run elf executable to use elf library.
 """
-import subprocess
+import glob
+import math
+import os
 import sys
-import warnings
-from typing import List, Iterable, Iterator, Tuple, Dict, Set, Any, Union, Optional
+from typing import List, Iterable, Iterator, Tuple, Dict, Any, Union, Optional, Callable, Deque
 import collections
+import collections.abc
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 import re
-from os import readlink, scandir, DirEntry
-from pathlib import Path
-from queue import Queue
-from .vendor.lddtree import lddtree
-from elftools.elf.elffile import ELFFile, ELFError  # type: ignore
+from os import scandir, DirEntry
+from .vendor.lddtree import FsCache, lddtree, link_chain, realpath as _realpath
+from .dpkg import dpkg_s, dpkg_search, dpkg_index, DpkgIndex, DPKG_ADMINDIR, _stamp as _dpkg_stamp
+from .cache import ElfCache, StatElfCache, default_cache_dir
+from .graph import DepGraph, LibNode, lib_paths
+from .elf import read_elf_type, ET_DYN, ElfInfo
+from .vfs import FileSystem, LOCAL_FS, open_root
+from .stats import Stats, count, phase, use as _use_stats, active as _active_stats
 
 
 lib_rgx = re.compile(".*\\.so(.[.0-9]+){0,1}$")
 
 
-def is_elf(path: str) -> bool:
-    try:
-        with open(path, 'rb') as f:
-            elf = ELFFile(f)
-            return bool(elf)
-    except (IOError, ELFError):
-        return False
+def is_elf(path: str, fs: FileSystem = LOCAL_FS) -> bool:
+    return read_elf_type(path, fs.open) is not None
+
+
+def is_shared_elf(path: str, fs: FileSystem = LOCAL_FS) -> bool:
+    """
+    Check ELF header for ``e_type == ET_DYN`` (shared library or PIE).
+    """
+    return read_elf_type(path, fs.open) == ET_DYN
 
 
 def _maybe_lib(path: str) -> bool:
     return lib_rgx.match(path) is not None
 
 
-def check_if_lib(path: str) -> bool:
-    return _maybe_lib(path) and is_elf(path)
+def check_if_lib(path: str, fs: FileSystem = LOCAL_FS) -> bool:
+    return _maybe_lib(path) and is_shared_elf(path, fs)
 
 
 def scantree(path: str) -> Iterator[DirEntry]:
     """
     Recursively yield DirEntry objects for given directory.
     """
+    count('listdir')
     for entry in scandir(path):
         if entry.is_dir(follow_symlinks=False):
             yield from scantree(entry.path)
@@ -44,60 +53,73 @@ def scantree(path: str) -> Iterator[DirEntry]:
             yield entry
 
 
-def find_libs(path: str) -> Iterator[str]:
+def _walk_files(path: str, fs: FileSystem) -> Iterator[str]:
     """
-    Recursively list directory looking for dynamic library files.
+    Recursively yield paths of all non-directory entries.
     """
-    return (e.path
-            for e in scantree(path)
-            if check_if_lib(e.path))
+    if fs is LOCAL_FS:
+        yield from (e.path for e in scantree(path))
+        return
+
+    for name, is_dir in fs.listdir(path):
+        child = os.path.join(path, name)
+        if is_dir:
+            yield from _walk_files(child, fs)
+        else:
+            yield child
 
 
-def dpkg_s(*args: str) -> Tuple[List[Tuple[str, str]], List[str]]:
-    """ Call `dpkg -S {arg}` and parse output into a list of tuples:
+def find_libs(path: str,
+              workers: Optional[int] = None,
+              fs: FileSystem = LOCAL_FS) -> Iterator[str]:
+    """
+    Recursively list directory looking for dynamic library files.
 
-        [(pkg-name, full-path)]
+    :param workers: Number of threads to use for checking ELF headers,
+                    results are produced in directory scan order as they
+                    become available.
 
-        Returns
-        =======
-        [(pkg, path),...], [not-found-inputs]
+    :param fs: File system to scan, see ``lddcollect.vfs``
     """
-    def parse_line(line: str) -> Tuple[str, str]:
-        idx = line.find(': ')
-        if idx < 0:
-            raise ValueError('Unexpected output from dpkg')
-        deb, path = line[:idx], line[idx + 2:]
-        return (deb, path)
-
-    proc = subprocess.Popen(['/usr/bin/dpkg', '-S', *args],
-                            stderr=subprocess.PIPE,
-                            stdout=subprocess.PIPE)
-
-    exit_code = proc.wait()
-    assert proc.stdout is not None
-    lines = proc.stdout.read().decode('utf8').split('\n')
-    parsed = [parse_line(line) for line in lines if line]
-    missing = []
-    found = set(path for _, path in parsed)
-    if exit_code != 0:
-        for arg in args:
-            if arg.startswith('/') or arg.startswith('./'):
-                if arg not in found:
-                    missing.append(arg)
-            else:
-                if not any(arg in path for path in found):
-                    missing.append(arg)
-
-    return parsed, missing
+    candidates = (p for p in _walk_files(path, fs) if _maybe_lib(p))
+
+    def check(p: str) -> bool:
+        return is_shared_elf(p, fs)
+
+    if workers is None or workers <= 1:
+        return (p for p in candidates if check(p))
+
+    return _filter_parallel(candidates, check, workers)
+
+
+def _filter_parallel(items: Iterable[str],
+                     pred: Callable[[str], bool],
+                     workers: int) -> Iterator[str]:
+    # Bounded number of checks in flight, so that input is consumed lazily
+    max_pending = workers * 16
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending: 'Deque[Tuple[str, Future]]' = collections.deque()
+        for item in items:
+            pending.append((item, pool.submit(pred, item)))
+            if len(pending) >= max_pending:
+                item, fut = pending.popleft()
+                if fut.result():
+                    yield item
+
+        while pending:
+            item, fut = pending.popleft()
+            if fut.result():
+                yield item
 
 
 def lib2pkg_debian(libs: Dict[str, Dict[str, str]],
-                   skip_prefix: Optional[str] = None) -> Dict[str, Optional[str]]:
+                   skip_prefix: Optional[str] = None,
+                   index: Optional[DpkgIndex] = None) -> Dict[str, Optional[str]]:
     """
     For each lib lookup Debian package that provides it.
     """
 
-    path2lib = {}
+    path2lib: Dict[str, List[str]] = {}
 
     for name, lib in libs.items():
         realpath = lib['realpath']
@@ -109,20 +131,20 @@ def lib2pkg_debian(libs: Dict[str, Dict[str, str]],
             if realpath.startswith(skip_prefix):
                 continue
 
-        p = Path(realpath)
-        path2lib[realpath] = name
+        path2lib.setdefault(realpath, []).append(name)
 
         # Deal with /lib vs /usr/lib ambiguity on Ubuntu 20.04
         # On 20.04 /lib is a symlink to /usr/lib some packages use
         # /lib some /usr/lib so we have to lookup both
-        p2 = p.resolve()
-        if p2 != p:
-            path2lib[str(p2)] = name
+        p2 = _realpath(realpath)
+        if p2 != realpath:
+            path2lib.setdefault(p2, []).append(name)
 
-    debs, _ = dpkg_s(*list(path2lib))
-    lib2pkg: Dict[str, Optional[str]] = {path2lib[path]: pkg
+    debs, _ = dpkg_search(list(path2lib), index=index)
+    lib2pkg: Dict[str, Optional[str]] = {name: pkg
                                          for pkg, path in debs
-                                         if path in path2lib}
+                                         if path in path2lib
+                                         for name in path2lib[path]}
     for name in libs:
         if name not in lib2pkg:
             lib2pkg[name] = None
@@ -130,37 +152,11 @@ def lib2pkg_debian(libs: Dict[str, Dict[str, str]],
     return lib2pkg
 
 
-def _resolve_link(link: Path) -> Path:
-    next_link = Path(readlink(str(link)))
-    if next_link.is_absolute():
-        return next_link
-
-    return link.parent/next_link
-
-
-def _resolve_link_all(path: Path) -> Iterable[Path]:
-    while path.is_symlink():
-        yield(path)
-        path = _resolve_link(path)
-    yield path
-
-
 def _lib_paths(lib: Dict[str, str]) -> Iterable[str]:
     """ yield all symlinks starting from lib[path]->lib[realpath]
         Produces Empty sequence if lib[path] is None
     """
-    path, realpath = lib['path'], lib['realpath']
-    if path == realpath:
-        if path is not None:
-            yield path
-    else:
-        last = ""
-        for p in _resolve_link_all(Path(path)):
-            last = str(p)
-            yield last
-
-        if last != realpath:
-            warnings.warn(f"Symlink didn't go to expected place: {last} != {realpath}")
+    return lib_paths(lib['path'], lib['realpath'])
 
 
 def _paths(ltree):
@@ -170,24 +166,296 @@ def _paths(ltree):
 
 
 def files2deb(files: List[str]) -> Dict[str, str]:
-    debs, non_deb = dpkg_s(*files)
+    debs, non_deb = dpkg_search(files)
     return {path: deb for deb, path in debs}
 
 
-def _update_realpath(ltree: Dict[str, Any]):
+def _update_realpath(ltree: Dict[str, Any], fs: FileSystem = LOCAL_FS, cache: Optional[FsCache] = None):
     # lddtree seems to set realpath to path for top-level lib
     # but we want it to be just like any other lib
     if ltree['path'] == ltree['realpath']:
-        root_path = Path(ltree['path'])
-        if root_path.is_symlink():
-            ltree['realpath'] = str(root_path.resolve())
+        root_path = ltree['path']
+        if len(link_chain(root_path, fs=fs, cache=cache)) > 1:
+            ltree['realpath'] = _realpath(root_path, fs, cache)
+
+
+# (elf_cache, find_cache, fs_cache), live for one resolution
+_Caches = Tuple[Any, Dict[Any, Any], FsCache]
+
+# Per-process caches used by worker processes: cache_dir -> caches, workers
+# only live for one resolution
+_worker_caches: Dict[Optional[str], _Caches] = {}
+
+# File system and pre-parsed ELF files used by worker processes, set by pool
+# initializer, or inherited from the parent where there is none (Python 3.6,
+# workers are forked there)
+_worker_fs: FileSystem = LOCAL_FS
+_worker_elf_info: Optional[Dict[str, ElfInfo]] = None
+
+_POOL_INITIALIZER = sys.version_info >= (3, 7)
+
+
+def _init_worker(fs: FileSystem, elf_info: Optional[Dict[str, ElfInfo]] = None):
+    global _worker_fs, _worker_elf_info
+    _worker_fs = fs
+    _worker_elf_info = elf_info
+
+
+def _make_caches(cache_dir: Optional[str], elf_info: Optional[Dict[str, ElfInfo]] = None) -> _Caches:
+    elf_cache = {} if cache_dir is None else ElfCache(cache_dir)
+    if elf_info:
+        for path, info in elf_info.items():
+            elf_cache[path] = info
+    return (elf_cache, {}, FsCache())
+
+
+def _resolve_chunk(fnames: List[str],
+                   verbose: bool = False,
+                   cache_dir: Optional[str] = None,
+                   caches: Optional[_Caches] = None,
+                   fs: Optional[FileSystem] = None,
+                   stats: Optional[Stats] = None,
+                   evict_inputs: bool = False) -> Tuple[List[int], DepGraph, Tuple[int, int], Optional[Stats]]:
+    """
+    Resolve dependencies of ``fnames``, also returns persistent cache (hits, misses).
+
+    :param stats: Collect counters into this object and return it, used by
+                  worker processes
+
+    :param evict_inputs: Drop parsed inputs that are not libraries of any
+                         input of this chunk from the in-memory ELF cache,
+                         so that it only grows with the number of libraries
+    """
+    if stats is not None:
+        with _use_stats(stats), stats.phase('resolve_chunk'):
+            roots, graph, counts, _ = _resolve_chunk(fnames, verbose, cache_dir, caches, fs,
+                                                     evict_inputs=evict_inputs)
+        return roots, graph, counts, stats
+
+    if fs is None:
+        fs = _worker_fs
+    if caches is None:
+        caches = _worker_caches.get(cache_dir)
+        if caches is None:
+            caches = _worker_caches[cache_dir] = _make_caches(cache_dir, _worker_elf_info)
+    elf_cache, find_cache, fs_cache = caches
+    hits, misses = getattr(elf_cache, 'hits', 0), getattr(elf_cache, 'misses', 0)
+
+    graph = DepGraph(fs, fs_cache)
+    roots: List[int] = []
+    for fname in fnames:
+        if verbose:
+            print(f"Finding dependencies ({fname})", file=sys.stderr)
+
+        ltree = lddtree(fname, elf_cache=elf_cache, find_cache=find_cache, fs=fs, cache=fs_cache)
+        _update_realpath(ltree, fs, fs_cache)
+        roots.append(graph.add_tree(fname, ltree))
+
+    if evict_inputs:
+        # library entries are keyed by real path, inputs by the path given
+        libs = {n.realpath for n in graph.nodes if not n.is_input}
+        for root in roots:
+            path = graph.nodes[root].path
+            if path not in libs:
+                if isinstance(elf_cache, ElfCache):
+                    elf_cache.forget(path)
+                else:
+                    elf_cache.pop(path, None)
+
+    if isinstance(elf_cache, ElfCache):
+        elf_cache.flush()
+        hits, misses = elf_cache.hits - hits, elf_cache.misses - misses
+
+    return roots, graph, (hits, misses), None
+
+
+def _chunks(items: Iterable[str], n: int) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _chunk_size(fnames: Iterable[str], workers: int, max_size: int = 32) -> int:
+    # about four chunks per worker, so that few inputs still use all of them
+    if isinstance(fnames, collections.abc.Sized):
+        return max(1, min(max_size, math.ceil(len(fnames) / (workers * 4))))
+    return max_size
+
+
+def _resolve_parallel(fnames: Iterable[str],
+                      workers: int,
+                      verbose: bool = False,
+                      cache_dir: Optional[str] = None,
+                      chunk_size: Optional[int] = None,
+                      fs: FileSystem = LOCAL_FS,
+                      elf_info: Optional[Dict[str, ElfInfo]] = None,
+                      evict_inputs: bool = False) -> Iterator[Tuple[List[int], DepGraph, Tuple[int, int], Optional[Stats]]]:
+    max_pending = workers * 2
+    if chunk_size is None:
+        chunk_size = _chunk_size(fnames, workers)
+    # Image index and pre-parsed files are sent to every worker once rather than with every chunk
+    pool_args: Dict[str, Any] = {}
+    saved = (_worker_fs, _worker_elf_info)
+    if fs is not LOCAL_FS or elf_info:
+        if _POOL_INITIALIZER:
+            pool_args = dict(initializer=_init_worker, initargs=(fs, elf_info))
+        else:
+            # all workers are forked on first submit and inherit these
+            _init_worker(fs, elf_info)
+
+    # Counters of worker processes are sent back with results
+    stats = _active_stats()
+    trace = stats is not None and stats.events is not None
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, **pool_args) as pool:
+            pending: 'Deque[Future]' = collections.deque()
+            for chunk in _chunks(fnames, chunk_size):
+                pending.append(pool.submit(_resolve_chunk, chunk, verbose, cache_dir, None, None,
+                                           None if stats is None else Stats(trace), evict_inputs))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        _init_worker(*saved)
+
+
+def resolve_graph(fnames: Iterable[str],
+                  verbose: bool = False,
+                  workers: Optional[int] = None,
+                  cache_dir: Optional[str] = None,
+                  fs: FileSystem = LOCAL_FS,
+                  elf_info: Optional[Dict[str, ElfInfo]] = None) -> Tuple[DepGraph, List[int]]:
+    """
+    Build dependency graph for a set of ELF files.
+
+    :param fnames: File paths to ELF files
+
+    :param verbose: Print things to stderr
+
+    :param workers: Parse ELF files using this many processes
+
+    :param cache_dir: Keep parsed ELF files in this directory and re-use them
+                      across runs, only used for the local file system
+
+    :param fs: File system to read, paths are paths inside it
+
+    :param elf_info: Already parsed ELF files by path, these are not read
+                     again, see ``lddcollect.dedup``
+
+    Returns:
+
+      Graph and ids of the input nodes (in the input order)
+    """
+    hits, misses = 0, 0
+    if fs is not LOCAL_FS:
+        # persistent cache is keyed by host inodes
+        cache_dir = None
+
+    with phase('resolve'):
+        if workers is not None and workers > 1:
+            stats = _active_stats()
+            graph = DepGraph(fs, FsCache())
+            roots: List[int] = []
+            for _roots, _graph, (_hits, _misses), _stats in _resolve_parallel(fnames, workers,
+                                                                              verbose=verbose,
+                                                                              cache_dir=cache_dir,
+                                                                              fs=fs,
+                                                                              elf_info=elf_info):
+                remap = graph.merge(_graph)
+                roots.extend(remap[r] for r in _roots)
+                hits, misses = hits + _hits, misses + _misses
+                if stats is not None and _stats is not None:
+                    stats.merge(_stats)
+        else:
+            caches = _make_caches(cache_dir, elf_info)
+            roots, graph, (hits, misses), _ = _resolve_chunk(list(fnames), verbose, caches=caches, fs=fs)
+            if isinstance(caches[0], ElfCache):
+                caches[0].close()
+
+    if cache_dir is not None and verbose:
+        print(f"ELF cache: {hits} hits, {misses} misses", file=sys.stderr)
+
+    return graph, roots
+
+
+def pkg_lookup(graph: DepGraph,
+               dpkg_ignore: List[str] = [],
+               skip_prefix: Optional[str] = None,
+               skip_inputs: bool = False,
+               cache_dir: Optional[str] = None,
+               index: Optional[DpkgIndex] = None) -> Callable[[int], Optional[str]]:
+    """
+    Function mapping graph node to a Debian package (or None).
+
+    :param skip_inputs: Do not lookup packages for input nodes
+
+    :param index: dpkg database index to use, loaded (or re-used) if not supplied
+    """
+    def _skip_pkg(pkg: str) -> bool:
+        if pkg in dpkg_ignore:
+            return True
+        if pkg.split(':')[0] in dpkg_ignore:
+            return True
+        return False
+
+    def _skip(node: LibNode) -> bool:
+        if node.realpath is None or (skip_inputs and node.is_input):
+            return True
+        return skip_prefix is not None and node.realpath.startswith(skip_prefix)
+
+    fs = graph.fs
+    nodes = graph.nodes
+    with phase('pkg'):
+        if index is None and fs is LOCAL_FS:
+            cache_file = None if cache_dir is None else os.path.join(cache_dir, 'dpkg-index.pickle')
+            index = dpkg_index(cache_file=cache_file)
+        elif index is None:
+            # dpkg database of the image, `dpkg -S` can not be used
+            try:
+                index = DpkgIndex.from_admindir(DPKG_ADMINDIR, fs=fs)
+            except OSError:
+                return lambda nid: None
+
+        if index is None:
+            # No direct access to dpkg database, lookup all nodes at once
+            lib2pkg = lib2pkg_debian({nid: {'realpath': node.realpath}
+                                      for nid, node in enumerate(nodes) if not _skip(node)})  # type: ignore
+            lib2pkg = {nid: pkg for nid, pkg in lib2pkg.items() if pkg is not None and not _skip_pkg(pkg)}
+            return lambda nid: lib2pkg.get(nid, None)  # type: ignore
+
+    def pkg_of(nid: int) -> Optional[str]:
+        node = nodes[nid]
+        if _skip(node):
+            return None
+        pkg = index.lookup(node.realpath)  # type: ignore
+        if pkg is None:
+            # Deal with /lib vs /usr/lib ambiguity, see lib2pkg_debian
+            pkg = index.lookup(_realpath(node.realpath, fs, graph.cache))  # type: ignore
+        if pkg is None or _skip_pkg(pkg):
+            return None
+        return pkg
+
+    return pkg_of
 
 
 def process_elf(fname: Union[str, Iterable[str]],
                 verbose: bool = False,
                 dpkg: bool = True,
                 dpkg_ignore: List[str] = [],
-                skip_prefix: Optional[str] = None) -> Tuple[List[str], List[str], List[str]]:
+                skip_prefix: Optional[str] = None,
+                workers: Optional[int] = None,
+                cache_dir: Optional[str] = None,
+                root: Union[str, FileSystem, None] = None,
+                stats: Optional[Stats] = None,
+                elf_info: Optional[Dict[str, ElfInfo]] = None) -> Tuple[List[str], List[str], List[str]]:
     """
     Find dependencies for a given elf file.
 
@@ -204,6 +472,23 @@ def process_elf(fname: Union[str, Iterable[str]],
                         that prefix, this is usually user directory that is
                         known to not contain any system files.
 
+    :param workers: Parse ELF files of multiple inputs using this many processes
+
+    :param cache_dir: Keep parsed ELF files and dpkg index in this directory
+                      and re-use them across runs
+
+    :param root: Root file system to use instead of ``/``: directory, tar
+                 archive, unpacked container image (OCI layout or ``docker
+                 save`` output) or a ``lddcollect.vfs.FileSystem``. File names
+                 and results are paths inside it, images are read without
+                 extracting them.
+
+    :param stats: Collect phase timings and I/O counters into this
+                  ``lddcollect.stats.Stats`` object
+
+    :param elf_info: Already parsed ELF files by path, for example copies of
+                     the same library found by ``lddcollect.dedup.find_duplicates``
+
     Returns:
 
       List of Debian package names that supplied file or it's non-dpkg
@@ -213,86 +498,294 @@ def process_elf(fname: Union[str, Iterable[str]],
 
       [pkgs], [files], [missing-libs]
     """
-    q: 'Queue[Tuple[str, Dict[str, Any]]]' = Queue()
-
-    ltree: Dict[str, Any] = {}
+    fnames: Iterable[str] = []
     if isinstance(fname, str):
-        if verbose:
-            print(f"Finding dependencies ({fname})", file=sys.stderr)
-
-        ltree = lddtree(fname)
-        _update_realpath(ltree)
-        q.put((fname, ltree))
-    elif isinstance(fname, collections.Iterable):
-        # create fake top level lib that depends on supplied inputs
-        roots = [f for f in fname]
-        libs: Dict[str, Any] = {}
-        ltree = dict(interp=None,
-                     rpath=None,
-                     runpath=None,
-                     path=None,
-                     realpath=None,
-                     needed=roots,
-                     libs=libs)
-        for fname in roots:
-            if verbose:
-                print(f"Finding dependencies ({fname})", file=sys.stderr)
-
-            _ldd = lddtree(fname, lib_cache=libs)
-            _update_realpath(_ldd)
-            libs.update(_ldd.pop('libs', {}))
-            libs[fname] = _ldd
-
-        q.put(('', ltree))
+        fnames = [fname]
+        workers = None
+    elif isinstance(fname, collections.abc.Iterable):
+        fnames = fname
     else:
         raise ValueError("Only accept str or Iterable[str]")
 
-    libs = ltree['libs']
+    with _use_stats(stats):
+        fs = root if isinstance(root, FileSystem) else open_root(root)
+        try:
+            graph, roots = resolve_graph(fnames, verbose=verbose, workers=workers, cache_dir=cache_dir, fs=fs,
+                                         elf_info=elf_info)
+
+            pkg_of = None
+            if dpkg:
+                if verbose:
+                    print(f"Mapping libs to packages ({len(graph)})", file=sys.stderr)
+                # single input is not looked up in dpkg
+                pkg_of = pkg_lookup(graph, dpkg_ignore, skip_prefix,
+                                    skip_inputs=isinstance(fname, str),
+                                    cache_dir=cache_dir)
+
+            return _summary(graph, roots, pkg_of, skip_prefix, verbose)
+        finally:
+            # opened here, caller has no way to close it
+            if fs is not root:
+                fs.close()
+
+
+def _summary(graph: DepGraph,
+             roots: List[int],
+             pkg_of: Optional[Callable[[int], Optional[str]]],
+             skip_prefix: Optional[str],
+             verbose: bool) -> Tuple[List[str], List[str], List[str]]:
+    with phase('collect'):
+        pkgs, files, missing = graph.collect(roots, pkg_of, skip_prefix)
 
-    def _skip_pkg(pkg: str) -> bool:
-        if pkg in dpkg_ignore:
-            return True
-        if pkg.split(':')[0] in dpkg_ignore:
-            return True
-        return False
-
-    if dpkg:
+    missing_libs: List[str] = []
+    for nid in missing:
+        name = graph.nodes[nid].name
         if verbose:
-            print(f"Mapping libs to packages ({len(ltree['libs'])})", file=sys.stderr)
-        lib2pkg = lib2pkg_debian(ltree['libs'], skip_prefix=skip_prefix)
-        if len(dpkg_ignore) > 0:
-            lib2pkg = {lib: pkg for lib, pkg in lib2pkg.items() if pkg is not None and not _skip_pkg(pkg)}
-    else:
-        lib2pkg = {}
+            print(f"Failed to find lib: {name}", file=sys.stderr)
+        if name not in missing_libs:
+            missing_libs.append(name)
 
-    seen: Set[str] = set()
-    pkgs: Set[str] = set()
-    files: Set[str] = set()
-    missing_libs: List[str] = []
+    return list(pkgs), list(files), missing_libs
 
-    while not q.empty():
-        name, lib = q.get()
-        if name in seen:
-            continue
 
-        if lib['path'] is None and name != '':
-            if verbose:
-                print(f"Failed to find lib: {name}", file=sys.stderr)
-            missing_libs.append(name)
+def per_input(graph: DepGraph,
+              roots: List[int],
+              pkg_of: Optional[Callable[[int], Optional[str]]] = None,
+              skip_prefix: Optional[str] = None) -> Dict[str, Tuple[List[str], List[str], List[str]]]:
+    """
+    Dependencies of every input, closures are computed in one pass over the
+    graph sharing common sub-closures.
 
-        seen.add(name)
-        pkg = lib2pkg.get(name, None)
-        if pkg is not None:
-            pkgs.add(pkg)
-            continue
-        else:
-            for p in _lib_paths(lib):
-                if skip_prefix is not None and p.startswith(skip_prefix):
-                    continue
-                files.add(p)
+    Returns:
+
+      {input: ([pkgs], [files], [missing-libs])}
+    """
+    node_files: Dict[int, List[str]] = {}
+    node_pkg: Dict[int, Optional[str]] = {}
+
+    def _pkg(nid: int) -> Optional[str]:
+        if nid not in node_pkg:
+            node_pkg[nid] = None if pkg_of is None else pkg_of(nid)
+        return node_pkg[nid]
+
+    def _files(nid: int) -> List[str]:
+        paths = node_files.get(nid)
+        if paths is None:
+            node = graph.nodes[nid]
+            paths = node_files[nid] = [p for p in lib_paths(node.path, node.realpath, graph.fs, graph.cache)
+                                       if skip_prefix is None or not p.startswith(skip_prefix)]
+        return paths
+
+    out: Dict[str, Tuple[List[str], List[str], List[str]]] = {}
+    with phase('collect'):
+        masks = graph.closures(roots, _pkg)
+        for root in roots:
+            pkgs: List[str] = []
+            files: List[str] = []
+            missing: List[str] = []
+            for nid in graph.closure_nodes(masks[root]):
+                node = graph.nodes[nid]
+                if node.path is None:
+                    missing.append(node.name)
+                pkg = _pkg(nid)
+                if pkg is not None:
+                    pkgs.append(pkg)
+                else:
+                    files.extend(_files(nid))
+            out[graph.nodes[root].name] = (sorted(set(pkgs)), sorted(set(files)), sorted(set(missing)))
+
+    return out
+
+
+def process_elf_per_input(fnames: Iterable[str],
+                          verbose: bool = False,
+                          dpkg: bool = True,
+                          dpkg_ignore: List[str] = [],
+                          skip_prefix: Optional[str] = None,
+                          workers: Optional[int] = None,
+                          cache_dir: Optional[str] = None,
+                          root: Union[str, FileSystem, None] = None,
+                          stats: Optional[Stats] = None,
+                          elf_info: Optional[Dict[str, ElfInfo]] = None) -> Dict[str, Tuple[List[str], List[str], List[str]]]:
+    """
+    Same as ``process_elf`` but report dependencies of every input separately.
 
-        for name in lib['needed']:
-            if name not in seen:
-                q.put((name, libs[name]))
+    Returns:
 
-    return list(pkgs), list(files), missing_libs
+      {input: ([pkgs], [files], [missing-libs])}
+    """
+    with _use_stats(stats):
+        fs = root if isinstance(root, FileSystem) else open_root(root)
+        try:
+            graph, roots = resolve_graph(fnames, verbose=verbose, workers=workers, cache_dir=cache_dir, fs=fs,
+                                         elf_info=elf_info)
+            pkg_of = pkg_lookup(graph, dpkg_ignore, skip_prefix, cache_dir=cache_dir) if dpkg else None
+            return per_input(graph, roots, pkg_of, skip_prefix)
+        finally:
+            if fs is not root:
+                fs.close()
+
+
+def why(graph: DepGraph, roots: List[int], lib: str) -> Dict[str, List[LibNode]]:
+    """
+    Which inputs depend on ``lib`` (soname or path) and through what chain of
+    libraries.
+
+    Returns:
+
+      {input: [input-node, ..., lib-node]}
+    """
+    chains = graph.why(graph.find(lib), roots)
+    return {graph.nodes[root].name: [graph.nodes[nid] for nid in chain]
+            for root, chain in chains.items()}
+
+
+def _mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+class Resolver:
+    """
+    Dependency resolution that keeps state across calls: linker search paths,
+    parsed ELF files, symlinks, directory listings and dpkg index.
+
+    Parsed ELF files are checked against file stat on every use. Everything
+    else is dropped when ld.so.conf, ld.so.cache or the dpkg database change,
+    or when any of the library search directories (or input directories)
+    seen so far is modified. Images (``root``) are assumed to not change.
+
+    Not thread safe.
+    """
+
+    def __init__(self,
+                 root: Union[str, FileSystem, None] = None,
+                 cache_dir: Optional[str] = None):
+        """
+        :param root: Root file system, see ``process_elf``
+
+        :param cache_dir: Fall back to persistent cache of parsed ELF files and
+                          dpkg index in this directory
+        """
+        self.fs = root if isinstance(root, FileSystem) else open_root(root)
+        self._own_fs = self.fs is not root
+        self.cache_dir = cache_dir if self.fs is LOCAL_FS else None
+        self.invalidations = 0
+
+        self._elf_cache: Any = {}
+        if self.fs is LOCAL_FS:
+            self._elf_cache = StatElfCache(None if self.cache_dir is None else ElfCache(self.cache_dir))
+        self._find_cache: Dict[Any, Any] = {}
+        self._fs_cache = FsCache()
+        self._index: Optional[DpkgIndex] = None
+        # directory -> mtime, for directories whose contents were cached
+        self._dirs: Dict[str, int] = {}
+        self._stamp = self._config_stamp()
+
+    def _config_stamp(self) -> Any:
+        if self.fs is not LOCAL_FS:
+            return None
+        conf = ['/etc/ld.so.conf', '/etc/ld.so.conf.d', '/etc/ld.so.cache'] + glob.glob('/etc/ld.so.conf.d/*')
+        try:
+            dpkg = _dpkg_stamp(DPKG_ADMINDIR)
+        except OSError:
+            dpkg = None
+        return (tuple((p, _mtime(p)) for p in conf), dpkg)
+
+    def invalidate(self):
+        """ Forget everything except parsed ELF files (those are validated on use)
+        """
+        self._fs_cache = FsCache()
+        self._find_cache.clear()
+        self._index = None
+        self._dirs.clear()
+        self.invalidations += 1
+
+    def refresh(self) -> bool:
+        """ Invalidate caches if system configuration or any of the watched
+            directories changed since last call. Returns True if caches were dropped.
+        """
+        if self.fs is not LOCAL_FS:
+            return False
+
+        stamp = self._config_stamp()
+        if stamp != self._stamp or any(_mtime(d) != m for d, m in self._dirs.items()):
+            self._stamp = stamp
+            self.invalidate()
+            return True
+        return False
+
+    def _watch(self, fnames: List[str]):
+        if self.fs is not LOCAL_FS:
+            return
+        dirs = set(os.path.dirname(os.path.abspath(f)) for f in fnames)
+        for ldpaths in set(key[1] for key in self._find_cache):
+            dirs.update(ldpaths)
+        for d in dirs:
+            if d not in self._dirs:
+                self._dirs[d] = _mtime(d)
+
+    def resolve(self, fnames: Iterable[str], verbose: bool = False) -> Tuple[DepGraph, List[int]]:
+        """ Same as ``resolve_graph`` but with warm caches
+        """
+        self.refresh()
+        fnames = list(fnames)
+        with phase('resolve'):
+            roots, graph, _, _ = _resolve_chunk(fnames, verbose,
+                                                caches=(self._elf_cache, self._find_cache, self._fs_cache),
+                                                fs=self.fs)
+            if isinstance(self._elf_cache, StatElfCache):
+                self._elf_cache.flush()
+        self._watch(fnames)
+        return graph, roots
+
+    def pkg_lookup(self,
+                   graph: DepGraph,
+                   dpkg_ignore: List[str] = [],
+                   skip_prefix: Optional[str] = None,
+                   skip_inputs: bool = False) -> Callable[[int], Optional[str]]:
+        """ Same as ``pkg_lookup`` re-using dpkg index of an image
+        """
+        if self.fs is not LOCAL_FS and self._index is None:
+            try:
+                with phase('pkg'):
+                    self._index = DpkgIndex.from_admindir(DPKG_ADMINDIR, fs=self.fs)
+            except OSError:
+                return lambda nid: None
+        return pkg_lookup(graph, dpkg_ignore, skip_prefix,
+                          skip_inputs=skip_inputs,
+                          cache_dir=self.cache_dir,
+                          index=self._index)
+
+    def process_elf(self,
+                    fname: Union[str, Iterable[str]],
+                    verbose: bool = False,
+                    dpkg: bool = True,
+                    dpkg_ignore: List[str] = [],
+                    skip_prefix: Optional[str] = None) -> Tuple[List[str], List[str], List[str]]:
+        """ Same as ``process_elf`` but with warm caches
+        """
+        single = isinstance(fname, str)
+        graph, roots = self.resolve([fname] if single else fname, verbose)  # type: ignore
+        pkg_of = self.pkg_lookup(graph, dpkg_ignore, skip_prefix, skip_inputs=single) if dpkg else None
+        return _summary(graph, roots, pkg_of, skip_prefix, verbose)
+
+    def per_input(self,
+                  fnames: Iterable[str],
+                  verbose: bool = False,
+                  dpkg: bool = True,
+                  dpkg_ignore: List[str] = [],
+                  skip_prefix: Optional[str] = None) -> Dict[str, Tuple[List[str], List[str], List[str]]]:
+        """ Same as ``process_elf_per_input`` but with warm caches
+        """
+        graph, roots = self.resolve(fnames, verbose)
+        pkg_of = self.pkg_lookup(graph, dpkg_ignore, skip_prefix) if dpkg else None
+        return per_input(graph, roots, pkg_of, skip_prefix)
+
+    def close(self):
+        if isinstance(self._elf_cache, StatElfCache):
+            self._elf_cache.close()
+        if self._own_fs:
+            self.fs.close()
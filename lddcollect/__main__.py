@@ -1,9 +1,19 @@
+import os
 import sys
-from json import (dump as json_dump)
+from json import (dump as json_dump, dumps as json_dumps)
 import click
-from typing import List, Optional
-from pathlib import Path
-from . import process_elf, find_libs
+from typing import Any, List, Optional, Iterable, Dict, Tuple, Set, TYPE_CHECKING
+from . import (process_elf, find_libs, default_cache_dir, resolve_graph, pkg_lookup, why, per_input as _per_input,
+               Resolver)
+from .elf import ElfInfo
+from .graph import DepGraph, LibNode
+from .vfs import FileSystem, open_root, LOCAL_FS
+from .stats import Stats, phase, use as use_stats
+from .stream import stream_records
+from .dedup import find_duplicates, report as dedup_report
+
+if TYPE_CHECKING:
+    from .watch import Watcher
 
 
 @click.command(name='lddcollect')
@@ -11,14 +21,58 @@ from . import process_elf, find_libs
 @click.option('--json', is_flag=True, help="Output in json format")
 @click.option('--verbose', is_flag=True, help="Print some info to stderr")
 @click.option('--ignore-pkg', multiple=True, type=str, help="Packages to ignore (list package files instead)")
+@click.option('--jobs', '-j', type=int, default=1, help="Number of parallel workers, default: 1")
+@click.option('--cache/--no-cache', default=None,
+              help="Keep parsed ELF files and dpkg index across runs, default: no")
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              help="Cache location (implies --cache), default: $XDG_CACHE_HOME/lddcollect")
+@click.option('--ndjson', is_flag=True,
+              help="Stream results as they are found, one json record per line")
+@click.option('--dedup', is_flag=True,
+              help="Parse copies of the same library once, print groups of copies to stderr")
+@click.option('--watch', is_flag=True,
+              help="Keep running, print added and removed files, packages and missing libraries on changes")
+@click.option('--per-input', is_flag=True, help="Report dependencies of every input separately (json)")
+@click.option('--why', 'why_lib', type=str, help="Print which inputs need this library and how")
+@click.option('--root', type=click.Path(exists=True),
+              help="Root file system to use instead of /: directory, tar file or container image directory")
+@click.option('--bundle', type=click.Path(file_okay=False),
+              help="Copy listed files (and symlinks) into this directory, skips unchanged files")
+@click.option('--bundle-tar', type=click.Path(dir_okay=False, allow_dash=True),
+              help="Write listed files (and symlinks) into this tar file (.tar[.gz|.bz2|.xz], - for stdout)")
+@click.option('--hardlink', is_flag=True, help="Hardlink files into --bundle directory instead of copying")
+@click.option('--serve', 'serve_socket', type=click.Path(dir_okay=False),
+              help="Run resolver service on this Unix socket, keeping caches warm across queries")
+@click.option('--server', 'server_socket', type=click.Path(dir_okay=False, exists=True),
+              help="Send query to resolver service running on this Unix socket")
+@click.option('--stats', 'show_stats', is_flag=True,
+              help="Print time, file system access and cache use per phase to stderr")
+@click.option('--trace', type=click.Path(dir_okay=False),
+              help="Write phase timings to this file in Chrome trace format")
 @click.argument('libs_or_dir',
                 nargs=-1,
-                type=click.Path(exists=True, dir_okay=True, file_okay=True))
+                type=click.Path(dir_okay=True, file_okay=True))
 def main(libs_or_dir: List[str],
          dpkg: bool = False,
          json: bool = False,
          verbose: bool = False,
-         ignore_pkg: List[str] = []):
+         ignore_pkg: List[str] = [],
+         jobs: int = 1,
+         cache: Optional[bool] = None,
+         cache_dir: Optional[str] = None,
+         ndjson: bool = False,
+         dedup: bool = False,
+         watch: bool = False,
+         per_input: bool = False,
+         why_lib: Optional[str] = None,
+         root: Optional[str] = None,
+         bundle: Optional[str] = None,
+         bundle_tar: Optional[str] = None,
+         hardlink: bool = False,
+         serve_socket: Optional[str] = None,
+         server_socket: Optional[str] = None,
+         show_stats: bool = False,
+         trace: Optional[str] = None):
     """
     Find all other libraries and optionally Debian dependencies listed
     applications/libraries require to run.
@@ -41,24 +95,227 @@ def main(libs_or_dir: List[str],
       1. Non-dpkg managed files, one per line
       2. Separator line: ...
       3. Package names, one per line
+
+    With --root, inputs and outputs are paths inside that root file system.
+    Tar files (also compressed) and container images (OCI layout or `docker
+    save` output, unpacked into a directory) are read without extracting them.
+
+    With --serve SOCKET, run as a service answering queries sent with
+    --server SOCKET, caches stay warm between queries.
+
+    With --ndjson, print one json record per line as soon as a chunk of inputs
+    is resolved: {"type": "input"|"file"|"package"|"missing", ...}, followed
+    by a {"type": "done", ...} summary. Records are not sorted, every file,
+    package and missing library is printed once.
+
+    With --dedup, find copies of the same library among inputs (same size,
+    headers and dynamic section), parse only one of them and print groups of
+    copies with the number of bytes they waste to stderr.
+
+    With --watch, keep running and print changes as "+path" and "-path" lines
+    (packages after "..."), starting with everything as added. Inputs are
+    resolved again only when they or libraries they use change. Changes to
+    missing libraries go to stderr. Stop with Ctrl-C.
+
+    With --stats, print wall time and counts of files opened, bytes read,
+    stat/readlink calls, ELF parses, cache hits/misses and dpkg lookups per
+    phase (scan, resolve, pkg, collect, output) to stderr.
     """
-    pkgs: Optional[List[str]] = None
+    _check_options({'--json': json, '--ndjson': ndjson, '--dedup': dedup, '--watch': watch,
+                    '--per-input': per_input, '--why': why_lib is not None, '--root': root is not None,
+                    '--bundle': bundle is not None, '--bundle-tar': bundle_tar is not None,
+                    '--serve': serve_socket is not None, '--server': server_socket is not None})
+
+    if cache is None:
+        cache = cache_dir is not None
+    if not cache:
+        cache_dir = None
+    elif cache_dir is None:
+        cache_dir = default_cache_dir()
+
+    stats: Optional[Stats] = None
+    if show_stats or trace is not None:
+        stats = Stats(trace=trace is not None)
+        # also reported when exiting early or with an error
+        click.get_current_context().call_on_close(lambda: _report_stats(stats, trace))
+
+    with use_stats(stats):
+        fs = open_root(root)
+        click.get_current_context().call_on_close(fs.close)
+        if serve_socket is not None:
+            from .server import serve as _serve
+            _serve(serve_socket, Resolver(fs, cache_dir), verbose=verbose)
+            return
+
+        if server_socket is not None:
+            result = _query_server(server_socket, libs_or_dir, dpkg, ignore_pkg, per_input)
+            if result is None:
+                return
+            pkgs, files, missing = result
+        else:
+            libs_or_dir = _check_inputs(libs_or_dir, fs)
+            if watch:
+                from .watch import Watcher
+                _print_watch(Watcher(libs_or_dir, Resolver(fs, cache_dir),
+                                     dpkg=dpkg, dpkg_ignore=ignore_pkg, verbose=verbose), json)
+                return
+
+            # time the scan on its own rather than interleaved with resolution
+            libs, prefix = _scan(libs_or_dir, fs, jobs, listed=stats is not None and not ndjson)
+
+            elf_info = None
+            if dedup:
+                libs = list(libs)
+                elf_info = _find_copies(libs, fs)
+
+            if ndjson:
+                _print_ndjson(stream_records(libs,
+                                             verbose=verbose,
+                                             dpkg=dpkg,
+                                             dpkg_ignore=ignore_pkg,
+                                             skip_prefix=prefix,
+                                             workers=jobs,
+                                             cache_dir=cache_dir,
+                                             fs=fs))
+                return
+
+            if per_input or why_lib is not None:
+                graph, roots = resolve_graph(libs, verbose=verbose, workers=jobs, cache_dir=cache_dir, fs=fs,
+                                             elf_info=elf_info)
+                if why_lib is not None:
+                    _print_why(why(graph, roots, why_lib), json)
+                else:
+                    _print_graph_per_input(graph, roots, prefix, dpkg, ignore_pkg, cache_dir)
+                return
+
+            pkgs, files, missing = process_elf(libs,
+                                               verbose=verbose,
+                                               dpkg=dpkg,
+                                               dpkg_ignore=ignore_pkg,
+                                               skip_prefix=prefix,
+                                               workers=jobs,
+                                               cache_dir=cache_dir,
+                                               root=fs,
+                                               elf_info=elf_info)
 
-    if len(libs_or_dir) == 1 and Path(libs_or_dir[0]).is_dir():
+        files = sorted(files)
+        if bundle is not None:
+            _bundle_dir(files, bundle, fs, jobs, hardlink, verbose)
+        if bundle_tar is not None:
+            _bundle_tar(files, bundle_tar, fs, verbose)
+        if bundle_tar != '-':
+            # otherwise stdout is taken by the archive
+            with phase('output'):
+                _print_files(files, sorted(pkgs) if dpkg else None, json)
+        _report_missing(missing)
+
+
+# Options that can not be used together with the first one
+_CONFLICTS = [
+    ('--ndjson', ('--json', '--per-input', '--why', '--bundle', '--bundle-tar', '--serve', '--server')),
+    ('--dedup', ('--ndjson', '--serve', '--server')),
+    ('--watch', ('--ndjson', '--dedup', '--per-input', '--why', '--root', '--bundle', '--bundle-tar', '--serve',
+                 '--server')),
+    ('--why', ('--per-input', '--bundle', '--bundle-tar')),
+    ('--per-input', ('--bundle', '--bundle-tar')),
+]
+
+
+def _check_options(given: Dict[str, bool]):
+    """ Reject option combinations that make no sense, ``given`` maps option
+        names to whether they were used
+    """
+    for option, others in _CONFLICTS:
+        if given[option] and any(given[o] for o in others):
+            raise click.UsageError(f"{option} can not be combined with {', '.join(others[:-1])} or {others[-1]}")
+    if given['--server'] and (given['--why'] or given['--root']):
+        raise click.UsageError("--why and --root can not be used with --server")
+
+
+def _query_server(server_socket: str,
+                  libs_or_dir: List[str],
+                  dpkg: bool,
+                  ignore_pkg: List[str],
+                  per_input: bool) -> Optional[Tuple[List[str], List[str], List[str]]]:
+    """ Resolve inputs with a running service, None when results were
+        already printed (--per-input)
+    """
+    from .server import query
+
+    request = {'paths': [os.path.abspath(p) for p in libs_or_dir],
+               'dpkg': dpkg,
+               'ignore_pkg': list(ignore_pkg),
+               'per_input': per_input}
+    try:
+        response = query(server_socket, request)
+    except (OSError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+
+    if per_input:
+        _print_per_input({name: (r.get('packages', []), r['files'], r['missing'])
+                          for name, r in response['inputs'].items()}, dpkg)
+        return None
+    return response.get('packages', []), response['files'], response['missing']
+
+
+def _check_inputs(libs_or_dir: List[str], fs: FileSystem) -> List[str]:
+    if fs is not LOCAL_FS:
+        libs_or_dir = [os.path.join('/', p) for p in libs_or_dir]
+    for p in libs_or_dir:
+        if not fs.exists(p):
+            raise click.BadParameter(f"Path '{p}' does not exist.", param_hint="'[LIBS_OR_DIR]...'")
+    return libs_or_dir
+
+
+def _scan(libs_or_dir: List[str], fs: FileSystem, jobs: int, listed: bool) -> Tuple[Iterable[str], Optional[str]]:
+    """ Inputs and the directory they were found in, if a single directory
+        was given. With ``listed`` the scan is done before returning.
+    """
+    if len(libs_or_dir) == 1 and fs.isdir(libs_or_dir[0]):
         prefix = libs_or_dir[0]
-        libs = list(find_libs(prefix))
-        pkgs, files, missing = process_elf(libs,
-                                           verbose=verbose,
-                                           dpkg=dpkg,
-                                           dpkg_ignore=ignore_pkg,
-                                           skip_prefix=prefix)
-    else:
-        libs = libs_or_dir
-        pkgs, files, missing = process_elf(libs, verbose=verbose, dpkg=dpkg, dpkg_ignore=ignore_pkg)
+        with phase('scan'):
+            libs: Iterable[str] = find_libs(prefix, workers=jobs, fs=fs)
+            if listed:
+                libs = list(libs)
+        return libs, prefix
+    return libs_or_dir, None
+
+
+def _find_copies(libs: List[str], fs: FileSystem) -> Dict[str, ElfInfo]:
+    """ Parsed copies for ``elf_info`` of ``process_elf``, groups of copies go to stderr """
+    with phase('dedup'):
+        groups, elf_info = find_duplicates(libs, fs)
+    dedup_report(groups, sys.stderr)
+    return elf_info
+
+
+def _bundle_dir(files: List[str], bundle: str, fs: FileSystem, jobs: int, hardlink: bool, verbose: bool):
+    from .bundle import bundle_dir
+
+    with phase('bundle'):
+        try:
+            stats = bundle_dir(files, bundle, fs, workers=jobs if jobs > 1 else None, hardlink=hardlink)
+        except OSError as e:
+            raise click.ClickException(f"Bundle failed: {e}")
+    if verbose:
+        print(f"Bundle: {stats.copied} copied, {stats.skipped} unchanged, "
+              f"{stats.links} symlinks, {stats.bytes} bytes", file=sys.stderr)
+
+
+def _bundle_tar(files: List[str], bundle_tar: str, fs: FileSystem, verbose: bool):
+    from .bundle import bundle_tar as bundle_tar_
 
-    files = sorted(files)
-    pkgs = sorted(pkgs) if dpkg else None
+    with phase('bundle'):
+        try:
+            stats = bundle_tar_(files, bundle_tar, fs)
+        except OSError as e:
+            raise click.ClickException(f"Bundle failed: {e}")
+    if verbose:
+        print(f"Bundle tar: {stats.copied} files, {stats.links} symlinks, "
+              f"{stats.bytes} bytes", file=sys.stderr)
 
+
+def _print_files(files: List[str], pkgs: Optional[List[str]], json: bool):
     if json:
         out = {'files': files}
         if pkgs is not None:
@@ -73,6 +330,70 @@ def main(libs_or_dir: List[str],
             for pkg in pkgs:
                 print(pkg)
 
+
+def _print_ndjson(batches: Iterable[List[Dict[str, Any]]]):
+    missing: List[str] = []
+    for batch in batches:
+        with phase('output'):
+            for record in batch:
+                print(json_dumps(record))
+                if record['type'] == 'missing':
+                    missing.append(record['name'])
+            # consumers see every finished chunk right away
+            sys.stdout.flush()
+    _report_missing(missing)
+
+
+def _print_watch(watcher: 'Watcher', json: bool):
+    try:
+        for n, diff in enumerate(watcher.watch()):
+            with phase('output'):
+                if n == 0:
+                    pkgs, files, missing = watcher.totals()
+                    _print_changes(files, [], pkgs, [], missing, [], watcher.dpkg, json)
+                else:
+                    _print_changes(*diff, watcher.dpkg, json)
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+def _print_changes(added_files: List[str], removed_files: List[str],
+                   added_pkgs: List[str], removed_pkgs: List[str],
+                   added_missing: List[str], removed_missing: List[str],
+                   dpkg: bool, json: bool):
+    if json:
+        out: Dict[str, Any] = {'files': {'added': added_files, 'removed': removed_files}}
+        if dpkg:
+            out['packages'] = {'added': added_pkgs, 'removed': removed_pkgs}
+        out['missing'] = {'added': added_missing, 'removed': removed_missing}
+        print(json_dumps(out))
+        return
+
+    for file in added_files:
+        print(f"+{file}")
+    for file in removed_files:
+        print(f"-{file}")
+    if dpkg and (added_pkgs or removed_pkgs):
+        print("...")
+        for pkg in added_pkgs:
+            print(f"+{pkg}")
+        for pkg in removed_pkgs:
+            print(f"-{pkg}")
+    for lib in added_missing:
+        print(f"Missing library: {lib}", file=sys.stderr)
+    for lib in removed_missing:
+        print(f"Found library: {lib}", file=sys.stderr)
+
+
+def _report_stats(stats: Stats, trace: Optional[str]):
+    sys.stdout.flush()
+    stats.report(sys.stderr)
+    if trace is not None:
+        stats.write_trace(trace)
+
+
+def _report_missing(missing: List[str]):
     if len(missing) > 0:
         sys.stdout.flush()
         print("\nThere were missing libraries", file=sys.stderr)
@@ -81,5 +402,45 @@ def main(libs_or_dir: List[str],
         sys.exit(1)
 
 
+def _print_per_input(results: Dict[str, Tuple[List[str], List[str], List[str]]], dpkg: bool):
+    out: Dict[str, Dict[str, List[str]]] = {}
+    missing: Set[str] = set()
+    for name, (pkgs, files, _missing) in results.items():
+        out[name] = {'files': files}
+        if dpkg:
+            out[name]['packages'] = pkgs
+        out[name]['missing'] = _missing
+        missing.update(_missing)
+
+    json_dump(out, sys.stdout, indent=2)
+    _report_missing(sorted(missing))
+
+
+def _print_graph_per_input(graph: DepGraph,
+                           roots: List[int],
+                           prefix: Optional[str],
+                           dpkg: bool,
+                           ignore_pkg: List[str],
+                           cache_dir: Optional[str]):
+    pkg_of = pkg_lookup(graph, ignore_pkg, prefix, cache_dir=cache_dir) if dpkg else None
+    _print_per_input(_per_input(graph, roots, pkg_of, prefix), dpkg)
+
+
+def _print_why(chains: Dict[str, List[LibNode]], json: bool):
+    if json:
+        json_dump({name: [{'name': n.name, 'path': n.path} for n in chain]
+                   for name, chain in chains.items()},
+                  sys.stdout, indent=2)
+    else:
+        for name, chain in sorted(chains.items()):
+            target = chain[-1]
+            print(' -> '.join([name] + [n.name for n in chain[1:]]) +
+                  ('' if target.path is None else f" ({target.path})"))
+
+    if len(chains) == 0:
+        print("No input depends on that library", file=sys.stderr)
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
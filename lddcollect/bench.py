@@ -0,0 +1,233 @@
+""" Benchmark on synthetic dependency trees.
+
+Generates trees with ``lddcollect.synth`` and times every phase of a run:
+directory scan, dependency resolution, package mapping (including loading the
+dpkg database of the tree) and output. Nothing from the host system is used,
+so results are comparable across machines.
+
+::
+
+   python -m lddcollect.bench -n 100 -n 10000 -n 100000
+   python -m lddcollect.bench --fs tar --jobs 4 --json
+   python -m lddcollect.bench --copies 2 --dedup
+"""
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from json import dump as json_dump
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import click
+
+from . import find_libs, resolve_graph, pkg_lookup, _summary
+from .dedup import find_duplicates
+from .dpkg import DpkgIndex
+from .synth import generate_tree, SynthTree, RPATH_MODES, ADMINDIR, LIB_DIR
+from .vfs import FileSystem, LOCAL_FS, open_root
+
+PHASES = ('scan', 'resolve', 'pkg', 'output')
+FS_MODES = ('local', 'dir', 'tar')
+
+
+def _timed(fn: Callable[[], Any]) -> Tuple[float, Any]:
+    t0 = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - t0, result
+
+
+def run_phases(tree: SynthTree,
+               fs: FileSystem = LOCAL_FS,
+               workers: Optional[int] = None,
+               dedup: bool = False) -> Dict[str, Any]:
+    """
+    Run all phases once with cold in-memory caches.
+
+    :param tree: Tree to process, generated with ``host_paths=True`` for the
+                 local file system, otherwise paths inside ``fs``
+
+    :param dedup: Find copies among inputs first (extra ``dedup`` phase) and
+                  parse only one file of every group
+
+    Returns:
+
+      Seconds per phase and counts of things found
+    """
+    prefix = tree.root if fs is LOCAL_FS else ''
+    times: Dict[str, float] = {}
+
+    times['scan'], libs = _timed(lambda: list(find_libs(prefix + '/usr', workers=workers, fs=fs)))
+    elf_info = None
+    if dedup:
+        times['dedup'], (groups, elf_info) = _timed(lambda: find_duplicates(tree.bins + libs, fs))
+    times['resolve'], (graph, roots) = _timed(lambda: resolve_graph(tree.bins + libs, workers=workers, fs=fs,
+                                                                    elf_info=elf_info))
+
+    def _pkgs() -> Dict[int, Optional[str]]:
+        index = None
+        if fs is LOCAL_FS:
+            index = DpkgIndex.from_admindir(tree.root + ADMINDIR, root=tree.root)
+        pkg_of = pkg_lookup(graph, index=index)
+        return {nid: pkg_of(nid) for nid in range(len(graph))}
+
+    times['pkg'], pkgs = _timed(_pkgs)
+
+    def _output() -> Tuple[List[str], List[str], List[str]]:
+        _pkgs, files, missing = _summary(graph, roots, pkgs.get, None, False)
+        out = io.StringIO()
+        for file in sorted(files):
+            print(file, file=out)
+        print("...", file=out)
+        for pkg in sorted(_pkgs):
+            print(pkg, file=out)
+        return _pkgs, files, missing
+
+    times['output'], (_pkgs, files, missing) = _timed(_output)
+
+    return {'times': times,
+            'scanned': len(libs),
+            'nodes': len(graph),
+            'listed': len(files),
+            'packages': len(_pkgs),
+            'missing': len(missing),
+            'copies': sum(len(g.paths) for g in groups) if dedup else None}
+
+
+def run(num_files: int,
+        workdir: str,
+        fs_mode: str = 'local',
+        workers: Optional[int] = None,
+        repeat: int = 3,
+        copies: int = 0,
+        dedup: bool = False,
+        **synth_args) -> Dict[str, Any]:
+    """
+    Generate a tree of about ``num_files`` files in ``workdir`` and time it,
+    best of ``repeat`` runs per phase.
+
+    :param fs_mode: ``local``, ``dir`` (``--root`` directory) or ``tar``
+                    (``--root`` tarball)
+    :param copies: Add this many copies of all library directories, they are
+                   scanned as inputs too
+    :param dedup: Time ``dedup`` phase, see ``run_phases``
+    :param synth_args: Passed on to ``lddcollect.synth.generate_tree``
+    """
+    if fs_mode not in FS_MODES:
+        raise ValueError(f"fs_mode should be one of {FS_MODES}")
+    if fs_mode == 'local' and synth_args.get('rpath') == 'none':
+        # host ld.so.conf does not know about the tree
+        raise ValueError("rpath='none' needs a root file system, use 'dir' or 'tar'")
+
+    chain = synth_args.get('symlink_chain', 1)
+    bins = max(1, num_files // 20)
+    libs = max(1, (num_files - bins) // (chain + 1))
+    root = os.path.join(workdir, f'tree-{num_files}')
+    if os.path.exists(root):
+        shutil.rmtree(root)
+
+    t0 = time.perf_counter()
+    tree = generate_tree(root, libs=libs, bins=bins, host_paths=fs_mode == 'local', **synth_args)
+    for i in range(copies):
+        shutil.copytree(root + LIB_DIR, root + f'{LIB_DIR}-copy{i}', symlinks=True)
+    fs: FileSystem = LOCAL_FS
+    if fs_mode == 'dir':
+        fs = open_root(root)
+    elif fs_mode == 'tar':
+        with tarfile.open(root + '.tar', 'w') as tar:
+            tar.add(root, arcname='.')
+        fs = open_root(root + '.tar')
+    generate = time.perf_counter() - t0
+
+    best: Dict[str, Any] = {}
+    for _ in range(max(1, repeat)):
+        result = run_phases(tree, fs, workers, dedup)
+        if best:
+            result['times'] = {k: min(v, best['times'][k]) for k, v in result['times'].items()}
+        best = result
+
+    fs.close()
+
+    best['times']['total'] = sum(best['times'][k] for k in PHASES + ('dedup',) if k in best['times'])
+    best['times']['generate'] = generate
+    best.update(files=tree.num_files, libs=len(tree.libs), fs=fs_mode)
+    return best
+
+
+def _columns(dedup: bool) -> Tuple[str, ...]:
+    return ('generate', 'scan') + ('dedup',) * dedup + PHASES[1:] + ('total',)
+
+
+def _print_header(dedup: bool):
+    print(f"{'files':>8} {'nodes':>8} {'missing':>7} " + ' '.join(f'{c:>8}' for c in _columns(dedup)))
+
+
+def _print_row(r: Dict[str, Any], dedup: bool):
+    print(f"{r['files']:>8} {r['nodes']:>8} {r['missing']:>7} " +
+          ' '.join(f"{r['times'][c]:8.3f}" for c in _columns(dedup)))
+    sys.stdout.flush()
+
+
+@click.command(name='lddcollect.bench')
+@click.option('--files', '-n', 'sizes', type=int, multiple=True,
+              help="Approximate number of files in a generated tree, can be repeated, default: 100 10000 100000")
+@click.option('--fs', 'fs_mode', type=click.Choice(FS_MODES), default='local',
+              help="Read tree from local paths, as --root directory or as --root tarball, default: local")
+@click.option('--jobs', '-j', type=int, default=1, help="Number of parallel workers, default: 1")
+@click.option('--repeat', type=int, default=3, help="Report best of this many runs, default: 3")
+@click.option('--fanout', type=int, default=3, help="DT_NEEDED entries per file, default: 3")
+@click.option('--depth', type=int, default=4, help="Layers of libraries, default: 4")
+@click.option('--rpath', type=click.Choice(RPATH_MODES), default='origin',
+              help="How libraries are located, default: origin ($ORIGIN relative DT_RUNPATH)")
+@click.option('--symlink-chain', type=int, default=1, help="Symlinks from soname to real file, default: 1")
+@click.option('--dir-size', type=int, default=1000, help="Files per library directory, default: 1000")
+@click.option('--seed', type=int, default=0, help="Random seed, default: 0")
+@click.option('--copies', type=int, default=0, help="Copies of all library directories, default: 0")
+@click.option('--dedup', is_flag=True, help="Find copies first and parse one file of every group")
+@click.option('--keep', type=click.Path(file_okay=False), help="Generate trees in this directory and keep them")
+@click.option('--json', is_flag=True, help="Output in json format")
+def main(sizes: Tuple[int, ...],
+         fs_mode: str,
+         jobs: int,
+         repeat: int,
+         fanout: int,
+         depth: int,
+         rpath: str,
+         symlink_chain: int,
+         dir_size: int,
+         seed: int,
+         copies: int,
+         dedup: bool,
+         keep: Optional[str],
+         json: bool):
+    """
+    Time directory scan, dependency resolution, package mapping and output on
+    synthetic ELF trees, times are in seconds.
+    """
+    synth_args = dict(fanout=fanout, depth=depth, rpath=rpath,
+                      symlink_chain=symlink_chain, dir_size=dir_size, seed=seed)
+    if fs_mode == 'local' and rpath == 'none':
+        raise click.UsageError("--rpath none needs --fs dir or --fs tar")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='lddcollect-bench-') as tmp:
+        workdir = tmp
+        if keep is not None:
+            os.makedirs(keep, exist_ok=True)
+            workdir = keep
+        if not json:
+            _print_header(dedup)
+        for n in sizes or (100, 10000, 100000):
+            results.append(run(n, workdir, fs_mode, workers=jobs if jobs > 1 else None,
+                               repeat=repeat, copies=copies, dedup=dedup, **synth_args))
+            if not json:
+                _print_row(results[-1], dedup)
+
+    if json:
+        json_dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
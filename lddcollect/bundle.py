@@ -0,0 +1,268 @@
+""" Copy collected files into a minimal root file system.
+
+Symlinks are recreated as symlinks, including symlinked parent directories
+(``/lib -> usr/lib``), regular files are copied in parallel using the
+cheapest mechanism available: reflink, ``copy_file_range``, ``sendfile``,
+plain copy. Files that are already up to date (same size and modification
+time) are not copied again.
+"""
+import os
+import shutil
+import stat
+import sys
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Union
+
+from .vfs import FileSystem, LOCAL_FS
+
+# ioctl to share data blocks between files (btrfs, xfs)
+FICLONE = 0x40049409
+
+_COPY_CHUNK = 1 << 30
+
+
+class BundlePlan(NamedTuple):
+    """ What to create, paths are the same inside the bundle and in the source
+        file system.
+    """
+    dirs: List[str]
+    links: Dict[str, str]   # path -> symlink target
+    files: List[str]        # regular files
+
+
+class BundleStats(NamedTuple):
+    copied: int
+    skipped: int
+    links: int
+    bytes: int
+
+
+def plan_bundle(files: Iterable[str], fs: FileSystem = LOCAL_FS) -> BundlePlan:
+    """ Work out directories, symlinks and regular files needed to reproduce
+        ``files`` with the same symlink structure as in ``fs``.
+
+        Relative paths are relative to the current directory on the host file
+        system, paths in other file systems are always absolute.
+    """
+    dirs: Set[str] = set()
+    links: Dict[str, str] = {}
+    regular: Set[str] = set()
+    if fs is LOCAL_FS:
+        todo = [os.path.abspath(f) for f in files]
+    else:
+        todo = list(files)
+
+    def add_dir(path: str) -> str:
+        """ Record directories and symlinks along ``path``, return real path """
+        current = '/'
+        for name in path.strip('/').split('/'):
+            if not name:
+                continue
+            current = os.path.join(current, name)
+            if fs.islink(current):
+                links[current] = fs.readlink(current)
+                current = add_dir(fs.realpath(current))
+            else:
+                dirs.add(current)
+        return current
+
+    while todo:
+        path = todo.pop()
+        parent = add_dir(os.path.dirname(path))
+        dst = os.path.join(parent, os.path.basename(path))
+        if dst in links or dst in regular:
+            continue
+        if fs.islink(dst):
+            links[dst] = fs.readlink(dst)
+            todo.append(os.path.normpath(os.path.join(parent, links[dst])))
+        else:
+            regular.add(dst)
+
+    return BundlePlan(sorted(dirs), links, sorted(regular))
+
+
+def _reflink(src: int, dst: int) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(dst, FICLONE, src)
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _kernel_copies() -> List[Callable[[int, int, int], int]]:
+    """ Available ways to copy ``count`` bytes between file descriptors in the
+        kernel, as ``copy(src, dst, count)``, best first
+    """
+    copies: List[Callable[[int, int, int], int]] = []
+    if hasattr(os, 'copy_file_range'):
+        copies.append(os.copy_file_range)
+    if hasattr(os, 'sendfile'):
+        copies.append(lambda src, dst, count: os.sendfile(dst, src, None, count))
+    return copies
+
+
+def _copy_fd(src: int, dst: int, size: int):
+    """ Copy file contents in the kernel where possible """
+    if _reflink(src, dst):
+        return
+
+    for copy in _kernel_copies():
+        done = 0
+        try:
+            while done < size:
+                n = copy(src, dst, min(size - done, _COPY_CHUNK))
+                if n == 0:
+                    break
+                done += n
+            return
+        except OSError:
+            # not supported for this pair of files, try the next one
+            if done:
+                raise
+
+    # fall back to a plain copy
+    with os.fdopen(os.dup(src), 'rb') as fsrc, os.fdopen(os.dup(dst), 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def _up_to_date(dst: str, st) -> bool:
+    try:
+        dst_st = os.lstat(dst)
+    except OSError:
+        return False
+    return (stat.S_ISREG(dst_st.st_mode) and
+            dst_st.st_size == st.st_size and
+            dst_st.st_mtime_ns == st.st_mtime_ns)
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def _copy_file(src: str, dst: str, fs: FileSystem, hardlink: bool) -> int:
+    """ Returns number of bytes copied, -1 if file was up to date """
+    st = fs.stat(src)
+    if _up_to_date(dst, st):
+        return -1
+
+    _remove(dst)
+    if fs is LOCAL_FS:
+        if hardlink:
+            try:
+                os.link(src, dst)
+                return 0
+            except OSError:
+                pass
+
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            _copy_fd(fsrc.fileno(), fdst.fileno(), st.st_size)
+    else:
+        with fs.open(src) as fsrc, open(dst, 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+
+    os.chmod(dst, stat.S_IMODE(st.st_mode))
+    os.utime(dst, ns=(st.st_mtime_ns, st.st_mtime_ns))
+    return st.st_size
+
+
+def bundle_dir(files: Iterable[str],
+               dest: str,
+               fs: FileSystem = LOCAL_FS,
+               workers: Optional[int] = None,
+               hardlink: bool = False) -> BundleStats:
+    """ Copy ``files`` (and symlinks they go through) into directory ``dest``.
+
+        :param fs: File system to copy from
+        :param workers: Number of threads copying files
+        :param hardlink: Hardlink instead of copying when on the same device,
+                         files in the bundle then share data with the originals
+    """
+    plan = plan_bundle(files, fs)
+    dest = os.path.abspath(dest)
+
+    for d in plan.dirs:
+        host = dest + d
+        if os.path.islink(host) or (os.path.lexists(host) and not os.path.isdir(host)):
+            os.unlink(host)
+        os.makedirs(host, exist_ok=True)
+
+    # shortest first: symlinked directories before links inside them
+    for path in sorted(plan.links, key=len):
+        host = dest + path
+        target = plan.links[path]
+        if os.path.islink(host) and os.readlink(host) == target:
+            continue
+        _remove(host)
+        os.makedirs(os.path.dirname(host), exist_ok=True)
+        os.symlink(target, host)
+
+    copied, skipped, nbytes = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=workers or min(8, (os.cpu_count() or 1) * 2)) as pool:
+        for n in pool.map(lambda path: _copy_file(path, dest + path, fs, hardlink), plan.files):
+            if n < 0:
+                skipped += 1
+            else:
+                copied += 1
+                nbytes += n
+
+    return BundleStats(copied, skipped, len(plan.links), nbytes)
+
+
+def bundle_tar(files: Iterable[str],
+               out: Union[str, BinaryIO],
+               fs: FileSystem = LOCAL_FS) -> BundleStats:
+    """ Write ``files`` (and symlinks they go through) into a tar archive.
+
+        Archive is streamed, compression is chosen from file extension
+        (``.gz``, ``.bz2``, ``.xz``), ``out`` can also be a binary file object
+        or ``-`` for stdout.
+    """
+    plan = plan_bundle(files, fs)
+
+    fileobj: Optional[BinaryIO] = None
+    name: Optional[str] = None
+    if out == '-':
+        fileobj = sys.stdout.buffer
+    elif isinstance(out, str):
+        name = out
+    else:
+        fileobj = out
+
+    compression = ''
+    if name is not None:
+        for ext, comp in (('.gz', 'gz'), ('.tgz', 'gz'), ('.bz2', 'bz2'), ('.xz', 'xz')):
+            if name.endswith(ext):
+                compression = comp
+
+    nbytes = 0
+    with tarfile.open(name=name, fileobj=fileobj, mode='w|' + compression,
+                      format=tarfile.PAX_FORMAT) as tar:
+        for d in plan.dirs:
+            info = tarfile.TarInfo(d.lstrip('/'))
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            tar.addfile(info)
+
+        for path in sorted(plan.links):
+            info = tarfile.TarInfo(path.lstrip('/'))
+            info.type = tarfile.SYMTYPE
+            info.mode = 0o777
+            info.linkname = plan.links[path]
+            tar.addfile(info)
+
+        for path in plan.files:
+            st = fs.stat(path)
+            info = tarfile.TarInfo(path.lstrip('/'))
+            info.size = st.st_size
+            info.mode = stat.S_IMODE(st.st_mode)
+            info.mtime = st.st_mtime_ns // 10**9
+            with fs.open(path) as f:
+                tar.addfile(info, f)
+            nbytes += st.st_size
+
+    return BundleStats(len(plan.files), 0, len(plan.links), nbytes)
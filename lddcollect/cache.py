@@ -0,0 +1,228 @@
+""" Persistent on-disk cache of parsed ELF files.
+
+Entries are keyed by file identity and version: (device, inode, size,
+mtime), so modified files are re-parsed and their old entries replaced.
+Entries of deleted files are removed when the cache is closed, at most once
+per ``prune_interval``.
+"""
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from .elf import ElfInfo, ElfCompat
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS elf (
+  dev INTEGER NOT NULL,
+  ino INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  path TEXT NOT NULL,
+  info TEXT NOT NULL,
+  PRIMARY KEY (dev, ino)
+);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value
+)
+"""
+
+# Seconds between automatic prunes
+PRUNE_INTERVAL = 24 * 3600
+
+_StatKey = Tuple[int, int, int, int]
+
+
+def default_cache_dir() -> str:
+    """ ``$XDG_CACHE_HOME/lddcollect``, defaults to ``~/.cache/lddcollect``
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'lddcollect')
+
+
+def stat_key(path: str) -> Optional[_StatKey]:
+    """ (dev, inode, size, mtime_ns) of a file, None if it doesn't exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _encode(info: ElfInfo) -> str:
+    return json.dumps([list(info.compat), info.interp, list(info.needed), info.rpath, info.runpath])
+
+
+def _decode(data: str) -> ElfInfo:
+    compat, interp, needed, rpath, runpath = json.loads(data)
+    return ElfInfo(ElfCompat(*compat), interp, tuple(needed), rpath, runpath)
+
+
+class ElfCache:
+    """
+    SQLite backed cache of ``read_elf_info`` results.
+
+    Can be used as ``elf_cache`` in ``lddtree``: supports ``.get(path)`` and
+    ``cache[path] = info``. Keeps count of ``hits`` and ``misses``.
+
+    :param prune_interval: ``close`` calls ``prune`` if it was last done more
+                           than this many seconds ago, None to never prune
+                           automatically
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, prune_interval: Optional[float] = PRUNE_INTERVAL):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.path = os.path.join(cache_dir, f'elf-v{_SCHEMA_VERSION}.sqlite')
+        self.prune_interval = prune_interval
+        self.hits = 0
+        self.misses = 0
+        # Entries already looked up in this run
+        self._mem: Dict[str, ElfInfo] = {}
+        self._pending = 0
+
+        # not needed unless a cache is used
+        import sqlite3
+        self._db = sqlite3.connect(self.path, timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def get(self, path: str, default: Optional[ElfInfo] = None) -> Optional[ElfInfo]:
+        info = self._mem.get(path)
+        if info is not None:
+            return info
+
+        key = stat_key(path)
+        row = None
+        if key is not None:
+            row = self._db.execute('SELECT size, mtime_ns, info FROM elf WHERE dev=? AND ino=?',
+                                   key[:2]).fetchone()
+
+        if row is None or (row[0], row[1]) != key[2:]:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        info = _decode(row[2])
+        self._mem[path] = info
+        return info
+
+    def __setitem__(self, path: str, info: ElfInfo):
+        self._mem[path] = info
+        key = stat_key(path)
+        if key is None:
+            return
+
+        # replaces stale entry for the same file if any
+        self._db.execute('INSERT OR REPLACE INTO elf (dev, ino, size, mtime_ns, path, info) VALUES (?,?,?,?,?,?)',
+                         key + (path, _encode(info)))
+        self._pending += 1
+        if self._pending >= 1000:
+            self.flush()
+
+    def __contains__(self, path: str) -> bool:
+        return self.get(path) is not None
+
+    def forget(self, path: Optional[str] = None):
+        """ Drop in-memory entry for ``path`` (or all of them), so that next
+            lookup is checked against the file on disk again.
+        """
+        if path is None:
+            self._mem.clear()
+        else:
+            self._mem.pop(path, None)
+
+    def flush(self):
+        """ Commit pending writes to disk
+        """
+        if self._pending:
+            self._db.commit()
+            self._pending = 0
+
+    def prune(self) -> int:
+        """ Remove entries for files that no longer exist or have changed.
+
+            Returns number of removed entries.
+        """
+        self.flush()
+        stale = [(dev, ino)
+                 for dev, ino, size, mtime_ns, path in self._db.execute(
+                         'SELECT dev, ino, size, mtime_ns, path FROM elf')
+                 if stat_key(path) != (dev, ino, size, mtime_ns)]
+        self._db.executemany('DELETE FROM elf WHERE dev=? AND ino=?', stale)
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pruned', ?)", (time.time(),))
+        self._db.commit()
+        return len(stale)
+
+    def _prune_due(self) -> bool:
+        if self.prune_interval is None:
+            return False
+        row = self._db.execute("SELECT value FROM meta WHERE key='pruned'").fetchone()
+        return row is None or time.time() - row[0] >= self.prune_interval
+
+    def close(self):
+        self.flush()
+        if self._prune_due():
+            self.prune()
+        self._db.close()
+
+    def __enter__(self) -> 'ElfCache':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StatElfCache:
+    """
+    In-memory cache of ``read_elf_info`` results for long running processes.
+
+    Every lookup is checked against current (device, inode, size, mtime) of
+    the file, so rebuilt files are parsed again. Misses are looked up in
+    ``backing`` persistent cache if supplied.
+    """
+
+    def __init__(self, backing: Optional[ElfCache] = None):
+        self.backing = backing
+        self._mem: Dict[str, Tuple[Optional[_StatKey], ElfInfo]] = {}
+
+    def get(self, path: str, default: Optional[ElfInfo] = None) -> Optional[ElfInfo]:
+        key = stat_key(path)
+        entry = self._mem.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        if self.backing is not None:
+            self.backing.forget(path)
+            info = self.backing.get(path)
+            if info is not None:
+                self._mem[path] = (key, info)
+                return info
+        return default
+
+    def __setitem__(self, path: str, info: ElfInfo):
+        self._mem[path] = (stat_key(path), info)
+        if self.backing is not None:
+            self.backing[path] = info
+
+    def __len__(self) -> int:
+        return len(self._mem)
+
+    def clear(self):
+        self._mem.clear()
+
+    def flush(self):
+        if self.backing is not None:
+            self.backing.flush()
+
+    def close(self):
+        if self.backing is not None:
+            self.backing.close()
@@ -0,0 +1,203 @@
+""" Find copies of the same ELF file among inputs.
+
+Python environments and vendored SDKs often ship many identical copies of a
+library in different directories. Files are grouped by size first, files of
+the same size are then compared by a hash of their first page (ELF and
+program headers, normally also the GNU build-id note), of the dynamic
+section and of the dynamic string table (needed libraries, rpath). One file
+of every group is parsed and the result is used for all copies, see
+``elf_info`` parameter of ``process_elf``.
+
+Hashing reads about as many bytes as parsing, a file is read once either way.
+What copies save is parsing and, with ``--cache-dir``, cache entries; time
+both with ``python -m lddcollect.bench --dedup --copies N``.
+
+Copies can still resolve to different libraries (``$ORIGIN`` in rpath), only
+parsing is shared.
+"""
+import hashlib
+import struct
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, TextIO, Tuple
+
+from .elf import (_FORMATS, DT_NULL, DT_STRSZ, DT_STRTAB, ElfInfo, ElfParseError, PN_XNUM, PT_DYNAMIC,
+                  PT_INTERP, PT_LOAD, parse_compat, read_elf_info)
+from .stats import count
+from .vfs import FileSystem, LOCAL_FS
+
+_PAGE = 4096
+
+
+class DupGroup(NamedTuple):
+    """ Copies of the same file, paths are real paths (no symlinks).
+    """
+    size: int
+    paths: List[str]
+
+    @property
+    def wasted(self) -> int:
+        """ Bytes taken by all but one copy """
+        return self.size * (len(self.paths) - 1)
+
+
+def elf_fingerprint(path: str, fs: FileSystem = LOCAL_FS) -> Optional[bytes]:
+    """ Hash of the first page, program interpreter, dynamic section and
+        dynamic string table of an ELF file, everything ``read_elf_info``
+        looks at. Parts within the first page are not read again, small
+        libraries take a single read.
+
+        Returns None if file can not be read or is not an ELF file.
+    """
+    count('dedup_hash')
+
+    def read(f, offset: int, size: int) -> bytes:
+        if offset + size <= len(head):
+            # already hashed with the first page
+            return b''
+        f.seek(offset)
+        data = f.read(size)
+        count('bytes_read', len(data))
+        return data
+
+    try:
+        with fs.open(path) as f:
+            head = f.read(_PAGE)
+            count('bytes_read', len(head))
+            compat = parse_compat(head)
+            if compat is None:
+                return None
+
+            h = hashlib.blake2b(head, digest_size=16)
+            bo, ehdr_fmt, phdr_fmt, dyn_fmt = _FORMATS[(compat.elfclass, compat.little_endian)]
+            ehdr = struct.unpack_from(bo + ehdr_fmt, head, 16)
+            e_phoff, e_phentsize, e_phnum = ehdr[4], ehdr[8], ehdr[9]
+            phdr_fmt = bo + phdr_fmt
+            if e_phnum == PN_XNUM or (e_phnum > 0 and e_phentsize < struct.calcsize(phdr_fmt)):
+                return None
+
+            phdrs = head[e_phoff:e_phoff + e_phentsize * e_phnum]
+            if len(phdrs) != e_phentsize * e_phnum:
+                phdrs = read(f, e_phoff, e_phentsize * e_phnum)
+                h.update(phdrs)
+
+            # (p_type, p_offset, p_vaddr, p_filesz)
+            segments: List[Tuple[int, int, int, int]] = []
+            for i in range(e_phnum):
+                ph = struct.unpack_from(phdr_fmt, phdrs, i * e_phentsize)
+                if compat.elfclass == 64:
+                    segments.append((ph[0], ph[2], ph[3], ph[5]))
+                else:
+                    segments.append((ph[0], ph[1], ph[2], ph[4]))
+
+            for p_type, p_offset, _, p_filesz in segments:
+                if p_type == PT_INTERP:
+                    h.update(read(f, p_offset, p_filesz))
+
+            dynamic = next((s for s in segments if s[0] == PT_DYNAMIC), None)
+            if dynamic is not None:
+                dyn = head[dynamic[1]:dynamic[1] + dynamic[3]]
+                if len(dyn) != dynamic[3]:
+                    dyn = read(f, dynamic[1], dynamic[3])
+                    h.update(dyn)
+
+                dyn_fmt = bo + dyn_fmt
+                dyn_sz = struct.calcsize(dyn_fmt)
+                strtab, strsz = None, None
+                for d_tag, d_val in struct.iter_unpack(dyn_fmt, dyn[:len(dyn) - len(dyn) % dyn_sz]):
+                    if d_tag == DT_NULL:
+                        break
+                    if d_tag == DT_STRTAB:
+                        strtab = d_val
+                    elif d_tag == DT_STRSZ:
+                        strsz = d_val
+
+                # needed libraries and search paths are in the string table,
+                # often beyond the first page
+                for p_type, p_offset, p_vaddr, p_filesz in segments:
+                    if strtab is not None and p_type == PT_LOAD and p_vaddr <= strtab < p_vaddr + p_filesz:
+                        if strsz is None:
+                            strsz = p_vaddr + p_filesz - strtab
+                        h.update(read(f, strtab - p_vaddr + p_offset, strsz))
+                        break
+    except (OSError, struct.error):
+        return None
+
+    return h.digest()
+
+
+def find_duplicates(fnames: Iterable[str],
+                    fs: FileSystem = LOCAL_FS) -> Tuple[List[DupGroup], Dict[str, ElfInfo]]:
+    """
+    Group copies of the same ELF file and parse one file of every group.
+
+    Symlinks to the same file and hardlinks are not copies. Only files that
+    have the same size as some other input are hashed.
+
+    :param fnames: ELF files, usually ``find_libs`` output
+
+    :param fs: File system to read, see ``lddcollect.vfs``
+
+    Returns:
+
+      Groups of two or more copies (most wasted bytes first) and parsed ELF
+      info for every path in these groups, including input paths that are
+      symlinks to them.
+    """
+    names: Dict[str, List[str]] = {}        # real path -> input paths
+    by_size: Dict[int, List[str]] = {}
+    inodes: Set[Tuple[int, int]] = set()
+
+    for fname in fnames:
+        real = fs.realpath(fname)
+        if real in names:
+            names[real].append(fname)
+            continue
+        names[real] = [fname]
+
+        try:
+            st = fs.stat(real)
+        except OSError:
+            continue
+        ino = getattr(st, 'st_ino', None)
+        if ino is not None:
+            if (st.st_dev, ino) in inodes:
+                continue
+            inodes.add((st.st_dev, ino))
+        by_size.setdefault(st.st_size, []).append(real)
+
+    groups: List[DupGroup] = []
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        by_hash: Dict[bytes, List[str]] = {}
+        for path in paths:
+            digest = elf_fingerprint(path, fs)
+            if digest is not None:
+                by_hash.setdefault(digest, []).append(path)
+        groups.extend(DupGroup(size, copies) for copies in by_hash.values() if len(copies) > 1)
+
+    elf_info: Dict[str, ElfInfo] = {}
+    parsed: List[DupGroup] = []
+    for group in groups:
+        try:
+            info = read_elf_info(group.paths[0], None if fs is LOCAL_FS else fs.open)
+        except (OSError, ElfParseError):
+            continue
+        parsed.append(group)
+        for real in group.paths:
+            elf_info[real] = info
+            for fname in names[real]:
+                elf_info[fname] = info
+
+    parsed.sort(key=lambda g: (-g.wasted, g.paths[0]))
+    return parsed, elf_info
+
+
+def report(groups: List[DupGroup], out: TextIO):
+    """ Print groups of copies and bytes they waste """
+    wasted = sum(g.wasted for g in groups)
+    copies = sum(len(g.paths) for g in groups)
+    print(f"Duplicates: {len(groups)} groups, {copies} files, {wasted} bytes wasted", file=out)
+    for group in groups:
+        print(f"  {group.wasted:>12} {group.size} x {len(group.paths)}", file=out)
+        for path in group.paths:
+            print(f"      {path}", file=out)
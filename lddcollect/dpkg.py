@@ -0,0 +1,308 @@
+""" Lookup of Debian packages owning files.
+
+Reads dpkg database directly (``/var/lib/dpkg/info/*.list`` and
+``/var/lib/dpkg/diversions``) building path to package index once, falls back
+to calling ``dpkg -S`` when database can not be read.
+"""
+import io
+import os
+import pickle
+import subprocess
+from typing import List, Tuple, Dict, Optional, Iterable
+
+from .stats import count
+from .vfs import FileSystem, LOCAL_FS
+
+DPKG_ADMINDIR = '/var/lib/dpkg'
+
+# Directories that are symlinks into /usr on "merged /usr" systems
+_USR_MERGED_DIRS = ('bin', 'sbin', 'lib', 'lib32', 'lib64', 'libx32')
+
+# Command line length is limited, split long argument lists into chunks
+_DPKG_S_CHUNK = 1000
+
+_SNAPSHOT_VERSION = 2
+
+
+def dpkg_s(*args: str) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """ Call `dpkg -S {arg}` and parse output into a list of tuples:
+
+        [(pkg-name, full-path)]
+
+        Returns
+        =======
+        [(pkg, path),...], [not-found-inputs]
+    """
+    def parse_line(line: str) -> Tuple[str, str]:
+        idx = line.find(': ')
+        if idx < 0:
+            raise ValueError('Unexpected output from dpkg')
+        deb, path = line[:idx], line[idx + 2:]
+        return (deb, path)
+
+    parsed: List[Tuple[str, str]] = []
+    missing: List[str] = []
+
+    for i in range(0, max(len(args), 1), _DPKG_S_CHUNK):
+        chunk = args[i:i + _DPKG_S_CHUNK]
+        count('dpkg_query')
+        count('dpkg_lookup', len(chunk))
+        proc = subprocess.Popen(['/usr/bin/dpkg', '-S', *chunk],
+                                stderr=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+        stdout, _ = proc.communicate()
+        lines = stdout.decode('utf8').split('\n')
+        _parsed = [parse_line(line) for line in lines if line]
+        parsed.extend(_parsed)
+
+        if proc.returncode != 0:
+            found = set(path for _, path in _parsed)
+            for arg in chunk:
+                if arg.startswith('/') or arg.startswith('./'):
+                    if arg not in found:
+                        missing.append(arg)
+                else:
+                    if not any(arg in path for path in found):
+                        missing.append(arg)
+
+    return parsed, missing
+
+
+def _stamp(admindir: str) -> Tuple[int, int]:
+    """ Modification time of dpkg database, changes whenever packages are
+        installed or removed.
+    """
+    def mtime(path: str) -> int:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    return (os.stat(os.path.join(admindir, 'info')).st_mtime_ns,
+            mtime(os.path.join(admindir, 'diversions')))
+
+
+def _open_text(path: str, fs: FileSystem) -> io.TextIOWrapper:
+    return io.TextIOWrapper(fs.open(path), encoding='utf8', errors='surrogateescape')
+
+
+def _read_lists(infodir: str, fs: FileSystem = LOCAL_FS) -> Dict[str, str]:
+    owners: Dict[str, str] = {}
+    nbytes = 0  # characters, close enough to bytes for file lists
+
+    for name, _ in fs.listdir(infodir):
+        if not name.endswith('.list'):
+            continue
+        pkg = name[:-5]
+        with _open_text(os.path.join(infodir, name), fs) as f:
+            for line in f:
+                nbytes += len(line)
+                path = line.rstrip('\n')
+                if path == '/.' or not path:
+                    continue
+                other = owners.get(path)
+                if other is None:
+                    owners[path] = pkg
+                elif pkg not in other.split(', '):
+                    # Directories (and some files) are shared across packages
+                    owners[path] = other + ', ' + pkg
+
+    # Lists do not say what is a directory, but every directory listed there
+    # is also the parent of something listed, drop these: /usr is not a file
+    # of every package
+    for parent in {os.path.dirname(path) for path in owners}:
+        owners.pop(parent, None)
+
+    count('bytes_read', nbytes)
+    return owners
+
+
+def _read_diversions(fname: str, fs: FileSystem = LOCAL_FS) -> List[Tuple[str, str, str]]:
+    """ Diversions file is a sequence of line triplets: from, to, diverted-by
+    """
+    try:
+        with _open_text(fname, fs) as f:
+            lines = f.read().split('\n')
+    except FileNotFoundError:
+        return []
+
+    return [(lines[i], lines[i + 1], lines[i + 2])
+            for i in range(0, len(lines) - 2, 3)]
+
+
+def _apply_diversions(owners: Dict[str, str],
+                      diversions: Iterable[Tuple[str, str, str]]):
+    for src, dst, by in diversions:
+        src_owners = owners.get(src)
+        if src_owners is not None:
+            orig = [pkg for pkg in src_owners.split(', ') if pkg != by]
+            if orig:
+                # original file was moved to a new location
+                owners[dst] = ', '.join(orig)
+
+        if by == ':':
+            # local diversion, file in the original location is not managed
+            owners.pop(src, None)
+        else:
+            owners[src] = by
+
+
+def _usr_merged_dirs(root: str, fs: FileSystem = LOCAL_FS) -> Tuple[str, ...]:
+    root = root.rstrip('/')
+
+    def is_merged(d: str) -> bool:
+        path = root + '/' + d
+        return (fs.islink(path) and
+                fs.realpath(path) == fs.realpath(root + '/usr/' + d))
+
+    return tuple(d for d in _USR_MERGED_DIRS if is_merged(d))
+
+
+class DpkgIndex:
+    """
+    Mapping from file path to Debian package name(s) that own that file.
+
+    Package names are reported the same way ``dpkg -S`` does: ``pkg[:arch]``,
+    multiple owners are separated by ``", "``.
+    """
+
+    def __init__(self,
+                 owners: Dict[str, str],
+                 aliased: Tuple[str, ...] = (),
+                 stamp: Optional[Tuple[int, int]] = None):
+        self._owners = owners
+        self._aliased = tuple('/' + d + '/' for d in aliased)
+        self.stamp = stamp
+
+    @staticmethod
+    def from_admindir(admindir: str = DPKG_ADMINDIR,
+                      root: str = '/',
+                      fs: FileSystem = LOCAL_FS) -> 'DpkgIndex':
+        """ Parse dpkg database.
+
+        :param admindir: dpkg database location
+        :param root: Filesystem root used to detect /lib -> /usr/lib aliasing
+        :param fs: File system to read, database of an image is not stamped
+        """
+        stamp = _stamp(admindir) if fs is LOCAL_FS else None
+        owners = _read_lists(os.path.join(admindir, 'info'), fs)
+        _apply_diversions(owners, _read_diversions(os.path.join(admindir, 'diversions'), fs))
+        return DpkgIndex(owners, _usr_merged_dirs(root, fs), stamp)
+
+    @staticmethod
+    def load(admindir: str = DPKG_ADMINDIR,
+             cache_file: Optional[str] = None,
+             root: str = '/') -> 'DpkgIndex':
+        """ Load index, possibly from on-disk snapshot.
+
+        :param admindir: dpkg database location
+        :param cache_file: Snapshot file to re-use/update, snapshot is ignored
+                           when dpkg database was modified after it was created
+        :param root: Filesystem root used to detect /lib -> /usr/lib aliasing
+        """
+        if cache_file is None:
+            return DpkgIndex.from_admindir(admindir, root)
+
+        stamp = _stamp(admindir)
+        key = (_SNAPSHOT_VERSION, os.path.abspath(admindir), stamp)
+        try:
+            with open(cache_file, 'rb') as f:
+                snapshot_key, owners, aliased = pickle.load(f)
+            if snapshot_key == key:
+                return DpkgIndex(owners, aliased, stamp)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+        idx = DpkgIndex.from_admindir(admindir, root)
+        idx.save(cache_file, admindir)
+        return idx
+
+    def save(self, cache_file: str, admindir: str = DPKG_ADMINDIR):
+        """ Write snapshot to disk (atomically).
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        aliased = tuple(d.strip('/') for d in self._aliased)
+        key = (_SNAPSHOT_VERSION, os.path.abspath(admindir), self.stamp)
+        tmp = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump((key, self._owners, aliased), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def lookup(self, path: str) -> Optional[str]:
+        """ Package owning ``path`` or None
+        """
+        count('dpkg_lookup')
+        pkg = self._owners.get(path)
+        if pkg is not None or not self._aliased:
+            return pkg
+
+        # /lib/x vs /usr/lib/x on "merged /usr" systems
+        if path.startswith('/usr/'):
+            alt = path[4:]
+            if alt.startswith(self._aliased):
+                return self._owners.get(alt)
+        elif path.startswith(self._aliased):
+            return self._owners.get('/usr' + path)
+
+        return None
+
+    def search(self, paths: Iterable[str]) -> Tuple[List[Tuple[str, str]], List[str]]:
+        """ Same output as ``dpkg_s`` but without calling ``dpkg``.
+
+            Returns
+            =======
+            [(pkg, path),...], [not-found-inputs]
+        """
+        found: List[Tuple[str, str]] = []
+        missing: List[str] = []
+        for path in paths:
+            pkg = self.lookup(path)
+            if pkg is None:
+                missing.append(path)
+            else:
+                found.append((pkg, path))
+        return found, missing
+
+
+_index_cache: Dict[Tuple[str, Optional[str]], DpkgIndex] = {}
+
+
+def dpkg_index(admindir: str = DPKG_ADMINDIR,
+               cache_file: Optional[str] = None) -> Optional[DpkgIndex]:
+    """ Get index for dpkg database, re-using previously loaded one unless
+        database was modified since. Returns None if database can not be read.
+    """
+    key = (admindir, cache_file)
+    idx = _index_cache.get(key)
+    try:
+        if idx is not None and idx.stamp == _stamp(admindir):
+            return idx
+        idx = DpkgIndex.load(admindir, cache_file)
+    except OSError:
+        return None
+
+    _index_cache[key] = idx
+    return idx
+
+
+def dpkg_search(paths: List[str],
+                index: Optional[DpkgIndex] = None) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """ Find packages owning supplied absolute paths.
+
+        Uses dpkg database index, falls back to ``dpkg -S`` when database can
+        not be read directly.
+
+        Returns
+        =======
+        [(pkg, path),...], [not-found-inputs]
+    """
+    if index is None:
+        index = dpkg_index()
+    if index is not None:
+        return index.search(paths)
+    if len(paths) == 0:
+        return [], []
+    return dpkg_s(*paths)
@@ -0,0 +1,342 @@
+""" Minimal ELF parsing without pyelftools.
+
+Only reads what is needed for dependency resolution: header fields used for
+compatibility checks, PT_INTERP and DT_NEEDED/DT_RPATH/DT_RUNPATH entries of
+the dynamic section. pyelftools is used as a fallback for files this module
+can not handle.
+"""
+import mmap
+import os
+import struct
+from typing import BinaryIO, NamedTuple, Optional, Tuple, Callable, List
+
+from .stats import count
+
+ELF_MAGIC = b'\x7fELF'
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+ET_EXEC = 2
+ET_DYN = 3
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+PN_XNUM = 0xffff
+
+# byte order, ELF header (after e_ident), program header, dynamic entry
+_FORMATS = {
+    (32, True): ('<', 'HHIIIIIHHHHHH', 'IIIIIIII', 'iI'),
+    (32, False): ('>', 'HHIIIIIHHHHHH', 'IIIIIIII', 'iI'),
+    (64, True): ('<', 'HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ'),
+    (64, False): ('>', 'HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ'),
+}
+
+Opener = Callable[[str], BinaryIO]
+
+# EI_OSABI values that are interchangeable: NONE/SYSV and GNU/LINUX
+_OSABI_COMPAT = frozenset([0, 3])
+
+
+class ElfParseError(ValueError):
+    """ File is not an ELF file or is malformed.
+    """
+
+
+class ElfCompat(NamedTuple):
+    """ Aspects of an ELF file that need to match for one to load another.
+    """
+    elfclass: int        # 32 or 64
+    little_endian: bool
+    machine: int         # e_machine
+    osabi: int           # e_ident[EI_OSABI]
+
+
+def parse_compat(hdr: bytes) -> Optional[ElfCompat]:
+    """ Extract compatibility info from the first 20 bytes of the file.
+
+        Returns None if this is not an ELF file.
+    """
+    if len(hdr) < 20 or hdr[:4] != ELF_MAGIC:
+        return None
+    ei_class, ei_data, osabi = hdr[4], hdr[5], hdr[7]
+    if ei_class not in (ELFCLASS32, ELFCLASS64) or ei_data not in (ELFDATA2LSB, ELFDATA2MSB):
+        return None
+    little_endian = ei_data == ELFDATA2LSB
+    machine, = struct.unpack_from('<H' if little_endian else '>H', hdr, 18)
+    return ElfCompat(32 if ei_class == ELFCLASS32 else 64, little_endian, machine, osabi)
+
+
+def _open(path: str) -> BinaryIO:
+    count('open')
+    return open(path, 'rb')
+
+
+def read_compat(path: str, opener: Opener = _open) -> Optional[ElfCompat]:
+    """ Read compatibility info from file on disk.
+
+        :param opener: Function to open ``path`` for binary reading
+
+        Returns None if file is missing or is not an ELF file.
+    """
+    try:
+        with opener(path) as f:
+            hdr = f.read(20)
+    except OSError:
+        return None
+    count('bytes_read', len(hdr))
+    return parse_compat(hdr)
+
+
+def compatible(a: ElfCompat, b: ElfCompat) -> bool:
+    """ See if two ELFs are compatible: bit size, endianness, machine type,
+        and operating system.
+    """
+    return (a.elfclass == b.elfclass and
+            a.little_endian == b.little_endian and
+            a.machine == b.machine and
+            (a.osabi == b.osabi or (a.osabi in _OSABI_COMPAT and b.osabi in _OSABI_COMPAT)))
+
+
+def parse_elf_type(hdr: bytes) -> Optional[int]:
+    """ Extract ``e_type`` from the start of the file, None if not an ELF file.
+    """
+    if len(hdr) < 20 or hdr[:4] != ELF_MAGIC or hdr[5] not in (ELFDATA2LSB, ELFDATA2MSB):
+        return None
+    e_type, = struct.unpack_from('<H' if hdr[5] == ELFDATA2LSB else '>H', hdr, 16)
+    return e_type
+
+
+def read_elf_type(path: str, opener: Opener = _open) -> Optional[int]:
+    """ Read ``e_type`` from the ELF header (first 64 bytes only).
+
+        Returns None if file can not be read or is not an ELF file.
+    """
+    count('elf_sniff')
+    try:
+        with opener(path) as f:
+            hdr = f.read(64)
+    except OSError:
+        return None
+    count('bytes_read', len(hdr))
+    return parse_elf_type(hdr)
+
+
+class ElfInfo(NamedTuple):
+    """ Dynamic linking information of an ELF file.
+
+        ``rpath`` and ``runpath`` are raw strings as stored in the file (not
+        split, ``$ORIGIN`` not expanded), None when not present.
+    """
+    compat: ElfCompat
+    interp: Optional[str]
+    needed: Tuple[str, ...]
+    rpath: Optional[str]
+    runpath: Optional[str]
+
+
+def _decode(b: bytes) -> str:
+    return b.decode('utf8', errors='surrogateescape')
+
+
+def parse_elf_info(read: Callable[[int, int], bytes]) -> ElfInfo:
+    """ Parse ELF file given a function to read byte ranges from it.
+
+        :param read: ``read(offset, size) -> bytes``, can return fewer bytes
+                     at the end of file
+
+        Raises ElfParseError if file is not an ELF or is malformed.
+    """
+    def read_exact(offset: int, size: int) -> bytes:
+        data = read(offset, size)
+        if len(data) != size:
+            raise ElfParseError('Truncated ELF file')
+        return data
+
+    ident = read(0, 64)
+    compat = parse_compat(ident)
+    if compat is None:
+        raise ElfParseError('Not an ELF file')
+
+    bo, ehdr_fmt, phdr_fmt, dyn_fmt = _FORMATS[(compat.elfclass, compat.little_endian)]
+    ehdr = struct.unpack_from(bo + ehdr_fmt, ident, 16)
+    e_phoff, e_phentsize, e_phnum = ehdr[4], ehdr[8], ehdr[9]
+    if e_phnum == PN_XNUM:
+        raise ElfParseError('Extended program header numbering is not supported')
+
+    phdr_fmt = bo + phdr_fmt
+    if e_phnum > 0 and e_phentsize < struct.calcsize(phdr_fmt):
+        raise ElfParseError('Bad e_phentsize')
+    phdrs = read_exact(e_phoff, e_phentsize * e_phnum)
+
+    # (p_type, p_offset, p_vaddr, p_filesz)
+    segments: List[Tuple[int, int, int, int]] = []
+    for i in range(e_phnum):
+        ph = struct.unpack_from(phdr_fmt, phdrs, i * e_phentsize)
+        if compat.elfclass == 64:
+            p_type, p_offset, p_vaddr, p_filesz = ph[0], ph[2], ph[3], ph[5]
+        else:
+            p_type, p_offset, p_vaddr, p_filesz = ph[0], ph[1], ph[2], ph[4]
+        segments.append((p_type, p_offset, p_vaddr, p_filesz))
+
+    interp = None
+    for p_type, p_offset, _, p_filesz in segments:
+        if p_type == PT_INTERP:
+            interp = _decode(read_exact(p_offset, p_filesz).split(b'\0', 1)[0])
+            break
+
+    dynamic = next((s for s in segments if s[0] == PT_DYNAMIC), None)
+    if dynamic is None:
+        return ElfInfo(compat, interp, (), None, None)
+
+    dyn_fmt = bo + dyn_fmt
+    dyn_sz = struct.calcsize(dyn_fmt)
+    _, p_offset, _, p_filesz = dynamic
+    dyn_data = read_exact(p_offset, p_filesz - p_filesz % dyn_sz)
+
+    tags: List[Tuple[int, int]] = []
+    strtab, strsz = None, None
+    for d_tag, d_val in struct.iter_unpack(dyn_fmt, dyn_data):
+        if d_tag == DT_NULL:
+            break
+        if d_tag == DT_STRTAB:
+            strtab = d_val
+        elif d_tag == DT_STRSZ:
+            strsz = d_val
+        elif d_tag in (DT_NEEDED, DT_RPATH, DT_RUNPATH):
+            tags.append((d_tag, d_val))
+
+    if not tags:
+        return ElfInfo(compat, interp, (), None, None)
+    if strtab is None:
+        raise ElfParseError('Dynamic section has no DT_STRTAB')
+
+    # DT_STRTAB is a virtual address, translate to file offset
+    strtab_offset = None
+    for p_type, p_offset, p_vaddr, p_filesz in segments:
+        if p_type == PT_LOAD and p_vaddr <= strtab < p_vaddr + p_filesz:
+            strtab_offset = strtab - p_vaddr + p_offset
+            if strsz is None:
+                strsz = p_vaddr + p_filesz - strtab
+            break
+    if strtab_offset is None or strsz is None:
+        raise ElfParseError('DT_STRTAB is not in a loadable segment')
+
+    strings = read_exact(strtab_offset, strsz)
+
+    def get_str(offset: int) -> str:
+        end = strings.find(b'\0', offset)
+        if offset >= len(strings) or end < 0:
+            raise ElfParseError('Bad string table offset')
+        return _decode(strings[offset:end])
+
+    needed: List[str] = []
+    rpath, runpath = None, None
+    for d_tag, d_val in tags:
+        if d_tag == DT_NEEDED:
+            needed.append(get_str(d_val))
+        elif d_tag == DT_RPATH:
+            rpath = get_str(d_val)
+        else:
+            runpath = get_str(d_val)
+
+    return ElfInfo(compat, interp, tuple(needed), rpath, runpath)
+
+
+def _read_elf_info_elftools(path: str, opener: Opener = _open) -> ElfInfo:
+    from elftools.elf.elffile import ELFFile  # type: ignore
+    from elftools.common.exceptions import ELFError  # type: ignore
+
+    try:
+        with opener(path) as f:
+            compat = parse_compat(f.read(20))
+            if compat is None:
+                raise ElfParseError('Not an ELF file')
+            f.seek(0)
+            elf = ELFFile(f)
+
+            interp = None
+            needed: List[str] = []
+            rpath, runpath = None, None
+            for segment in elf.iter_segments():
+                p_type = segment.header.p_type
+                if p_type == 'PT_INTERP' and interp is None:
+                    interp = segment.get_interp_name()
+                elif p_type == 'PT_DYNAMIC':
+                    for t in segment.iter_tags():
+                        if t.entry.d_tag == 'DT_RPATH':
+                            rpath = t.rpath
+                        elif t.entry.d_tag == 'DT_RUNPATH':
+                            runpath = t.runpath
+                        elif t.entry.d_tag == 'DT_NEEDED':
+                            needed.append(t.needed)
+                    break
+    except ELFError as e:
+        raise ElfParseError(str(e)) from e
+
+    return ElfInfo(compat, interp, tuple(needed), rpath, runpath)
+
+
+def read_elf_info(path: str, opener: Optional[Opener] = None) -> ElfInfo:
+    """ Read dynamic linking information from an ELF file.
+
+        File is memory mapped and only the relevant parts are parsed, falls back
+        to pyelftools for files that can not be parsed that way.
+
+        :param opener: Function to open ``path`` for binary reading, file is
+                       then accessed with seek/read instead of mmap
+
+        Raises ElfParseError if file is not an ELF or is malformed, OSError if
+        file can not be read.
+    """
+    count('elf_parse')
+    if opener is not None:
+        return _read_elf_info_stream(path, opener)
+
+    count('open')
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 64:
+            raise ElfParseError('Not an ELF file')
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            def read_mm(offset: int, n: int) -> bytes:
+                data = mm[offset:offset + n]
+                count('bytes_read', len(data))
+                return data
+
+            try:
+                return parse_elf_info(read_mm)
+            except (ElfParseError, struct.error):
+                if parse_compat(mm[:20]) is None:
+                    raise ElfParseError('Not an ELF file') from None
+
+    return _read_elf_info_elftools(path)
+
+
+def _read_elf_info_stream(path: str, opener: Opener) -> ElfInfo:
+    with opener(path) as f:
+        def read(offset: int, n: int) -> bytes:
+            f.seek(offset)
+            data = f.read(n)
+            count('bytes_read', len(data))
+            return data
+
+        try:
+            return parse_elf_info(read)
+        except (ElfParseError, struct.error):
+            if parse_compat(read(0, 20)) is None:
+                raise ElfParseError('Not an ELF file') from None
+
+    return _read_elf_info_elftools(path, opener)
@@ -0,0 +1,434 @@
+""" Compact dependency graph.
+
+Nodes are numbered, strings are interned and edges are kept in integer
+arrays, so that large graphs (tens of thousands of libraries) stay small and
+can be traversed quickly.
+"""
+import re
+import sys
+import warnings
+from array import array
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .vendor.lddtree import FsCache, link_chain
+from .vfs import FileSystem, LOCAL_FS
+
+# Node key: (soname, search path used to find it), inputs use INPUT in place
+# of search path
+NodeKey = Tuple[str, Tuple[str, ...]]
+INPUT: Tuple[str, ...] = ('',)
+
+# Per input: interpreter, rpath, runpath and ids of libraries in lddtree order
+_TreeInfo = Tuple[Optional[str], Tuple[str, ...], Tuple[str, ...], array]
+
+
+_NONZERO_BYTE = re.compile(b'[^\x00]')
+
+
+def _intern(s: Optional[str]) -> Optional[str]:
+    return None if s is None else sys.intern(s)
+
+
+def _bits(mask: int) -> Iterator[int]:
+    """ Indexes of set bits, in increasing order
+    """
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    for m in _NONZERO_BYTE.finditer(data):
+        i, byte = m.start() * 8, data[m.start()]
+        for j in range(8):
+            if byte & (1 << j):
+                yield i + j
+
+
+def lib_paths(path: Optional[str],
+              realpath: Optional[str],
+              fs: FileSystem = LOCAL_FS,
+              cache: Optional[FsCache] = None) -> Iterator[str]:
+    """ yield all symlinks starting from path->realpath
+        Produces Empty sequence if path is None
+    """
+    if path == realpath:
+        if path is not None:
+            yield path
+    else:
+        assert path is not None
+        last = ""
+        for last in link_chain(path, fs=fs, cache=cache):
+            yield last
+
+        if last != realpath:
+            warnings.warn(f"Symlink didn't go to expected place: {last} != {realpath}")
+
+
+class LibNode:
+    """ Library or input file in the dependency graph. ``path`` is None for
+        libraries that were not found.
+    """
+    __slots__ = ('name', 'ldpaths', 'path', 'realpath')
+
+    def __init__(self,
+                 name: str,
+                 ldpaths: Tuple[str, ...],
+                 path: Optional[str],
+                 realpath: Optional[str]):
+        self.name = name
+        self.ldpaths = ldpaths
+        self.path = path
+        self.realpath = realpath
+
+    @property
+    def key(self) -> NodeKey:
+        return (self.name, self.ldpaths)
+
+    @property
+    def is_input(self) -> bool:
+        return self.ldpaths == INPUT
+
+    @property
+    def missing(self) -> bool:
+        return self.path is None
+
+    def __getstate__(self):
+        return (self.name, self.ldpaths, self.path, self.realpath)
+
+    def __setstate__(self, state):
+        self.name, self.ldpaths, self.path, self.realpath = state
+
+    def __repr__(self) -> str:
+        return f"LibNode({self.name!r}, path={self.path!r}, realpath={self.realpath!r})"
+
+
+class DepGraph:
+    """
+    Dependency graph of a set of ELF files.
+
+    Nodes are identified by integer ids, direct dependencies of every node
+    are stored in an integer array. ``fs`` is the file system paths refer to
+    and ``cache`` its state read during resolution, neither is pickled with
+    the graph.
+
+    Inputs added with ``add_tree`` also keep the rest of the ``lddtree``
+    output (interpreter, rpath, runpath and which node every soname was
+    resolved to), so that ``to_dict`` can reproduce it.
+    """
+
+    def __init__(self, fs: FileSystem = LOCAL_FS, cache: Optional[FsCache] = None):
+        self.fs = fs
+        self.cache = cache
+        self.nodes: List[LibNode] = []
+        self._adj: List[array] = []
+        self._ids: Dict[NodeKey, int] = {}
+        self._ldpaths: Dict[Tuple[str, ...], Tuple[str, ...]] = {INPUT: INPUT}
+        self._radj: Optional[List[array]] = None
+        self._trees: Dict[int, _TreeInfo] = {}
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __getstate__(self):
+        return (self.nodes, self._adj, self._trees)
+
+    def __setstate__(self, state):
+        self.__init__()
+        nodes, adj, trees = state
+        for node in nodes:
+            self.add_node(node.name, node.ldpaths, node.path, node.realpath)
+        self._adj = adj
+        self._radj = None
+        for root, (interp, rpath, runpath, libs) in trees.items():
+            self._trees[root] = (interp, self._paths(rpath), self._paths(runpath), libs)
+
+    def _paths(self, paths: Iterable[str]) -> Tuple[str, ...]:
+        """ Shared copy of a search path tuple """
+        paths = tuple(paths)
+        return self._ldpaths.setdefault(paths, paths)
+
+    def node_id(self, key: NodeKey) -> Optional[int]:
+        return self._ids.get(key)
+
+    def add_node(self,
+                 name: str,
+                 ldpaths: Tuple[str, ...],
+                 path: Optional[str],
+                 realpath: Optional[str]) -> int:
+        """ Add node unless node with the same (name, ldpaths) exists, return node id
+        """
+        ldpaths = self._paths(ldpaths)
+        key = (sys.intern(name), ldpaths)
+        nid = self._ids.get(key)
+        if nid is None:
+            nid = len(self.nodes)
+            self._ids[key] = nid
+            self.nodes.append(LibNode(key[0], ldpaths, _intern(path), _intern(realpath)))
+            self._adj.append(array('l'))
+        return nid
+
+    def add_edge(self, src: int, dst: int):
+        deps = self._adj[src]
+        if dst not in deps:
+            deps.append(dst)
+            self._radj = None
+
+    def add_tree(self, fname: str, ltree: Dict[str, Any]) -> int:
+        """ Add output of ``lddtree`` for input ``fname``, return id of the input node
+        """
+        libs = ltree['libs']
+        ids: Dict[str, int] = {}
+
+        def lib_id(name: str) -> int:
+            nid = ids.get(name)
+            if nid is None:
+                lib = libs[name]
+                nid = ids[name] = self.add_node(name, lib.get('ldpaths', ()), lib['path'], lib['realpath'])
+            return nid
+
+        root = self.add_node(fname, INPUT, ltree['path'], ltree['realpath'])
+        for name in ltree['needed']:
+            self.add_edge(root, lib_id(name))
+        for name, lib in libs.items():
+            src = lib_id(name)
+            for dep in lib['needed']:
+                self.add_edge(src, lib_id(dep))
+
+        self._trees[root] = (_intern(ltree['interp']), self._paths(ltree['rpath']), self._paths(ltree['runpath']),
+                             array('l', (ids[name] for name in libs)))
+        return root
+
+    def merge(self, other: 'DepGraph') -> List[int]:
+        """ Add all nodes and edges of ``other``, returns mapping from node ids
+            in ``other`` to node ids in this graph.
+        """
+        remap = [self.add_node(n.name, n.ldpaths, n.path, n.realpath) for n in other.nodes]
+        for a, deps in enumerate(other._adj):
+            for b in deps:
+                self.add_edge(remap[a], remap[b])
+        for root, (interp, rpath, runpath, libs) in other._trees.items():
+            self._trees[remap[root]] = (interp, self._paths(rpath), self._paths(runpath),
+                                        array('l', (remap[i] for i in libs)))
+        return remap
+
+    def deps(self, nid: int) -> array:
+        """ Ids of direct dependencies of a node, in DT_NEEDED order
+        """
+        return self._adj[nid]
+
+    def collect(self,
+                roots: Iterable[int],
+                pkg_of: Optional[Callable[[int], Optional[str]]] = None,
+                skip_prefix: Optional[str] = None) -> Tuple[Set[str], Set[str], List[int]]:
+        """ Single pass over dependencies of ``roots``.
+
+            Dependencies of libraries that belong to a package are not
+            followed: they are assumed to be handled by the package manager.
+
+            :param pkg_of: Package owning a node, or None
+            :param skip_prefix: Do not report files under this path
+
+            Returns
+            =======
+            {pkgs}, {files}, [missing-node-ids]
+        """
+        adj, nodes = self._adj, self.nodes
+
+        seen = bytearray(len(nodes))
+        pkgs: Set[str] = set()
+        files: Set[str] = set()
+        missing: List[int] = []
+
+        q = deque(roots)
+        while q:
+            nid = q.popleft()
+            if seen[nid]:
+                continue
+            seen[nid] = 1
+            node = nodes[nid]
+
+            if node.path is None:
+                missing.append(nid)
+
+            pkg = None if pkg_of is None else pkg_of(nid)
+            if pkg is not None:
+                pkgs.add(pkg)
+                continue
+
+            for p in lib_paths(node.path, node.realpath, self.fs, self.cache):
+                if skip_prefix is None or not p.startswith(skip_prefix):
+                    files.add(p)
+
+            q.extend(d for d in adj[nid] if not seen[d])
+
+        return pkgs, files, missing
+
+    def to_dict(self, root: int) -> Dict[str, Any]:
+        """ Export closure of ``root`` in the ``lddtree`` output format.
+
+            Inputs added with ``add_tree`` get the same dict ``lddtree``
+            returned for them (with input ``realpath`` resolved). For other
+            roots ``interp`` is None, ``rpath`` and ``runpath`` are empty and
+            the first library of every soname found in breadth-first order
+            is listed.
+        """
+        def entry(nid: int) -> Dict[str, Any]:
+            node = self.nodes[nid]
+            # names, not nodes: a library shared by several inputs can have
+            # edges to libraries of the same soname found by each of them
+            needed = list(dict.fromkeys(self.nodes[d].name for d in self.deps(nid)))
+            ret = {'path': node.path, 'realpath': node.realpath, 'needed': needed}
+            if not node.is_input and not (node.name == interp_name and node.path == interp):
+                ret['ldpaths'] = node.ldpaths
+            return ret
+
+        tree = self._trees.get(root)
+        interp = None if tree is None else tree[0]
+        interp_name = None if interp is None else interp.rsplit('/', 1)[-1]
+
+        ret = entry(root)
+        libs: Dict[str, Any] = {}
+        if tree is not None:
+            ret.update(interp=interp, rpath=list(tree[1]), runpath=list(tree[2]))
+            for nid in tree[3]:
+                libs[self.nodes[nid].name] = entry(nid)
+        else:
+            ret.update(interp=None, rpath=[], runpath=[])
+            seen = {root}
+            q = deque(self.deps(root))
+            while q:
+                nid = q.popleft()
+                if nid in seen:
+                    continue
+                seen.add(nid)
+                libs.setdefault(self.nodes[nid].name, entry(nid))
+                q.extend(self.deps(nid))
+
+        ret['libs'] = libs
+        return ret
+
+    def closures(self,
+                 roots: Iterable[int],
+                 pkg_of: Optional[Callable[[int], Optional[str]]] = None) -> Dict[int, int]:
+        """ Closure of every root as a bit mask of node ids.
+
+            Computed in one traversal: strongly connected components are found
+            in dependency-first order, and the closure of every component is
+            shared by everything that depends on it. Dependencies of packaged
+            libraries are not followed, same as ``collect``.
+        """
+        adj = self._adj
+
+        def succ(nid: int) -> Iterable[int]:
+            if pkg_of is not None and pkg_of(nid) is not None:
+                return ()
+            return adj[nid]
+
+        index: Dict[int, int] = {}
+        lowlink: Dict[int, int] = {}
+        on_stack: Set[int] = set()
+        stack: List[int] = []
+        comp_mask: Dict[int, int] = {}  # node id -> closure of its component
+
+        # Iterative Tarjan's algorithm
+        for root in roots:
+            if root in index:
+                continue
+            work = [(root, iter(succ(root)))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                nid, it = work[-1]
+                advanced = False
+                for d in it:
+                    if d not in index:
+                        index[d] = lowlink[d] = len(index)
+                        stack.append(d)
+                        on_stack.add(d)
+                        work.append((d, iter(succ(d))))
+                        advanced = True
+                        break
+                    if d in on_stack:
+                        lowlink[nid] = min(lowlink[nid], index[d])
+                if advanced:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[nid])
+
+                if lowlink[nid] == index[nid]:
+                    # nid is the root of a component, all components it
+                    # depends on are already done
+                    members = []
+                    while True:
+                        m = stack.pop()
+                        on_stack.discard(m)
+                        members.append(m)
+                        if m == nid:
+                            break
+                    mask = 0
+                    for m in members:
+                        mask |= 1 << m
+                    for m in members:
+                        for d in succ(m):
+                            if d in comp_mask:
+                                mask |= comp_mask[d]
+                    for m in members:
+                        comp_mask[m] = mask
+
+        return {root: comp_mask[root] for root in roots}
+
+    def closure_nodes(self, mask: int) -> Iterator[int]:
+        """ Node ids in a closure mask returned by ``closures``
+        """
+        return _bits(mask)
+
+    def _reverse(self) -> List[array]:
+        if self._radj is None:
+            radj = [array('l') for _ in self.nodes]
+            for a, deps in enumerate(self._adj):
+                for b in deps:
+                    radj[b].append(a)
+            self._radj = radj
+        return self._radj
+
+    def find(self, lib: str) -> List[int]:
+        """ Node ids matching ``lib``: soname, path or real path
+        """
+        return [nid for nid, n in enumerate(self.nodes)
+                if lib in (n.name, n.path, n.realpath)]
+
+    def why(self, targets: Iterable[int], roots: Iterable[int]) -> Dict[int, List[int]]:
+        """ For every root that depends on any of ``targets`` find the shortest
+            dependency chain from root to a target.
+
+            Returns
+            =======
+            {root: [root, ..., target]}
+        """
+        radj = self._reverse()
+        # next hop towards the closest target
+        nxt: Dict[int, int] = {}
+        q = deque()
+        for t in targets:
+            if t not in nxt:
+                nxt[t] = -1
+                q.append(t)
+
+        while q:
+            nid = q.popleft()
+            for p in radj[nid]:
+                if p not in nxt:
+                    nxt[p] = nid
+                    q.append(p)
+
+        chains: Dict[int, List[int]] = {}
+        for root in roots:
+            if root not in nxt:
+                continue
+            chain = [root]
+            while nxt[chain[-1]] >= 0:
+                chain.append(nxt[chain[-1]])
+            chains[root] = chain
+        return chains
@@ -0,0 +1,148 @@
+""" Resolver service on a Unix socket.
+
+Keeps a ``Resolver`` with warm caches in a long running process, so that
+repeated queries do not pay for interpreter start up, ld.so.conf parsing, ELF
+parsing and dpkg database loading every time.
+
+Protocol is one JSON object per line in both directions, any number of
+requests can be sent over one connection. Request::
+
+    {"paths": ["/abs/path", ...], "dpkg": false, "ignore_pkg": [], "per_input": false}
+
+``paths`` is either ELF files or a single directory, same as on the command
+line. Response::
+
+    {"files": [...], "packages": [...], "missing": [...]}
+
+``packages`` only when ``dpkg`` was requested, with ``per_input`` the response
+is ``{"inputs": {input: {"files": .., "packages": .., "missing": ..}}}``.
+Errors are reported as ``{"error": "message"}``. ``{"op": "ping"}`` returns
+``{"ok": true}``.
+"""
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+from typing import Any, Dict, List, Optional
+
+from . import Resolver, find_libs
+
+
+def handle(resolver: Resolver, request: Dict[str, Any]) -> Dict[str, Any]:
+    """ Process one request, see module docs for the format
+    """
+    if request.get('op', 'resolve') == 'ping':
+        return {'ok': True}
+
+    paths: List[str] = request['paths']
+    dpkg = bool(request.get('dpkg', False))
+    ignore_pkg: List[str] = request.get('ignore_pkg', [])
+    fs = resolver.fs
+
+    for p in paths:
+        if not os.path.isabs(p):
+            raise ValueError(f"Path must be absolute: {p}")
+        if not fs.exists(p):
+            raise ValueError(f"Path '{p}' does not exist.")
+
+    prefix: Optional[str] = None
+    libs = paths
+    if len(paths) == 1 and fs.isdir(paths[0]):
+        prefix = paths[0]
+        libs = list(find_libs(prefix, fs=fs))
+
+    if request.get('per_input', False):
+        results = resolver.per_input(libs, dpkg=dpkg, dpkg_ignore=ignore_pkg, skip_prefix=prefix)
+        inputs = {}
+        for name, (pkgs, files, missing) in results.items():
+            inputs[name] = {'files': files, 'missing': missing}
+            if dpkg:
+                inputs[name]['packages'] = pkgs
+        return {'inputs': inputs}
+
+    pkgs, files, missing = resolver.process_elf(libs, dpkg=dpkg, dpkg_ignore=ignore_pkg, skip_prefix=prefix)
+    out: Dict[str, Any] = {'files': sorted(files), 'missing': missing}
+    if dpkg:
+        out['packages'] = sorted(pkgs)
+    return out
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = handle(self.server.resolver, json.loads(line))  # type: ignore
+            except Exception as e:  # report any failure to the client, keep serving
+                response = {'error': str(e) or e.__class__.__name__}
+            self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+            self.wfile.flush()
+
+
+class _Server(socketserver.UnixStreamServer):
+    # requests are handled one at a time, let clients queue up
+    request_queue_size = 128
+
+    def __init__(self, path: str, resolver: Resolver):
+        self.resolver = resolver
+        super().__init__(path, _Handler)
+
+
+def make_server(path: str, resolver: Resolver) -> socketserver.UnixStreamServer:
+    """ Server bound to Unix socket ``path``, call ``.serve_forever()`` to run it.
+    """
+    if os.path.exists(path):
+        # left behind by a previous server, unless another one is running
+        try:
+            query(path, {'op': 'ping'}, timeout=1)
+        except OSError:
+            os.unlink(path)
+        else:
+            raise RuntimeError(f"Server is already running on {path}")
+    return _Server(path, resolver)
+
+
+def serve(path: str, resolver: Optional[Resolver] = None, verbose: bool = False):
+    """ Serve requests on Unix socket ``path`` until interrupted (SIGINT/SIGTERM).
+    """
+    if resolver is None:
+        resolver = Resolver()
+
+    def _stop(*args):
+        raise KeyboardInterrupt()
+
+    server = make_server(path, resolver)
+    signal.signal(signal.SIGTERM, _stop)
+    if verbose:
+        print(f"Serving on {path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        resolver.close()
+
+
+def query(path: str, request: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+    """ Send one request to the server on Unix socket ``path`` and return the response.
+
+        Raises ``RuntimeError`` if server reported an error.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode('utf8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"No response from {path}")
+
+    response = json.loads(line)
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response
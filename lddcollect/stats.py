@@ -0,0 +1,168 @@
+""" Phase timings and I/O counters of a run.
+
+Collection is off unless a ``Stats`` object is activated with ``use``, code
+doing I/O calls ``count`` and wraps its work in ``phase``, both do nothing
+when no statistics are being collected.
+
+::
+
+    stats = Stats(trace=True)
+    process_elf(files, stats=stats)
+    stats.report()
+    stats.write_trace('trace.json')  # chrome://tracing or https://ui.perfetto.dev
+
+Counters:
+
+``open``, ``bytes_read``
+    Files opened and bytes read from them (ELF headers and dynamic sections,
+    dpkg database)
+``stat``, ``readlink``, ``realpath``, ``listdir``
+    File system queries
+``elf_sniff``, ``elf_parse``
+    ELF header checks of candidate files, full parses of dynamic sections
+``elf_cache_hit``, ``elf_cache_miss``, ``find_cache_hit``, ``find_cache_miss``
+    Lookups of parsed ELF files and library search results
+``find_lib``
+    Candidate library files checked while searching library paths
+``dpkg_lookup``, ``dpkg_query``
+    Paths looked up in the dpkg database, ``dpkg -S`` invocations
+
+Counters updated from several threads at once can be slightly off, counts
+from worker processes are added to the parent when their results arrive.
+"""
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Union
+
+_active: Optional['Stats'] = None
+
+
+class Stats:
+    """
+    Counters and wall time per phase, optionally a trace of phases.
+
+    :param trace: Record start and duration of every phase for
+                  ``write_trace``
+    """
+
+    def __init__(self, trace: bool = False):
+        self.counters: Dict[str, int] = collections.Counter()
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.events: Optional[List[Dict[str, Any]]] = [] if trace else None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator['Stats']:
+        """ Attribute time and counts of the enclosed block to phase ``name``,
+            phases can be nested and repeated.
+        """
+        before = dict(self.counters)
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            wall = time.perf_counter() - t0
+            delta = {k: v - before.get(k, 0) for k, v in self.counters.items() if v != before.get(k, 0)}
+            totals = self.phases.setdefault(name, collections.Counter())
+            totals['wall'] += wall
+            totals.update(delta)
+            if self.events is not None:
+                # perf_counter is system wide on Linux, so events of worker
+                # processes line up with events of the parent
+                self.events.append({'name': name, 'ph': 'X', 'cat': 'lddcollect',
+                                    'ts': t0 * 1e6, 'dur': wall * 1e6,
+                                    'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'args': delta})
+
+    def merge(self, other: 'Stats'):
+        """ Add counts and trace events collected elsewhere (worker process) """
+        self.counters.update(other.counters)  # type: ignore
+        if self.events is not None and other.events is not None:
+            self.events.extend(other.events)
+
+    @property
+    def wall(self) -> float:
+        """ Seconds since this object was created """
+        return time.perf_counter() - self._start
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'wall': self.wall,
+                'counters': dict(self.counters),
+                'phases': {name: dict(p) for name, p in self.phases.items()}}
+
+    def report(self, file: Optional[TextIO] = None):
+        """ Print per phase wall time and counters, stderr by default """
+        if file is None:
+            file = sys.stderr
+
+        def _line(name: str, wall: float, counters: Dict[str, Any]) -> str:
+            counts = ' '.join(f'{k}={int(v)}' for k, v in sorted(counters.items()) if k != 'wall')
+            return f"  {name:<10} {wall:9.3f}s  {counts}".rstrip()
+
+        print("Stats:", file=file)
+        for name, p in self.phases.items():
+            print(_line(name, p['wall'], p), file=file)
+        print(_line('total', self.wall, self.counters), file=file)
+
+    def write_trace(self, out: Union[str, TextIO]):
+        """ Write recorded phases in Chrome trace event format """
+        events = list(self.events or [])
+        events.sort(key=lambda e: e['ts'])
+        doc = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if isinstance(out, str):
+            with open(out, 'wt') as f:
+                json.dump(doc, f)
+        else:
+            json.dump(doc, out)
+
+
+class _NoPhase:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def count(name: str, n: int = 1):
+    """ Increment counter ``name`` of the active stats, if any """
+    stats = _active
+    if stats is not None:
+        stats.counters[name] += n
+
+
+def phase(name: str):
+    """ Context manager timing a phase of the active stats, if any """
+    stats = _active
+    if stats is None:
+        return _NO_PHASE
+    return stats.phase(name)
+
+
+def active() -> Optional[Stats]:
+    return _active
+
+
+@contextmanager
+def use(stats: Optional[Stats]) -> Iterator[Optional[Stats]]:
+    """ Collect statistics into ``stats`` within the block, ``None`` leaves
+        the current setting unchanged.
+    """
+    global _active
+    if stats is None:
+        yield _active
+        return
+
+    prev, _active = _active, stats
+    try:
+        yield stats
+    finally:
+        _active = prev
@@ -0,0 +1,141 @@
+""" Streaming results for large runs.
+
+Inputs are resolved in chunks as they are discovered, each chunk gets its own
+small dependency graph (parsed ELF files and library search results are still
+shared across chunks) and results are reported as soon as a chunk is done.
+Parsed inputs are dropped from the ELF cache after their chunk unless they are
+also libraries, only reported names are kept. Memory use then grows with the
+number of distinct libraries and reported paths rather than with the parsed
+inputs and their graphs, and consumers can start working before the scan is
+over.
+
+Records (one JSON object per line with ``--ndjson``)::
+
+    {"type": "input", "path": "/opt/app/bin/app"}
+    {"type": "file", "path": "/opt/app/lib/libfoo.so.1"}
+    {"type": "package", "name": "libc6:amd64"}
+    {"type": "missing", "name": "libbar.so.2"}
+    {"type": "done", "inputs": 1, "files": 1, "packages": 1, "missing": 1}
+
+Every file, package and missing library is reported once, in no particular
+order. Input records come in the batch of their chunk. ``done`` is always the
+last record.
+"""
+import os
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from . import (_chunks, _make_caches, _resolve_chunk, _resolve_parallel, pkg_lookup,
+               dpkg_index, DpkgIndex, DPKG_ADMINDIR, ElfCache)
+from .graph import DepGraph
+from .vendor.lddtree import FsCache
+from .stats import phase, active as _active_stats
+from .vfs import FileSystem, LOCAL_FS
+
+Record = Dict[str, Any]
+
+
+def _resolved_chunks(fnames: Iterable[str],
+                     verbose: bool,
+                     workers: Optional[int],
+                     cache_dir: Optional[str],
+                     fs: FileSystem,
+                     chunk_size: int) -> Iterator[Tuple[List[str], List[int], DepGraph]]:
+    """ Resolve ``fnames`` in chunks, yields inputs, their node ids and graph of every chunk """
+    if workers is not None and workers > 1:
+        stats = _active_stats()
+        results = _resolve_parallel(fnames, workers, verbose=verbose, cache_dir=cache_dir,
+                                    chunk_size=chunk_size, fs=fs, evict_inputs=True)
+        fs_cache = FsCache()
+        while True:
+            # only time spent waiting for workers, not processing of results
+            with phase('resolve'):
+                result = next(results, None)
+            if result is None:
+                return
+            roots, graph, _, _stats = result
+            if stats is not None and _stats is not None:
+                stats.merge(_stats)
+            # file system and its cache are not pickled with the graph
+            graph.fs, graph.cache = fs, fs_cache
+            # chunks are resolved in order, roots are inputs of the chunk
+            yield [graph.nodes[r].path for r in roots], roots, graph
+
+    caches = _make_caches(cache_dir)
+    try:
+        for chunk in _chunks(fnames, chunk_size):
+            with phase('resolve'):
+                roots, graph, _, _ = _resolve_chunk(chunk, verbose, caches=caches, fs=fs, evict_inputs=True)
+            yield chunk, roots, graph
+    finally:
+        if isinstance(caches[0], ElfCache):
+            caches[0].close()
+
+
+def stream_records(fnames: Iterable[str],
+                   verbose: bool = False,
+                   dpkg: bool = True,
+                   dpkg_ignore: List[str] = [],
+                   skip_prefix: Optional[str] = None,
+                   workers: Optional[int] = None,
+                   cache_dir: Optional[str] = None,
+                   fs: FileSystem = LOCAL_FS,
+                   chunk_size: int = 32) -> Iterator[List[Record]]:
+    """
+    Same results as ``process_elf`` reported incrementally, see module docs
+    for the record format.
+
+    :param fnames: ELF files, consumed lazily (can be ``find_libs`` output)
+
+    :param chunk_size: Number of inputs resolved together
+
+    Returns:
+
+      Batches of records, one batch per chunk of inputs
+    """
+    if fs is not LOCAL_FS:
+        # persistent cache is keyed by host inodes
+        cache_dir = None
+
+    index: Optional[DpkgIndex] = None
+    if dpkg:
+        with phase('pkg'):
+            if fs is LOCAL_FS:
+                cache_file = None if cache_dir is None else os.path.join(cache_dir, 'dpkg-index.pickle')
+                index = dpkg_index(cache_file=cache_file)
+            else:
+                try:
+                    index = DpkgIndex.from_admindir(DPKG_ADMINDIR, fs=fs)
+                except OSError:
+                    dpkg = False
+
+    seen_files: Set[str] = set()
+    seen_pkgs: Set[str] = set()
+    seen_missing: Set[str] = set()
+    num_inputs = 0
+    for inputs, roots, graph in _resolved_chunks(fnames, verbose, workers, cache_dir, fs, chunk_size):
+        batch: List[Record] = [{'type': 'input', 'path': p} for p in inputs]
+        num_inputs += len(inputs)
+
+        pkg_of = pkg_lookup(graph, dpkg_ignore, skip_prefix, index=index) if dpkg else None
+        with phase('collect'):
+            pkgs, files, missing = graph.collect(roots, pkg_of, skip_prefix)
+
+        batch.extend({'type': 'file', 'path': p} for p in files if p not in seen_files)
+        seen_files.update(files)
+        batch.extend({'type': 'package', 'name': pkg} for pkg in pkgs if pkg not in seen_pkgs)
+        seen_pkgs.update(pkgs)
+        for nid in missing:
+            name = graph.nodes[nid].name
+            if name not in seen_missing:
+                seen_missing.add(name)
+                if verbose:
+                    print(f"Failed to find lib: {name}", file=sys.stderr)
+                batch.append({'type': 'missing', 'name': name})
+        yield batch
+
+    yield [{'type': 'done',
+            'inputs': num_inputs,
+            'files': len(seen_files),
+            'packages': len(seen_pkgs),
+            'missing': len(seen_missing)}]
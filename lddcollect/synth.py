@@ -0,0 +1,260 @@
+""" Synthetic ELF files and dependency trees for tests and benchmarks.
+
+``elf_bytes`` produces minimal, but valid, ELF shared objects: ELF header,
+program headers (PT_INTERP, PT_LOAD, PT_DYNAMIC), a string table and a
+dynamic section with DT_NEEDED/DT_SONAME/DT_RPATH/DT_RUNPATH entries. There
+is no code and no section headers, this is enough for ``readelf -d``,
+pyelftools and dependency resolution.
+
+``generate_tree`` writes a small root file system made of such files: layers
+of libraries where each library needs ``fanout`` libraries of the next layer,
+symlink chains from sonames to real files, executables, ``/etc/ld.so.conf``
+and a dpkg database. Generation is deterministic for a given ``seed``.
+"""
+import os
+import random
+import struct
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set
+
+from .elf import (_FORMATS, ELF_MAGIC, ELFCLASS32, ELFCLASS64, ELFDATA2LSB, ELFDATA2MSB, ET_DYN,
+                  PT_LOAD, PT_DYNAMIC, PT_INTERP, DT_NULL, DT_NEEDED, DT_STRTAB, DT_STRSZ,
+                  DT_RPATH, DT_RUNPATH)
+
+EM_386 = 3
+EM_X86_64 = 62
+DT_SONAME = 14
+PF_R = 4
+
+RPATH_MODES = ('origin', 'absolute', 'none')
+
+LIB_DIR = '/usr/lib/synth'
+BIN_DIR = '/usr/bin'
+INTERP = LIB_DIR + '/ld-synth.so.1'
+ADMINDIR = '/var/lib/dpkg'
+
+
+def _align(n: int, a: int) -> int:
+    return (n + a - 1) // a * a
+
+
+def elf_bytes(needed: Sequence[str] = (),
+              soname: Optional[str] = None,
+              rpath: Optional[str] = None,
+              runpath: Optional[str] = None,
+              interp: Optional[str] = None,
+              elfclass: int = 64,
+              little_endian: bool = True,
+              machine: Optional[int] = None,
+              e_type: int = ET_DYN) -> bytes:
+    """ Minimal ELF file with a given dynamic section.
+
+    :param needed: DT_NEEDED entries in order
+    :param interp: Program interpreter (PT_INTERP), executables have one
+    :param machine: ``e_machine``, default: x86-64 for 64-bit, i386 for 32-bit
+    """
+    bo, ehdr_fmt, phdr_fmt, dyn_fmt = _FORMATS[(elfclass, little_endian)]
+    if machine is None:
+        machine = EM_X86_64 if elfclass == 64 else EM_386
+
+    strtab = bytearray(b'\0')
+
+    def add_str(s: str) -> int:
+        offset = len(strtab)
+        strtab.extend(s.encode('utf8') + b'\0')
+        return offset
+
+    dyn = [(DT_NEEDED, add_str(name)) for name in needed]
+    for tag, value in ((DT_SONAME, soname), (DT_RPATH, rpath), (DT_RUNPATH, runpath)):
+        if value is not None:
+            dyn.append((tag, add_str(value)))
+
+    ehsize = 16 + struct.calcsize(bo + ehdr_fmt)
+    phentsize = struct.calcsize(bo + phdr_fmt)
+    dynsz = struct.calcsize(bo + dyn_fmt)
+    phnum = 3 if interp is not None else 2
+
+    # file layout: headers, interpreter, strings, dynamic section
+    interp_data = b'' if interp is None else interp.encode('utf8') + b'\0'
+    interp_off = ehsize + phnum * phentsize
+    strtab_off = interp_off + len(interp_data)
+    dyn_off = _align(strtab_off + len(strtab), elfclass // 8)
+    dyn += [(DT_STRTAB, strtab_off), (DT_STRSZ, len(strtab)), (DT_NULL, 0)]
+    size = dyn_off + len(dyn) * dynsz
+
+    def phdr(p_type: int, offset: int, filesz: int, align: int) -> bytes:
+        # file is mapped at address 0, so virtual addresses equal file offsets
+        if elfclass == 64:
+            return struct.pack(bo + phdr_fmt, p_type, PF_R, offset, offset, offset, filesz, filesz, align)
+        return struct.pack(bo + phdr_fmt, p_type, offset, offset, offset, filesz, filesz, PF_R, align)
+
+    ident = (ELF_MAGIC +
+             bytes([ELFCLASS64 if elfclass == 64 else ELFCLASS32,
+                    ELFDATA2LSB if little_endian else ELFDATA2MSB,
+                    1]))
+    out = bytearray(ident.ljust(16, b'\0'))
+    out += struct.pack(bo + ehdr_fmt,
+                       e_type, machine, 1,
+                       0,        # e_entry
+                       ehsize,   # e_phoff
+                       0,        # e_shoff
+                       0,        # e_flags
+                       ehsize, phentsize, phnum,
+                       64 if elfclass == 64 else 40,  # e_shentsize
+                       0, 0)
+    if interp is not None:
+        out += phdr(PT_INTERP, interp_off, len(interp_data), 1)
+    out += phdr(PT_LOAD, 0, size, 0x1000)
+    out += phdr(PT_DYNAMIC, dyn_off, len(dyn) * dynsz, elfclass // 8)
+    out += interp_data
+    out += strtab
+    out += b'\0' * (dyn_off - len(out))
+    for tag, value in dyn:
+        out += struct.pack(bo + dyn_fmt, tag, value)
+
+    assert len(out) == size
+    return bytes(out)
+
+
+class SynthTree(NamedTuple):
+    """ Generated tree, all paths are inside the tree unless it was generated
+        with ``host_paths=True``.
+    """
+    root: str                 # host directory containing the tree
+    bins: List[str]           # executables
+    libs: List[str]           # real library files
+    links: List[str]          # symlinks
+    lib_dirs: List[str]
+    packages: Dict[str, str]  # real library file -> package
+
+    @property
+    def num_files(self) -> int:
+        return len(self.bins) + len(self.libs) + len(self.links) + 1
+
+
+def _lib_names(idx: int, chain: int) -> List[str]:
+    """ Needed name first, real file last: ``libsN.so.1 -> libsN.so.1.0 -> ..`` """
+    return [f'libs{idx}.so.1' + '.0' * i for i in range(chain + 1)]
+
+
+def generate_tree(dest: str,
+                  libs: int = 100,
+                  bins: int = 10,
+                  fanout: int = 3,
+                  depth: int = 4,
+                  rpath: str = 'origin',
+                  symlink_chain: int = 1,
+                  dir_size: int = 1000,
+                  packaged: float = 0.5,
+                  host_paths: bool = False,
+                  seed: int = 0) -> SynthTree:
+    """
+    Write synthetic root file system into directory ``dest``.
+
+    :param libs: Number of libraries, split evenly into ``depth`` layers
+    :param bins: Number of executables, each needs ``fanout`` libraries of the
+                 first layer and has a program interpreter
+    :param fanout: Number of DT_NEEDED entries of executables and libraries
+                   (libraries of the last layer have none)
+    :param rpath: How libraries are found: ``origin`` - DT_RUNPATH relative
+                  to ``$ORIGIN``, ``absolute`` - DT_RUNPATH with absolute paths,
+                  ``none`` - only through ``/etc/ld.so.conf`` of the tree
+    :param symlink_chain: Number of symlinks between the needed name and the
+                          real library file
+    :param dir_size: Maximum number of files per library directory
+    :param packaged: Fraction of libraries owned by dpkg packages (first
+                     layers first), one package per directory
+    :param host_paths: Write paths prefixed with ``dest`` into ELF files,
+                       ld.so.conf and dpkg database, so that the tree can be
+                       used without ``--root``
+    """
+    if rpath not in RPATH_MODES:
+        raise ValueError(f"rpath should be one of {RPATH_MODES}")
+    if depth < 1:
+        raise ValueError("depth should be at least 1")
+
+    rng = random.Random(seed)
+    dest = os.path.abspath(dest)
+    prefix = dest if host_paths else ''
+
+    made: Set[str] = set()
+
+    def write(path: str, data: bytes, mode: int = 0o644):
+        host = dest + path
+        d = os.path.dirname(host)
+        if d not in made:
+            os.makedirs(d, exist_ok=True)
+            made.add(d)
+        with open(host, 'wb') as f:
+            f.write(data)
+        os.chmod(host, mode)
+
+    per_dir = max(1, dir_size // (symlink_chain + 1))
+    lib_dirs = [f'{LIB_DIR}/d{i:04d}' for i in range((libs + per_dir - 1) // per_dir)]
+    layers = [list(range(libs * i // depth, libs * (i + 1) // depth)) for i in range(depth)]
+
+    def lib_dir(idx: int) -> str:
+        return lib_dirs[idx // per_dir]
+
+    def runpath(origin: str, deps: List[int]) -> Optional[str]:
+        if rpath == 'none' or not deps:
+            return None
+        dirs = sorted(set(lib_dir(i) for i in deps))
+        if rpath == 'absolute':
+            return ':'.join(prefix + d for d in dirs)
+        return ':'.join('$ORIGIN/' + os.path.relpath(d, origin) for d in dirs)
+
+    def pick(layer: int) -> List[int]:
+        if layer >= depth:
+            return []
+        return rng.sample(layers[layer], min(fanout, len(layers[layer])))
+
+    interp = prefix + INTERP
+    write(INTERP, elf_bytes(soname=os.path.basename(INTERP)), 0o755)
+
+    lib_files: List[str] = []
+    links: List[str] = []
+    packages: Dict[str, str] = {}
+    info: Dict[str, List[str]] = {}  # package -> paths in its .list file
+    num_packaged = int(libs * packaged)
+    for layer, members in enumerate(layers):
+        for idx in members:
+            d = lib_dir(idx)
+            names = _lib_names(idx, symlink_chain)
+            deps = pick(layer + 1)
+            real = f'{d}/{names[-1]}'
+            write(real, elf_bytes([_lib_names(i, symlink_chain)[0] for i in deps],
+                                  soname=names[0],
+                                  runpath=runpath(d, deps)))
+            lib_files.append(real)
+            for name, target in zip(names[:-1], names[1:]):
+                os.symlink(target, dest + f'{d}/{name}')
+                links.append(f'{d}/{name}')
+
+            if idx < num_packaged:
+                pkg = 'synth-' + os.path.basename(d)
+                packages[real] = pkg
+                if pkg not in info:
+                    info[pkg] = ['/.'] + [prefix + p for p in ('/usr', '/usr/lib', LIB_DIR, d)]
+                info[pkg].extend(prefix + f'{d}/{name}' for name in names)
+
+    bin_files: List[str] = []
+    for i in range(bins):
+        path = f'{BIN_DIR}/synth{i}'
+        deps = pick(0)
+        write(path, elf_bytes([_lib_names(idx, symlink_chain)[0] for idx in deps],
+                              interp=interp,
+                              runpath=runpath(BIN_DIR, deps)), 0o755)
+        bin_files.append(path)
+
+    write('/etc/ld.so.conf', ''.join(prefix + d + '\n' for d in lib_dirs).encode('utf8'))
+
+    os.makedirs(dest + ADMINDIR + '/info', exist_ok=True)
+    for pkg, paths in info.items():
+        write(f'{ADMINDIR}/info/{pkg}.list', ''.join(p + '\n' for p in paths).encode('utf8'))
+
+    return SynthTree(dest,
+                     [prefix + p for p in bin_files],
+                     [prefix + p for p in lib_files],
+                     [prefix + p for p in links],
+                     [prefix + d for d in lib_dirs],
+                     {prefix + p: pkg for p, pkg in packages.items()})
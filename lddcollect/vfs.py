@@ -0,0 +1,609 @@
+""" File system access for dependency resolution.
+
+``LocalFS`` is the host file system. ``DirFS``, ``TarFS`` and ``OCIFS`` present
+a root file system stored in a directory, a tar archive or a set of OCI image
+layers, with symlinks resolved relative to that root. Archives are indexed
+once (member headers only), file data is read on demand from member offsets,
+so only the parts of the image that are actually needed get read.
+"""
+import errno
+import fnmatch
+import glob
+import io
+import json
+import os
+import shutil
+import stat
+import threading
+import weakref
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .stats import count
+
+_MAX_SYMLINKS = 40
+
+# Entry types
+T_FILE = 'f'
+T_DIR = 'd'
+T_LINK = 'l'
+T_HARDLINK = 'h'
+
+# Serializes seek+read on platforms without os.pread
+_SEEK_LOCK = threading.Lock()
+
+WHITEOUT_PREFIX = '.wh.'
+WHITEOUT_OPAQUE = '.wh..wh..opq'
+
+
+class FileStat(NamedTuple):
+    """ Subset of ``os.stat_result`` available for files in images.
+    """
+    st_size: int
+    st_mtime_ns: int
+    st_mode: int
+
+
+def _split(path: str) -> List[str]:
+    return [p for p in path.split('/') if p and p != '.']
+
+
+class FileSystem:
+    """
+    Read-only file system interface used by dependency resolution.
+
+    All paths are absolute paths inside this file system. Sub-classes
+    implement primitives operating on paths without symlinks in them
+    (``_type``, ``_readlink``, ``_open``, ``_children``), path resolution is
+    done here.
+    """
+
+    def _type(self, path: str) -> Optional[str]:
+        """ Type of entry (no symlink following), None if missing """
+        raise NotImplementedError()
+
+    def _readlink(self, path: str) -> str:
+        raise NotImplementedError()
+
+    def _open(self, path: str) -> BinaryIO:
+        raise NotImplementedError()
+
+    def _children(self, path: str) -> List[Tuple[str, str]]:
+        """ [(name, type)] of directory entries """
+        raise NotImplementedError()
+
+    def _stat(self, path: str) -> FileStat:
+        raise NotImplementedError()
+
+    def _resolve(self, path: str, follow: bool = True) -> Tuple[str, Optional[str]]:
+        """ Resolve symlinks in ``path``.
+
+            :param follow: Follow symlink in the last component
+
+            Returns canonical path and entry type (None if missing)
+        """
+        todo = _split(path)
+        todo.reverse()
+        parts: List[str] = []
+        hops = 0
+        kind: Optional[str] = T_DIR
+
+        while todo:
+            name = todo.pop()
+            if name == '..':
+                if parts:
+                    parts.pop()
+                kind = T_DIR
+                continue
+
+            current = '/' + '/'.join(parts + [name])
+            kind = self._type(current)
+            if kind == T_LINK and (todo or follow):
+                hops += 1
+                if hops > _MAX_SYMLINKS:
+                    return current, None
+                target = self._readlink(current)
+                if target.startswith('/'):
+                    parts = []
+                more = _split(target)
+                more.reverse()
+                todo.extend(more)
+                continue
+
+            parts.append(name)
+            if kind is None or (todo and kind != T_DIR):
+                # missing, keep the rest unresolved like os.path.realpath does
+                remaining = list(reversed(todo))
+                return '/' + '/'.join(parts + remaining), None
+
+        return '/' + '/'.join(parts), kind
+
+    def islink(self, path: str) -> bool:
+        count('stat')
+        return self._resolve(path, follow=False)[1] == T_LINK
+
+    def readlink(self, path: str) -> str:
+        count('readlink')
+        canonical, kind = self._resolve(path, follow=False)
+        if kind != T_LINK:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), path)
+        return self._readlink(canonical)
+
+    def isdir(self, path: str) -> bool:
+        count('stat')
+        return self._resolve(path)[1] == T_DIR
+
+    def isfile(self, path: str) -> bool:
+        count('stat')
+        return self._resolve(path)[1] in (T_FILE, T_HARDLINK)
+
+    def exists(self, path: str) -> bool:
+        count('stat')
+        return self._resolve(path)[1] is not None
+
+    def realpath(self, path: str) -> str:
+        count('realpath')
+        return self._resolve(path)[0]
+
+    def open(self, path: str) -> BinaryIO:
+        count('open')
+        canonical, kind = self._resolve(path)
+        if kind not in (T_FILE, T_HARDLINK):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return self._open(canonical)
+
+    def stat(self, path: str) -> FileStat:
+        """ Size, modification time and mode, follows symlinks """
+        count('stat')
+        canonical, kind = self._resolve(path)
+        if kind is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return self._stat(canonical)
+
+    def listdir(self, path: str) -> List[Tuple[str, bool]]:
+        """ [(name, is_dir)], symlinks are not followed """
+        count('listdir')
+        canonical, kind = self._resolve(path)
+        if kind != T_DIR:
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        return [(name, t == T_DIR) for name, t in self._children(canonical)]
+
+    def glob(self, pattern: str) -> List[str]:
+        """ Only supports wildcards in the last component """
+        dirname, basename = os.path.split(pattern)
+        if not glob.has_magic(basename):
+            return [pattern] if self.exists(pattern) else []
+        try:
+            names = [name for name, _ in self.listdir(dirname)]
+        except OSError:
+            return []
+        return sorted(os.path.join(dirname, name)
+                      for name in fnmatch.filter(names, basename))
+
+    def close(self):
+        """ Release open files and temporary files, if any """
+
+
+class LocalFS(FileSystem):
+    """
+    Host file system.
+    """
+
+    def islink(self, path: str) -> bool:
+        count('stat')
+        return os.path.islink(path)
+
+    def readlink(self, path: str) -> str:
+        count('readlink')
+        return os.readlink(path)
+
+    def isdir(self, path: str) -> bool:
+        count('stat')
+        return os.path.isdir(path)
+
+    def isfile(self, path: str) -> bool:
+        count('stat')
+        return os.path.isfile(path)
+
+    def exists(self, path: str) -> bool:
+        count('stat')
+        return os.path.exists(path)
+
+    def realpath(self, path: str) -> str:
+        count('realpath')
+        return os.path.realpath(path)
+
+    def open(self, path: str) -> BinaryIO:
+        count('open')
+        return open(path, 'rb')
+
+    def stat(self, path: str) -> FileStat:
+        count('stat')
+        return os.stat(path)  # type: ignore
+
+    def listdir(self, path: str) -> List[Tuple[str, bool]]:
+        count('listdir')
+        with os.scandir(path) as it:
+            return [(e.name, e.is_dir(follow_symlinks=False)) for e in it]
+
+    def glob(self, pattern: str) -> List[str]:
+        return glob.glob(pattern)
+
+    def __reduce__(self):
+        return (_local_fs, ())
+
+    def __repr__(self) -> str:
+        return 'LocalFS()'
+
+
+LOCAL_FS = LocalFS()
+
+
+def _local_fs() -> LocalFS:
+    return LOCAL_FS
+
+
+class DirFS(FileSystem):
+    """
+    Root file system unpacked into a directory. Absolute symlinks are resolved
+    relative to that directory rather than the host root.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root).rstrip('/')
+
+    def _host(self, path: str) -> str:
+        return self.root + path
+
+    def _type(self, path: str) -> Optional[str]:
+        try:
+            mode = os.lstat(self._host(path)).st_mode
+        except OSError:
+            return None
+        if stat.S_ISLNK(mode):
+            return T_LINK
+        if stat.S_ISDIR(mode):
+            return T_DIR
+        return T_FILE
+
+    def _readlink(self, path: str) -> str:
+        return os.readlink(self._host(path))
+
+    def _open(self, path: str) -> BinaryIO:
+        return open(self._host(path), 'rb')
+
+    def _stat(self, path: str) -> FileStat:
+        return os.stat(self._host(path))  # type: ignore
+
+    def _children(self, path: str) -> List[Tuple[str, str]]:
+        with os.scandir(self._host(path)) as it:
+            return [(e.name,
+                     T_LINK if e.is_symlink() else T_DIR if e.is_dir(follow_symlinks=False) else T_FILE)
+                    for e in it]
+
+    def __repr__(self) -> str:
+        return f'DirFS({self.root!r})'
+
+
+class _Entry:
+    __slots__ = ('type', 'offset', 'size', 'linkname', 'layer', 'mode', 'mtime')
+
+    def __init__(self, type: str, offset: int = 0, size: int = 0, linkname: str = '', layer: int = 0,
+                 mode: int = 0o755, mtime: int = 0):
+        self.type = type
+        self.offset = offset
+        self.size = size
+        self.linkname = linkname
+        self.layer = layer
+        self.mode = mode
+        self.mtime = mtime
+
+    def __getstate__(self):
+        return (self.type, self.offset, self.size, self.linkname, self.layer, self.mode, self.mtime)
+
+    def __setstate__(self, state):
+        self.type, self.offset, self.size, self.linkname, self.layer, self.mode, self.mtime = state
+
+
+class _RangeFile(io.RawIOBase):
+    """ Read-only view of a byte range of another file.
+
+        Underlying file is shared by all open members of a layer and by all
+        threads, so reads are positioned and never move its file offset.
+    """
+
+    def __init__(self, f: BinaryIO, offset: int, size: int):
+        self._f = f
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._size
+        self._pos = max(0, pos)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), self._size - self._pos))
+        if n == 0:
+            return 0
+        if hasattr(os, 'pread'):
+            data = os.pread(self._f.fileno(), n, self._offset + self._pos)
+        else:
+            with _SEEK_LOCK:
+                self._f.seek(self._offset + self._pos)
+                data = self._f.read(n)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def _norm(name: str) -> str:
+    return '/' + '/'.join(_split(name))
+
+
+def _open_layer(fname: str) -> Tuple[BinaryIO, Optional[str]]:
+    """ Open tar file for random access, compressed archives are decompressed
+        into a temporary file first.
+
+        Returns open file and path of the temporary file if one was created,
+        caller is responsible for removing it.
+    """
+    f = open(fname, 'rb')
+    magic = f.read(4)
+    f.seek(0)
+    if magic[:2] == b'\x1f\x8b':
+        import gzip
+        import tempfile
+
+        f.close()
+        fd, tmp_path = tempfile.mkstemp(prefix='lddcollect-', suffix='.tar')
+        tmp = os.fdopen(fd, 'w+b')
+        try:
+            with gzip.open(fname, 'rb') as src:
+                shutil.copyfileobj(src, tmp, 1 << 20)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp_path)
+            raise
+        tmp.seek(0)
+        return tmp, tmp_path
+    if magic == b'\x28\xb5\x2f\xfd':
+        f.close()
+        raise ValueError(f"zstd compressed layers are not supported: {fname}")
+    return f, None
+
+
+def _remove_files(paths: Dict[int, str]):
+    for path in paths.values():
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    paths.clear()
+
+
+class TarFS(FileSystem):
+    """
+    Root file system stored in one or more tar archives (image layers), later
+    layers override earlier ones, OCI whiteout files are applied.
+
+    Only member headers are read when building the index, file contents are
+    read on demand straight from the archive. Compressed layers are
+    decompressed once into temporary files, copies of this object sent to
+    worker processes read these files too. Temporary files are removed by
+    ``close`` or when the object is garbage collected.
+    """
+
+    def __init__(self, layers: List[str]):
+        if isinstance(layers, str):
+            layers = [layers]
+        self.layers = list(layers)
+        self._entries: Dict[str, _Entry] = {'/': _Entry(T_DIR)}
+        self._dirs: Dict[str, Set[str]] = {'/': set()}
+        self._files: Dict[int, BinaryIO] = {}
+        self._lock = threading.Lock()
+        # layer -> decompressed copy, owned by this object
+        self._plain: Dict[int, str] = {}
+        self._cleanup: Optional[weakref.finalize] = weakref.finalize(self, _remove_files, self._plain)
+
+        for idx, layer in enumerate(self.layers):
+            self._add_layer(idx, layer)
+
+    def __getstate__(self):
+        return (self.layers, self._entries, self._dirs, dict(self._plain))
+
+    def __setstate__(self, state):
+        self.layers, self._entries, self._dirs, self._plain = state
+        self._files = {}
+        self._lock = threading.Lock()
+        # decompressed copies belong to the original object
+        self._cleanup = None
+
+    def _file(self, layer: int) -> BinaryIO:
+        f = self._files.get(layer)
+        if f is None:
+            with self._lock:
+                f = self._files.get(layer)
+                if f is None:
+                    plain = self._plain.get(layer)
+                    if plain is not None:
+                        f = open(plain, 'rb')
+                    else:
+                        f, plain = _open_layer(self.layers[layer])
+                        if plain is not None:
+                            self._plain[layer] = plain
+                    self._files[layer] = f
+        return f
+
+    def _mkdirs(self, path: str):
+        """ Create implicit parent directories missing from the archive """
+        if path in self._dirs:
+            return
+        parent, name = os.path.split(path)
+        self._mkdirs(parent)
+        self._dirs[path] = set()
+        self._entries[path] = _Entry(T_DIR)
+        self._dirs[parent].add(name)
+
+    def _remove(self, path: str):
+        for name in self._dirs.pop(path, ()):
+            self._remove(os.path.join(path, name))
+        self._entries.pop(path, None)
+
+    def _add(self, path: str, entry: _Entry):
+        if path == '/':
+            return
+        parent, name = os.path.split(path)
+        self._mkdirs(parent)
+        old = self._entries.get(path)
+        if old is not None and old.type == T_DIR and entry.type != T_DIR:
+            self._remove(path)
+        self._entries[path] = entry
+        self._dirs[parent].add(name)
+        if entry.type == T_DIR:
+            self._dirs.setdefault(path, set())
+
+    def _add_layer(self, idx: int, fname: str):
+        import tarfile
+
+        f = self._file(idx)
+        members: List[Tuple[str, _Entry]] = []
+        with tarfile.open(fileobj=f, mode='r:') as tar:
+            for m in tar:
+                path = _norm(m.name)
+                mtime = int(m.mtime)
+                if m.isdir():
+                    entry = _Entry(T_DIR, layer=idx, mode=m.mode, mtime=mtime)
+                elif m.issym():
+                    entry = _Entry(T_LINK, linkname=m.linkname, layer=idx, mtime=mtime)
+                elif m.islnk():
+                    entry = _Entry(T_HARDLINK, linkname=_norm(m.linkname), layer=idx)
+                elif m.isreg():
+                    entry = _Entry(T_FILE, m.offset_data, m.size, layer=idx, mode=m.mode, mtime=mtime)
+                else:
+                    continue
+                members.append((path, entry))
+
+        # Whiteouts only hide entries from lower layers
+        for path, _ in members:
+            parent, name = os.path.split(path)
+            if name == WHITEOUT_OPAQUE:
+                for child in list(self._dirs.get(parent, ())):
+                    self._remove(os.path.join(parent, child))
+                    self._dirs[parent].discard(child)
+            elif name.startswith(WHITEOUT_PREFIX):
+                victim = os.path.join(parent, name[len(WHITEOUT_PREFIX):])
+                self._remove(victim)
+                self._dirs.get(parent, set()).discard(victim.rsplit('/', 1)[1])
+
+        for path, entry in members:
+            if not os.path.basename(path).startswith(WHITEOUT_PREFIX):
+                self._add(path, entry)
+
+    def _type(self, path: str) -> Optional[str]:
+        entry = self._entries.get(path)
+        return None if entry is None else entry.type
+
+    def _readlink(self, path: str) -> str:
+        return self._entries[path].linkname
+
+    def _target(self, path: str) -> _Entry:
+        entry = self._entries[path]
+        for _ in range(_MAX_SYMLINKS):
+            if entry.type != T_HARDLINK:
+                break
+            entry = self._entries[entry.linkname]
+        return entry
+
+    def _stat(self, path: str) -> FileStat:
+        entry = self._target(path)
+        kind = stat.S_IFDIR if entry.type == T_DIR else stat.S_IFREG
+        return FileStat(entry.size, entry.mtime * 10**9, kind | stat.S_IMODE(entry.mode))
+
+    def _open(self, path: str) -> BinaryIO:
+        entry = self._target(path)
+        if entry.type != T_FILE:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return io.BufferedReader(_RangeFile(self._file(entry.layer), entry.offset, entry.size))  # type: ignore
+
+    def _children(self, path: str) -> List[Tuple[str, str]]:
+        return [(name, self._entries[os.path.join(path, name)].type)
+                for name in sorted(self._dirs.get(path, ()))]
+
+    def walk_files(self) -> Iterator[str]:
+        """ All non-directory paths """
+        return (p for p, e in self._entries.items() if e.type != T_DIR)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        if self._cleanup is not None:
+            _remove_files(self._plain)
+
+    def __repr__(self) -> str:
+        return f'TarFS({self.layers!r})'
+
+
+class OCIFS(TarFS):
+    """
+    Root file system of a container image stored in a directory: OCI image
+    layout (``index.json`` + ``blobs/``) or ``docker save`` output
+    (``manifest.json``).
+    """
+
+    def __init__(self, path: str, image: int = 0):
+        self.path = path
+        super().__init__(oci_layers(path, image))
+
+    def __repr__(self) -> str:
+        return f'OCIFS({self.path!r})'
+
+
+def _blob(path: str, digest: str) -> str:
+    algo, value = digest.split(':', 1)
+    return os.path.join(path, 'blobs', algo, value)
+
+
+def oci_layers(path: str, image: int = 0) -> List[str]:
+    """ Layer files of an unpacked image, bottom layer first.
+    """
+    index_file = os.path.join(path, 'index.json')
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            manifest = json.load(f)['manifests'][image]
+        while 'layers' not in manifest:
+            with open(_blob(path, manifest['digest'])) as f:
+                manifest = json.load(f)
+            if 'manifests' in manifest:
+                # image index, pick the first image
+                manifest = manifest['manifests'][0]
+        return [_blob(path, layer['digest']) for layer in manifest['layers']]
+
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)[image]
+    return [os.path.join(path, layer) for layer in manifest['Layers']]
+
+
+def open_root(root: Optional[str]) -> FileSystem:
+    """ File system for ``--root``: directory, tar archive or unpacked container image.
+    """
+    if root is None or root == '/':
+        return LOCAL_FS
+    if os.path.isdir(root):
+        if os.path.exists(os.path.join(root, 'index.json')) or os.path.exists(os.path.join(root, 'manifest.json')):
+            return OCIFS(root)
+        return DirFS(root)
+    return TarFS([root])
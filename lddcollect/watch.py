@@ -0,0 +1,411 @@
+""" Keep dependencies of a set of inputs up to date as files change.
+
+``Watcher`` remembers, for every input, the files of its closure and the
+library search directories used to resolve it. Every update stats those
+(and directories of the input tree in directory mode) and only inputs that
+use something that changed are resolved again. ELF files are only parsed
+again if they changed, see ``Resolver``. Changes are reported as a ``Diff``
+of the totals: files, packages and missing libraries that were added or
+removed.
+
+On Linux inotify is used to wake up as soon as a watched directory changes,
+otherwise files are polled at a fixed interval.
+"""
+import ctypes
+import os
+import select
+import sys
+import time
+from collections import Counter
+from typing import Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from . import Resolver, check_if_lib, DPKG_ADMINDIR
+from .elf import ElfParseError
+from .graph import INPUT, lib_paths
+from .vfs import LOCAL_FS
+
+_Stamp = Optional[Tuple[int, int, int]]
+
+# Wait for this long without changes before updating, so that files being
+# written by a build are not read half way through
+_SETTLE = 0.2
+
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+
+_IN_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+            IN_DELETE_SELF | IN_MOVE_SELF)
+
+
+class Diff(NamedTuple):
+    """ Changes to the totals since previous update, sorted.
+    """
+    added_files: List[str]
+    removed_files: List[str]
+    added_packages: List[str]
+    removed_packages: List[str]
+    added_missing: List[str]
+    removed_missing: List[str]
+
+    @property
+    def empty(self) -> bool:
+        return not any(self)
+
+    def as_dict(self):
+        return {'files': {'added': self.added_files, 'removed': self.removed_files},
+                'packages': {'added': self.added_packages, 'removed': self.removed_packages},
+                'missing': {'added': self.added_missing, 'removed': self.removed_missing}}
+
+
+class _Closure(NamedTuple):
+    pkgs: FrozenSet[str]
+    files: FrozenSet[str]
+    missing: FrozenSet[str]
+    watch: FrozenSet[str]   # non-packaged files of the closure, including the input
+    dirs: FrozenSet[str]    # directories that were searched for libraries
+
+
+def _unresolved(fname: str) -> _Closure:
+    """ Input that is missing or can not be parsed, watched for changes only """
+    return _Closure(frozenset(), frozenset(), frozenset(), frozenset([fname]), frozenset([os.path.dirname(fname)]))
+
+
+class _Inotify:
+    """ Directory change notifications, only used to wake up early.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add(self, path: str):
+        """ Watch directory ``path``, no-op if already watched or missing """
+        self._add_watch(self.fd, os.fsencode(path), _IN_MASK)
+
+    def wait(self, timeout: float) -> bool:
+        """ Wait for events, returns False on timeout """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        # only the fact that something changed matters
+        while True:
+            try:
+                if not os.read(self.fd, 65536):
+                    break
+            except BlockingIOError:
+                break
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _inotify() -> Optional[_Inotify]:
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return _Inotify()
+    except (OSError, AttributeError):
+        return None
+
+
+class Watcher:
+    """
+    Dependencies of ELF files or of a directory on the host file system,
+    updated incrementally.
+
+    Call ``update()`` to check for changes, first call resolves everything.
+    ``watch()`` does that in a loop.
+    """
+
+    def __init__(self,
+                 paths: List[str],
+                 resolver: Optional[Resolver] = None,
+                 dpkg: bool = False,
+                 dpkg_ignore: List[str] = [],
+                 verbose: bool = False):
+        """
+        :param paths: ELF files, or a single directory to scan for libraries
+                      (same as on the command line)
+
+        :param resolver: Resolver to use, keeps ELF files parsed between updates
+        """
+        self.resolver = Resolver() if resolver is None else resolver
+        self.fs = self.resolver.fs
+        if self.fs is not LOCAL_FS:
+            # images are assumed to not change, see Resolver
+            raise ValueError("Only the host file system can be watched")
+        self.dpkg = dpkg
+        self.dpkg_ignore = dpkg_ignore
+        self.verbose = verbose
+
+        self.prefix: Optional[str] = None
+        self._paths = list(paths)
+        if len(paths) == 1 and self.fs.isdir(paths[0]):
+            self.prefix = paths[0]
+
+        #: Inputs resolved by the last update
+        self.updated: List[str] = []
+
+        self._started = False
+        self._config = None
+        # directory of the input tree -> (stamp, libraries in it)
+        self._scanned: Dict[str, Tuple[_Stamp, List[str]]] = {}
+        self._results: Dict[str, _Closure] = {}
+        # watched path -> stamp, and inputs that use it
+        self._files: Dict[str, _Stamp] = {}
+        self._dirs: Dict[str, _Stamp] = {}
+        self._users: Dict[str, Set[str]] = {}
+        self._totals: Tuple[Counter, Counter, Counter] = (Counter(), Counter(), Counter())
+
+    @property
+    def inputs(self) -> List[str]:
+        if self.prefix is None:
+            return self._paths
+        return [p for _, libs in self._scanned.values() for p in libs]
+
+    def totals(self) -> Tuple[List[str], List[str], List[str]]:
+        """ Current results, same as ``process_elf``: [pkgs], [files], [missing-libs]
+        """
+        pkgs, files, missing = self._totals
+        return sorted(pkgs), sorted(files), sorted(missing)
+
+    def _stamp(self, path: str) -> _Stamp:
+        try:
+            st = self.fs.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, getattr(st, 'st_ino', 0))
+
+    def _scan(self, path: str) -> Set[str]:
+        """ (Re-)list directory of the input tree, new sub-directories are
+            scanned too. Returns directories that are gone.
+        """
+        stamp = self._stamp(path)
+        try:
+            entries = self.fs.listdir(path)
+        except OSError:
+            entries = []
+
+        libs: List[str] = []
+        subdirs: Set[str] = set()
+        for name, is_dir in entries:
+            child = os.path.join(path, name)
+            if is_dir:
+                subdirs.add(child)
+                if child not in self._scanned:
+                    self._scan(child)
+            elif check_if_lib(child, self.fs):
+                libs.append(child)
+        self._scanned[path] = (stamp, libs)
+
+        return set(d for d in self._scanned if os.path.dirname(d) == path and d not in subdirs)
+
+    def _rescan(self) -> bool:
+        """ Re-list changed directories of the input tree, True if any """
+        changed = [d for d, (stamp, _) in self._scanned.items() if self._stamp(d) != stamp]
+        for d in changed:
+            if d not in self._scanned:
+                continue  # removed with its parent
+            for gone in self._scan(d):
+                for sub in [s for s in self._scanned if s == gone or s.startswith(gone + '/')]:
+                    del self._scanned[sub]
+        return len(changed) > 0
+
+    def _resolve(self, fnames: List[str]) -> Dict[str, Optional[_Closure]]:
+        """ Closures of ``fnames``, None for inputs that could not be resolved """
+        resolver = self.resolver
+        try:
+            graph, roots = resolver.resolve(fnames, self.verbose)
+        except (OSError, ElfParseError):
+            if len(fnames) == 1:
+                if self.verbose:
+                    print(f"Failed to resolve: {fnames[0]}", file=sys.stderr)
+                return {fnames[0]: None}
+            # find out which one
+            out: Dict[str, Optional[_Closure]] = {}
+            for fname in fnames:
+                out.update(self._resolve([fname]))
+            return out
+
+        pkg_of = resolver.pkg_lookup(graph, self.dpkg_ignore, self.prefix) if self.dpkg else None
+        masks = graph.closures(roots, pkg_of)
+        out = {}
+        for root in roots:
+            name = graph.nodes[root].name
+            pkgs: Set[str] = set()
+            files: Set[str] = set()
+            missing: Set[str] = set()
+            watch: Set[str] = {name}
+            dirs: Set[str] = {os.path.dirname(name)}
+            for nid in graph.closure_nodes(masks[root]):
+                node = graph.nodes[nid]
+                if node.ldpaths != INPUT:
+                    dirs.update(node.ldpaths)
+                if node.path is None:
+                    missing.add(node.name)
+                pkg = None if pkg_of is None else pkg_of(nid)
+                if pkg is not None:
+                    pkgs.add(pkg)
+                    continue
+                for p in lib_paths(node.path, node.realpath, graph.fs, graph.cache):
+                    watch.add(p)
+                    if self.prefix is None or not p.startswith(self.prefix):
+                        files.add(p)
+            out[name] = _Closure(frozenset(pkgs), frozenset(files), frozenset(missing),
+                                 frozenset(watch), frozenset(dirs))
+        return out
+
+    def _set(self, fname: str, closure: Optional[_Closure], stamps: Dict[str, _Stamp]):
+        """ Replace results of one input, ``stamps`` are stamps taken before resolving """
+        old = self._results.pop(fname, None)
+        if old is not None:
+            for total, items in zip(self._totals, old[:3]):
+                total.subtract(items)
+            for p in old.watch | old.dirs:
+                users = self._users[p]
+                users.discard(fname)
+                if not users:
+                    del self._users[p]
+                    self._files.pop(p, None)
+                    self._dirs.pop(p, None)
+
+        if closure is None:
+            return
+        self._results[fname] = closure
+        for total, items in zip(self._totals, closure[:3]):
+            total.update(items)
+        for paths, watched in ((closure.watch, self._files), (closure.dirs, self._dirs)):
+            for p in paths:
+                self._users.setdefault(p, set()).add(fname)
+                if p not in watched:
+                    watched[p] = stamps[p] if p in stamps else self._stamp(p)
+
+    def update(self) -> Diff:
+        """ Check for changes and resolve affected inputs again.
+        """
+        config = self.resolver._config_stamp()
+        affected: Set[str] = set()
+        stamps: Dict[str, _Stamp] = {}
+        changed = False
+
+        if not self._started:
+            self._started = True
+            self._config = config
+            if self.prefix is not None:
+                self._scan(self.prefix)
+            affected.update(self.inputs)
+        else:
+            if config != self._config:
+                self._config = config
+                affected.update(self._results)
+                changed = True
+
+            for watched in (self._files, self._dirs):
+                for p, stamp in watched.items():
+                    stamps[p] = self._stamp(p)
+                    if stamps[p] != stamp:
+                        affected.update(self._users[p])
+                        changed = True
+
+            if self.prefix is not None and self._rescan():
+                changed = True
+
+        inputs = self.inputs
+        current = set(inputs)
+        # new inputs and inputs that are gone
+        affected.update(p for p in current if p not in self._results)
+        affected.update(p for p in self._results if p not in current)
+
+        if changed:
+            # symlinks, directory listings and library search results
+            self.resolver.invalidate()
+
+        # (pkgs, files, missing) that can change and whether they were there before
+        touched: List[Set[str]] = [set(), set(), set()]
+        for fname in affected:
+            self._touch(touched, self._results.get(fname))
+        before = [set(k for k in items if total[k] > 0) for total, items in zip(self._totals, touched)]
+
+        todo = [p for p in inputs if p in affected]
+        if self.verbose and todo:
+            print(f"Resolving {len(todo)} inputs", file=sys.stderr)
+
+        results: Dict[str, Optional[_Closure]] = {p: None for p in affected if p not in current}
+        existing = [p for p in todo if self.fs.exists(p)]
+        results.update((p, _unresolved(p)) for p in todo if p not in existing)
+        if existing:
+            for fname, closure in self._resolve(existing).items():
+                if closure is None:
+                    # probably still being written, keep old results until it changes again
+                    closure = self._results.get(fname) or _unresolved(fname)
+                results[fname] = closure
+
+        for fname, closure in results.items():
+            self._set(fname, closure, stamps)
+            self._touch(touched, closure)
+        self.updated = todo
+
+        changes: List[Tuple[List[str], List[str]]] = []
+        for total, items, was in zip(self._totals, touched, before):
+            added = sorted(k for k in items if k not in was and total[k] > 0)
+            removed = sorted(k for k in items if k in was and total[k] <= 0)
+            for k in items:
+                if k in total and total[k] <= 0:
+                    del total[k]
+            changes.append((added, removed))
+
+        pkgs, files, missing = changes
+        return Diff(files[0], files[1], pkgs[0], pkgs[1], missing[0], missing[1])
+
+    @staticmethod
+    def _touch(touched: List[Set[str]], closure: Optional[_Closure]):
+        if closure is not None:
+            for items, new in zip(touched, closure[:3]):
+                items.update(new)
+
+    def _watched_dirs(self) -> Set[str]:
+        dirs = set(self._dirs) | set(self._scanned)
+        dirs.update(os.path.dirname(p) for p in self._files)
+        # ld.so.conf, ld.so.cache and dpkg database
+        dirs.update(['/etc', '/etc/ld.so.conf.d', DPKG_ADMINDIR])
+        return dirs
+
+    def watch(self, interval: float = 1.0) -> Iterator[Diff]:
+        """ Yield changes forever, empty updates are skipped.
+
+            :param interval: Seconds between updates when polling, with
+                             inotify updates happen when something changes
+                             (but at least every ten intervals)
+        """
+        notify = _inotify()
+        try:
+            if not self._started:
+                yield self.update()
+            while True:
+                if notify is None:
+                    time.sleep(interval)
+                else:
+                    for d in self._watched_dirs():
+                        notify.add(d)
+                    if notify.wait(interval * 10):
+                        deadline = time.monotonic() + interval
+                        while time.monotonic() < deadline and notify.wait(_SETTLE):
+                            pass
+                diff = self.update()
+                if not diff.empty:
+                    yield diff
+        finally:
+            if notify is not None:
+                notify.close()
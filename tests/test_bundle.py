@@ -0,0 +1,133 @@
+import errno
+import filecmp
+import os
+import tarfile
+
+import pytest
+
+from lddcollect.bundle import bundle_dir, bundle_tar, plan_bundle
+from lddcollect.synth import generate_tree
+from lddcollect.vfs import DirFS, TarFS
+
+
+def _src(d):
+    os.makedirs(os.path.join(d, "usr", "lib"))
+    with open(os.path.join(d, "usr", "lib", "libfoo.so.1.0"), "wb") as f:
+        f.write(b"\x7fELF" + b"x" * 100)
+    os.chmod(os.path.join(d, "usr", "lib", "libfoo.so.1.0"), 0o755)
+    os.symlink("libfoo.so.1.0", os.path.join(d, "usr", "lib", "libfoo.so.1"))
+    os.symlink("usr/lib", os.path.join(d, "lib"))
+
+
+def test_bundle_dir(tmp_path):
+    src = str(tmp_path / "src")
+    _src(src)
+    lib = os.path.join(src, "lib", "libfoo.so.1")
+
+    plan = plan_bundle([lib])
+    assert plan.links[os.path.join(src, "lib")] == "usr/lib"
+    assert plan.files == [os.path.join(src, "usr", "lib", "libfoo.so.1.0")]
+
+    dest = str(tmp_path / "dest")
+    stats = bundle_dir([lib], dest)
+    assert (stats.copied, stats.skipped, stats.links) == (1, 0, 2)
+
+    copied = dest + lib
+    assert os.path.islink(dest + os.path.join(src, "lib"))
+    assert os.readlink(copied) == "libfoo.so.1.0"
+    with open(copied, "rb") as f:
+        assert f.read(4) == b"\x7fELF"
+    st = os.stat(copied)
+    assert st.st_mode & 0o777 == 0o755
+    assert st.st_mtime_ns == os.stat(lib).st_mtime_ns
+
+    stats = bundle_dir([lib], dest)
+    assert (stats.copied, stats.skipped) == (0, 1)
+
+    # modified source is copied again
+    with open(lib, "ab") as f:
+        f.write(b"y")
+    stats = bundle_dir([lib], dest, workers=2)
+    assert (stats.copied, stats.skipped) == (1, 0)
+    assert os.path.getsize(copied) == 105
+
+
+def test_bundle_tar(tmp_path):
+    src = str(tmp_path / "src")
+    _src(src)
+    out = str(tmp_path / "out.tar.gz")
+    fs = DirFS(src)
+
+    stats = bundle_tar(["/lib/libfoo.so.1"], out, fs)
+    assert (stats.copied, stats.links, stats.bytes) == (1, 2, 104)
+
+    with tarfile.open(out) as tar:
+        members = {m.name: m for m in tar}
+    assert members["lib"].issym() and members["lib"].linkname == "usr/lib"
+    assert members["usr/lib/libfoo.so.1"].linkname == "libfoo.so.1.0"
+    assert members["usr/lib/libfoo.so.1.0"].size == 104
+    assert members["usr/lib/libfoo.so.1.0"].mode == 0o755
+
+    dest = str(tmp_path / "dest")
+    bundle_dir(["/lib/libfoo.so.1"], dest, fs)
+    assert os.path.getsize(os.path.join(dest, "lib", "libfoo.so.1")) == 104
+
+
+def test_bundle_dir_from_tar(tmp_path):
+    tree = generate_tree(str(tmp_path / "root"), libs=400, bins=10, depth=2)
+    tar = str(tmp_path / "root.tar")
+    with tarfile.open(tar, "w") as t:
+        t.add(tree.root, arcname=".")
+    fs = TarFS([tar])
+
+    files = tree.libs + tree.bins
+    for i in range(5):
+        # threads copy from the same layer file
+        dest = str(tmp_path / f"dest{i}")
+        stats = bundle_dir(files, dest, fs, workers=8)
+        assert stats.copied == len(plan_bundle(files, fs).files)
+        for path in files:
+            assert filecmp.cmp(tree.root + path, dest + path, shallow=False), path
+    fs.close()
+
+
+def test_bundle_relative(tmp_path, monkeypatch):
+    src = str(tmp_path / "src")
+    _src(src)
+    monkeypatch.chdir(src)
+
+    plan = plan_bundle(["lib/libfoo.so.1"])
+    assert plan.files == [os.path.join(src, "usr", "lib", "libfoo.so.1.0")]
+
+    stats = bundle_dir(["./lib/libfoo.so.1"], "../dest")
+    assert stats.copied == 1
+    assert os.path.islink(str(tmp_path / "dest") + os.path.join(src, "lib", "libfoo.so.1"))
+
+
+@pytest.mark.skipif(not hasattr(os, 'sendfile'), reason="no sendfile")
+def test_copy_fallback(tmp_path, monkeypatch):
+    import lddcollect.bundle
+
+    src = str(tmp_path / "src")
+    _src(src)
+    # no reflink, copy_file_range fails as across file systems on old kernels
+    monkeypatch.setattr(lddcollect.bundle, '_reflink', lambda src, dst: False)
+
+    def copy_file_range(*args):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(os, 'copy_file_range', copy_file_range, raising=False)
+    sendfile_calls = []
+    sendfile = os.sendfile
+
+    def _sendfile(*args):
+        sendfile_calls.append(args)
+        return sendfile(*args)
+
+    monkeypatch.setattr(os, 'sendfile', _sendfile)
+
+    dest = str(tmp_path / "dest")
+    stats = bundle_dir([src + "/lib/libfoo.so.1"], dest)
+    assert stats.copied == 1
+    assert sendfile_calls
+    assert filecmp.cmp(src + "/usr/lib/libfoo.so.1.0", dest + src + "/usr/lib/libfoo.so.1.0", shallow=False)
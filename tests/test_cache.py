@@ -0,0 +1,56 @@
+import os
+import shutil
+import sys
+from lddcollect.cache import ElfCache
+from lddcollect.elf import read_elf_info
+
+
+def test_elf_cache(tmp_path):
+    exe = str(tmp_path / "exe")
+    shutil.copy(os.path.realpath(sys.executable), exe)
+    info = read_elf_info(exe)
+    cache_dir = str(tmp_path / "cache")
+
+    with ElfCache(cache_dir) as cache:
+        assert cache.get(exe) is None
+        cache[exe] = info
+        assert cache.get(exe) == info
+        assert (cache.hits, cache.misses) == (0, 1)
+
+    with ElfCache(cache_dir) as cache:
+        assert cache.get(exe) == info
+        assert cache.hits == 1
+
+    # file changed: entry is stale
+    st = os.stat(exe)
+    os.utime(exe, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with ElfCache(cache_dir) as cache:
+        assert cache.get(exe) is None
+        assert cache.prune() == 1
+
+
+def test_elf_cache_auto_prune(tmp_path):
+    exe = str(tmp_path / "exe")
+    shutil.copy(os.path.realpath(sys.executable), exe)
+    lib = str(tmp_path / "lib")
+    shutil.copy(exe, lib)
+    info = read_elf_info(exe)
+    cache_dir = str(tmp_path / "cache")
+
+    def rows():
+        with ElfCache(cache_dir, prune_interval=None) as cache:
+            return sorted(path for path, in cache._db.execute('SELECT path FROM elf'))
+
+    with ElfCache(cache_dir) as cache:
+        cache[exe] = info
+        cache[lib] = info
+    assert rows() == [exe, lib]
+
+    os.unlink(lib)
+    st = os.stat(exe)
+    os.utime(exe, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    # pruned on close only once per interval
+    ElfCache(cache_dir).close()
+    assert rows() == [exe, lib]
+    ElfCache(cache_dir, prune_interval=0).close()
+    assert rows() == []
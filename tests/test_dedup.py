@@ -0,0 +1,103 @@
+import io
+import multiprocessing
+import os
+import shutil
+
+import pytest
+
+import lddcollect
+from lddcollect import process_elf, find_libs
+from lddcollect.dedup import elf_fingerprint, find_duplicates, report
+from lddcollect.stats import Stats, use
+from lddcollect.synth import generate_tree, elf_bytes
+from lddcollect.vfs import DirFS
+
+
+def test_find_duplicates(tmp_path):
+    tree = generate_tree(str(tmp_path / 'root'), libs=20, bins=2, depth=2, rpath='absolute')
+    src = tree.root + tree.libs[0]
+    other = tree.root + tree.libs[1]
+    assert os.path.getsize(src) == os.path.getsize(other)
+    assert elf_fingerprint(src) != elf_fingerprint(other)
+    assert elf_fingerprint(str(tmp_path / 'root' / 'etc' / 'ld.so.conf')) is None
+
+    copies = [str(tmp_path / d / 'libs0.so.1.0') for d in ('a', 'b')]
+    for copy in copies:
+        os.makedirs(os.path.dirname(copy))
+        shutil.copy(src, copy)
+    # not copies: symlink and hardlink to the same file
+    link, hardlink = str(tmp_path / 'a' / 'libs0.so.1'), str(tmp_path / 'b' / 'hardlink.so')
+    os.symlink(copies[0], link)
+    os.link(copies[1], hardlink)
+
+    inputs = [src, other, copies[0], link, copies[1], hardlink]
+    groups, elf_info = find_duplicates(inputs)
+    assert len(groups) == 1
+    assert groups[0].paths == [src] + copies
+    assert groups[0].wasted == 2 * os.path.getsize(src)
+    assert set(elf_info) == {src, copies[0], link, copies[1]}
+    assert elf_info[copies[1]].needed == elf_info[src].needed
+
+    out = io.StringIO()
+    report(groups, out)
+    assert out.getvalue().startswith('Duplicates: 1 groups, 3 files')
+
+
+def test_process_elf_dedup(tmp_path):
+    tree = generate_tree(str(tmp_path), libs=40, bins=5, fanout=2, depth=3, packaged=0)
+    for d in ('opt/a', 'opt/b'):
+        shutil.copytree(tree.root + '/usr/lib/synth/d0000', os.path.join(tree.root, d), symlinks=True)
+    fs = DirFS(tree.root)
+    inputs = list(find_libs('/opt', fs=fs))
+
+    stats, dedup_stats = Stats(), Stats()
+    with use(dedup_stats):
+        groups, elf_info = find_duplicates(inputs, fs)
+    assert len(groups) == len(tree.libs)
+    assert all(len(g.paths) == 2 for g in groups)
+    # one file of every group is parsed
+    assert dedup_stats.counters['elf_parse'] == len(groups)
+
+    expect = process_elf(inputs, dpkg=False, root=fs, stats=stats)
+    assert stats.counters['elf_parse'] >= 2 * len(groups)
+    assert process_elf(inputs, dpkg=False, root=fs, stats=dedup_stats, elf_info=elf_info) == expect
+    assert dedup_stats.counters['elf_parse'] == len(groups)
+    assert process_elf(inputs, dpkg=False, root=fs, workers=2, elf_info=elf_info) == expect
+
+
+def test_fingerprint_strings(tmp_path):
+    # same size and layout, needed libraries differ beyond the first page
+    long_name = 'lib' + 'x' * 5000 + '.so'
+    paths = []
+    for version in ('3.8', '3.9'):
+        path = str(tmp_path / f'ext{version}.so')
+        with open(path, 'wb') as f:
+            f.write(elf_bytes([long_name, f'libpython{version}.so.1.0'], soname='ext.so'))
+        paths.append(path)
+    with open(paths[0], 'rb') as a, open(paths[1], 'rb') as b:
+        assert a.read(4096) == b.read(4096)
+
+    assert elf_fingerprint(paths[0]) != elf_fingerprint(paths[1])
+    groups, elf_info = find_duplicates(paths)
+    assert groups == [] and elf_info == {}
+
+
+@pytest.mark.parametrize("initializer", [True, False])
+def test_process_elf_dedup_parallel(tmp_path, monkeypatch, initializer):
+    if not initializer and multiprocessing.get_start_method() != 'fork':
+        pytest.skip("workers are not forked")
+    tree = generate_tree(str(tmp_path), libs=40, bins=5, fanout=2, depth=3, packaged=0)
+    for d in ('opt/a', 'opt/b', 'opt/c'):
+        shutil.copytree(tree.root + '/usr/lib/synth/d0000', os.path.join(tree.root, d), symlinks=True)
+    fs = DirFS(tree.root)
+    inputs = list(find_libs('/opt', fs=fs))
+    groups, elf_info = find_duplicates(inputs, fs)
+    assert groups
+    expect = process_elf(inputs, dpkg=False, root=fs)
+
+    # Python 3.6 has no pool initializer, elf_info is inherited by forked workers
+    monkeypatch.setattr(lddcollect, '_POOL_INITIALIZER', initializer)
+    stats = Stats()
+    assert process_elf(inputs, dpkg=False, root=fs, workers=3, elf_info=elf_info, stats=stats) == expect
+    assert stats.counters.get('elf_parse', 0) == 0
+    assert lddcollect._worker_elf_info is None
@@ -0,0 +1,52 @@
+import os
+from lddcollect.dpkg import DpkgIndex, dpkg_s, dpkg_search
+
+
+def _mk_admindir(tmp_path):
+    admindir = tmp_path / "dpkg"
+    info = admindir / "info"
+    info.mkdir(parents=True)
+    (info / "libfoo1:amd64.list").write_text("/.\n/usr\n/usr/lib\n/usr/lib/libfoo.so.1\n")
+    (info / "bar.list").write_text("/.\n/usr\n/usr/bin\n/usr/bin/bar\n/usr/lib/libfoo.so.1\n")
+    (info / "bar.md5sums").write_text("")
+    (admindir / "diversions").write_text("/usr/lib/libfoo.so.1\n/usr/lib/libfoo.so.1.orig\nbar\n")
+    return str(admindir)
+
+
+def test_index(tmp_path):
+    admindir = _mk_admindir(tmp_path)
+    idx = DpkgIndex.from_admindir(admindir, root=str(tmp_path))
+
+    assert idx.lookup("/usr/bin/bar") == "bar"
+    # directories are not owned by every package that has files in them
+    assert idx.lookup("/usr") is None
+    assert idx.lookup("/usr/lib") is None
+    assert idx.lookup("/usr/lib/libfoo.so.1") == "bar"
+    assert idx.lookup("/usr/lib/libfoo.so.1.orig") == "libfoo1:amd64"
+    assert idx.lookup("/no/such/file") is None
+
+    found, missing = idx.search(["/usr/bin/bar", "/no/such/file"])
+    assert found == [("bar", "/usr/bin/bar")]
+    assert missing == ["/no/such/file"]
+
+
+def test_index_snapshot(tmp_path):
+    admindir = _mk_admindir(tmp_path)
+    cache_file = str(tmp_path / "cache" / "dpkg.pickle")
+
+    idx = DpkgIndex.load(admindir, cache_file=cache_file)
+    assert os.path.exists(cache_file)
+    idx2 = DpkgIndex.load(admindir, cache_file=cache_file)
+    assert idx2.stamp == idx.stamp
+    assert idx2.lookup("/usr/bin/bar") == "bar"
+
+    # new package installed: snapshot is stale
+    (tmp_path / "dpkg" / "info" / "baz.list").write_text("/usr/bin/baz\n")
+    os.utime(str(tmp_path / "dpkg" / "info"), ns=(0, idx.stamp[0] + 10**9))
+    idx3 = DpkgIndex.load(admindir, cache_file=cache_file)
+    assert idx3.lookup("/usr/bin/baz") == "baz"
+
+
+def test_matches_dpkg_s():
+    files = ["/usr/bin/dpkg", "/no/such/file/fa61bffb9352"]
+    assert dpkg_search(files) == dpkg_s(*files)
@@ -0,0 +1,31 @@
+import os
+import sys
+import pytest
+from lddcollect.elf import read_elf_info, _read_elf_info_elftools, ElfParseError, read_compat
+
+
+def _system_elfs():
+    exe = os.path.realpath(sys.executable)
+    return [exe] + [os.path.realpath(p) for p in ("/bin/ls", "/lib/x86_64-linux-gnu/libc.so.6")
+                    if os.path.exists(p)]
+
+
+@pytest.mark.parametrize("path", _system_elfs())
+def test_matches_pyelftools(path):
+    info = read_elf_info(path)
+    assert info == _read_elf_info_elftools(path)
+    assert info.compat == read_compat(path)
+
+
+def test_not_elf(tmp_path):
+    fname = str(tmp_path / "libc.so")
+    with open(fname, "wt") as f:
+        f.write("GROUP ( /lib/libc.so.6 )\n" * 4)
+
+    with pytest.raises(ElfParseError):
+        read_elf_info(fname)
+
+    empty = tmp_path / "empty.so"
+    empty.write_bytes(b"")
+    with pytest.raises(ElfParseError):
+        read_elf_info(str(empty))
@@ -0,0 +1,22 @@
+import os
+import shutil
+import sys
+from lddcollect import find_libs, is_shared_elf, is_elf
+
+
+def test_find_libs(tmp_path):
+    exe = os.path.realpath(sys.executable)
+    d = tmp_path / "prefix"
+    (d / "sub").mkdir(parents=True)
+    (d / "libtext.so").write_text("INPUT(-lc)\n")
+    (d / "README").write_text("not a lib\n")
+    for i in range(20):
+        shutil.copy(exe, str(d / "sub" / f"libx{i}.so.1"))
+
+    assert is_elf(exe)
+    assert is_shared_elf(exe)
+    assert not is_elf(str(d / "README"))
+
+    expect = sorted(str(d / "sub" / f"libx{i}.so.1") for i in range(20))
+    assert sorted(find_libs(str(d))) == expect
+    assert list(find_libs(str(d), workers=4)) == list(find_libs(str(d)))
@@ -0,0 +1,79 @@
+import os
+import pickle
+import sys
+from lddcollect import resolve_graph, _update_realpath
+from lddcollect.graph import DepGraph, INPUT
+from lddcollect.synth import elf_bytes
+from lddcollect.vendor.lddtree import lddtree
+
+
+def _graph():
+    g = DepGraph()
+    a = g.add_node("a", INPUT, "/a", "/a")
+    b = g.add_node("b", INPUT, "/b", "/b")
+    x = g.add_node("libx.so", (), "/lib/libx.so", "/lib/libx.so")
+    y = g.add_node("liby.so", (), "/lib/liby.so", "/lib/liby.so")
+    z = g.add_node("libz.so", (), None, None)
+    g.add_edge(a, x)
+    g.add_edge(x, y)
+    g.add_edge(y, x)  # cycle
+    g.add_edge(b, y)
+    g.add_edge(y, z)
+    return g, [a, b], (x, y, z)
+
+
+def test_closures():
+    g, (a, b), (x, y, z) = _graph()
+    masks = g.closures([a, b])
+    assert sorted(g.closure_nodes(masks[a])) == [a, x, y, z]
+    assert sorted(g.closure_nodes(masks[b])) == [b, x, y, z]
+
+    pkgs, files, missing = g.collect([a])
+    assert files == {"/a", "/lib/libx.so", "/lib/liby.so"}
+    assert missing == [z]
+
+    # packaged libs are not followed
+    masks = g.closures([a, b], pkg_of=lambda nid: "pkg" if nid == x else None)
+    assert sorted(g.closure_nodes(masks[a])) == [a, x]
+
+
+def test_why():
+    g, (a, b), (x, y, z) = _graph()
+    assert g.why([z], [a, b]) == {a: [a, x, y, z], b: [b, y, z]}
+    assert g.why(g.find("libx.so"), [b]) == {b: [b, y, x]}
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_to_dict(tmp_path):
+    libs, zdir = str(tmp_path / "libs"), str(tmp_path / "z")
+    _write(libs + "/libx.so", elf_bytes(["liby.so"], soname="libx.so"))
+    _write(libs + "/liby.so", elf_bytes(soname="liby.so"))
+    _write(libs + "/libz.so", elf_bytes(["liby.so"], soname="libz.so", runpath=zdir))
+    _write(zdir + "/liby.so", elf_bytes(soname="liby.so"))
+    # liby.so is found in z/ for app_a (through libz.so) and in libs/ for app_b,
+    # libx.so is the same node in both trees
+    app_a, app_b = str(tmp_path / "app_a"), str(tmp_path / "app_b")
+    _write(app_a, elf_bytes(["libz.so", "libx.so"], runpath=libs, interp="/lib64/ld-linux-x86-64.so.2"))
+    _write(app_b, elf_bytes(["libx.so"], rpath=libs))
+    inputs = [app_a, app_b, os.path.realpath(sys.executable)]
+
+    expect = []
+    for fname in inputs:
+        ltree = lddtree(fname)
+        _update_realpath(ltree)
+        expect.append(ltree)
+    assert expect[1]["libs"]["liby.so"]["path"] == libs + "/liby.so"
+
+    graph, roots = resolve_graph(inputs)
+    assert [graph.to_dict(r) for r in roots] == expect
+    graph2 = pickle.loads(pickle.dumps(graph))
+    assert [graph2.to_dict(r) for r in roots] == expect
+
+    # merged from worker processes
+    graph, roots = resolve_graph(inputs, workers=2)
+    assert [graph.to_dict(r) for r in roots] == expect
@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+from lddcollect import process_elf
+from lddcollect.synth import elf_bytes
+from lddcollect.vendor.lddtree import FsCache, link_chain, find_lib, readlink
+from lddcollect.elf import read_compat
+
+
+def test_link_chain(tmp_path):
+    d = str(tmp_path)
+    open(os.path.join(d, "libfoo.so.1.2"), "wb").close()
+    os.symlink("libfoo.so.1.2", os.path.join(d, "libfoo.so.1"))
+    os.symlink(os.path.join(d, "libfoo.so.1"), os.path.join(d, "libfoo.so"))
+
+    assert link_chain(d + "/libfoo.so") == (d + "/libfoo.so", d + "/libfoo.so.1", d + "/libfoo.so.1.2")
+    assert link_chain(d + "/libfoo.so.1.2") == (d + "/libfoo.so.1.2",)
+    assert readlink(d + "/libfoo.so", "/") == d + "/libfoo.so.1.2"
+
+    cache = FsCache()
+    assert link_chain(d + "/libfoo.so", cache=cache)[-1] == d + "/libfoo.so.1.2"
+    os.unlink(os.path.join(d, "libfoo.so"))
+    assert link_chain(d + "/libfoo.so", cache=cache)[-1] == d + "/libfoo.so.1.2"
+    assert link_chain(d + "/libfoo.so") == (d + "/libfoo.so",)
+
+
+def test_find_lib(tmp_path):
+    exe = os.path.realpath(sys.executable)
+    compat = read_compat(exe)
+    assert compat is not None
+
+    a, b = str(tmp_path / "a"), str(tmp_path / "b")
+    os.makedirs(a)
+    os.makedirs(b)
+    # not an ELF, should be skipped
+    with open(os.path.join(a, "libx.so"), "wt") as f:
+        f.write("INPUT(libc.so.6)\n")
+    shutil.copy(exe, os.path.join(b, "libx.so.1"))
+    os.symlink("libx.so.1", os.path.join(b, "libx.so"))
+
+    assert find_lib(compat, "libx.so", [a, b]) == (os.path.join(b, "libx.so.1"), os.path.join(b, "libx.so"))
+    assert find_lib(compat, "liby.so", [a, b]) == (None, None)
+
+
+def test_caches_per_call(tmp_path):
+    # library created after the first call is found by the next one
+    d = str(tmp_path)
+    app = os.path.join(d, "app")
+    with open(app, "wb") as f:
+        f.write(elf_bytes(["libq.so.1"], runpath=d))
+    assert process_elf(app, dpkg=False)[2] == ["libq.so.1"]
+
+    with open(os.path.join(d, "libq.so.1"), "wb") as f:
+        f.write(elf_bytes(soname="libq.so.1"))
+    _, files, missing = process_elf(app, dpkg=False)
+    assert missing == []
+    assert os.path.join(d, "libq.so.1") in files
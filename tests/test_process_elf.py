@@ -0,0 +1,100 @@
+import os
+import sys
+import pytest
+from lddcollect import process_elf
+
+
+def _inputs():
+    return [os.path.realpath(sys.executable)] + [p for p in ("/bin/ls", "/usr/bin/dpkg") if os.path.exists(p)]
+
+
+def test_process_elf_single():
+    exe = _inputs()[0]
+    pkgs, files, missing = process_elf(exe, dpkg=False)
+    assert pkgs == []
+    assert exe in files
+    assert missing == []
+
+
+def test_process_elf_parallel(tmp_path, monkeypatch):
+    import lddcollect
+    from lddcollect.synth import generate_tree
+
+    tree = generate_tree(str(tmp_path), libs=40, bins=20, depth=2, host_paths=True)
+    inputs = tree.bins + tree.libs[:4]
+    expect = process_elf(inputs, dpkg=False)
+    assert set(inputs) <= set(expect[1])
+
+    chunks = []
+    orig_chunks = lddcollect._chunks
+
+    def _chunks(items, n):
+        for chunk in orig_chunks(items, n):
+            chunks.append(chunk)
+            yield chunk
+
+    # few inputs are still split between all workers
+    monkeypatch.setattr(lddcollect, '_chunks', _chunks)
+    assert process_elf(inputs, dpkg=False, workers=3) == expect
+    assert [len(c) for c in chunks] == [2] * 12
+    assert lddcollect._chunk_size(range(1000), 3) == 32
+    assert lddcollect._chunk_size(iter(inputs), 3) == 32
+
+    # size of an iterator is not known
+    chunks.clear()
+    assert process_elf(iter(inputs), dpkg=False, workers=3) == expect
+    assert [len(c) for c in chunks] == [24]
+
+
+def test_graph_roundtrip():
+    import pickle
+    from lddcollect import resolve_graph
+
+    inputs = _inputs()
+    graph, roots = resolve_graph(inputs)
+    assert [graph.nodes[r].name for r in roots] == inputs
+
+    graph2 = pickle.loads(pickle.dumps(graph))
+    assert len(graph2) == len(graph)
+    assert graph2.collect(roots) == graph.collect(roots)
+
+    tree = graph.to_dict(roots[0])
+    assert tree['path'] == inputs[0]
+    assert set(tree['libs']) >= set(tree['needed'])
+
+
+def test_per_input_and_why():
+    from lddcollect import process_elf_per_input, resolve_graph, why
+
+    inputs = _inputs()
+    results = process_elf_per_input(inputs, dpkg=False)
+    assert list(results) == inputs
+    for fname in inputs:
+        _, files, missing = process_elf([fname], dpkg=False)
+        assert results[fname] == ([], sorted(files), sorted(missing))
+
+    graph, roots = resolve_graph(inputs)
+    chains = why(graph, roots, "libc.so.6")
+    assert set(chains) == set(inputs)
+    for fname, chain in chains.items():
+        assert chain[0].name == fname
+        assert chain[-1].name == "libc.so.6"
+    assert why(graph, roots, "libnosuchlib.so.7") == {}
+
+
+def test_process_elf_parallel_no_initializer(tmp_path, monkeypatch):
+    import multiprocessing
+    import lddcollect
+    from lddcollect.synth import generate_tree
+    from lddcollect.vfs import DirFS
+
+    if multiprocessing.get_start_method() != 'fork':
+        pytest.skip("workers are not forked")
+    tree = generate_tree(str(tmp_path), libs=20, bins=6, depth=2)
+    fs = DirFS(tree.root)
+    expect = process_elf(tree.bins, dpkg=False, root=fs)
+
+    # Python 3.6: no pool initializer, workers inherit file system from the parent
+    monkeypatch.setattr(lddcollect, '_POOL_INITIALIZER', False)
+    assert process_elf(tree.bins, dpkg=False, root=fs, workers=2) == expect
+    assert lddcollect._worker_fs is lddcollect.LOCAL_FS
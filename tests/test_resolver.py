@@ -0,0 +1,79 @@
+import os
+import shutil
+import sys
+import threading
+from lddcollect import Resolver, process_elf
+from lddcollect.cache import StatElfCache
+from lddcollect.elf import read_elf_info
+from lddcollect.server import make_server, query, handle
+
+
+def test_resolver(tmp_path):
+    exe = os.path.realpath(sys.executable)
+    d = str(tmp_path / "bin")
+    os.makedirs(d)
+    app = os.path.join(d, "app")
+    shutil.copy(exe, app)
+
+    expect = process_elf(app, dpkg=False)
+    resolver = Resolver()
+    assert resolver.process_elf(app, dpkg=False) == expect
+    assert resolver.process_elf(app, dpkg=False) == expect
+    assert resolver.invalidations == 0
+    assert not resolver.refresh()
+
+    # input directory changed
+    os.symlink("app", os.path.join(d, "app2"))
+    assert resolver.refresh()
+    assert resolver.invalidations == 1
+
+    results = resolver.per_input([app, os.path.join(d, "app2")], dpkg=False)
+    assert results[app][1] == sorted(expect[1])
+    assert os.path.join(d, "app2") in results[os.path.join(d, "app2")][1]
+    resolver.close()
+
+
+def test_stat_elf_cache(tmp_path):
+    exe = os.path.realpath(sys.executable)
+    path = str(tmp_path / "app")
+    shutil.copy(exe, path)
+
+    cache = StatElfCache()
+    info = read_elf_info(path)
+    cache[path] = info
+    assert cache.get(path) == info
+
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    assert cache.get(path) is None
+
+
+def test_server(tmp_path):
+    exe = os.path.realpath(sys.executable)
+    sock = str(tmp_path / "ldd.sock")
+    resolver = Resolver()
+    server = make_server(sock, resolver)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert query(sock, {'op': 'ping'}) == {'ok': True}
+
+        response = query(sock, {'paths': [exe]})
+        assert response == handle(resolver, {'paths': [exe]})
+        _, files, missing = process_elf([exe], dpkg=False)
+        assert response['files'] == sorted(files)
+        assert response['missing'] == missing
+        assert 'packages' not in response
+
+        response = query(sock, {'paths': [exe], 'per_input': True, 'dpkg': True})
+        assert set(response['inputs'][exe]) == {'files', 'packages', 'missing'}
+
+        try:
+            query(sock, {'paths': ['relative/path']})
+            assert False, "expected error"
+        except RuntimeError as e:
+            assert 'absolute' in str(e)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,66 @@
+import io
+import json
+from lddcollect import process_elf, process_elf_per_input
+from lddcollect.stats import Stats, count, phase, use
+from lddcollect.synth import generate_tree
+from lddcollect.vfs import DirFS
+
+
+def test_stats_object():
+    count('open')  # nothing active, ignored
+    stats = Stats(trace=True)
+    with use(stats):
+        with use(None):
+            count('open')
+        with phase('a'):
+            count('open', 2)
+            with phase('b'):
+                count('stat')
+        with phase('a'):
+            count('open')
+    count('open')
+
+    assert stats.counters == {'open': 4, 'stat': 1}
+    assert stats.phases['a']['open'] == 3
+    assert stats.phases['a']['stat'] == 1
+    assert dict(stats.phases['b']) == {'wall': stats.phases['b']['wall'], 'stat': 1}
+    assert stats.as_dict()['counters'] == {'open': 4, 'stat': 1}
+
+    out = io.StringIO()
+    stats.write_trace(out)
+    events = json.loads(out.getvalue())['traceEvents']
+    assert [e['name'] for e in events] == ['a', 'b', 'a']
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+
+    out = io.StringIO()
+    stats.report(out)
+    assert 'total' in out.getvalue()
+
+
+def test_process_elf_stats(tmp_path):
+    tree = generate_tree(str(tmp_path), libs=40, bins=5, fanout=2, depth=3)
+    fs = DirFS(tree.root)
+
+    stats = Stats()
+    pkgs, files, missing = process_elf(tree.bins, dpkg=True, root=fs, stats=stats)
+    assert missing == []
+    assert list(stats.phases) == ['resolve', 'pkg', 'collect']
+
+    resolve = stats.phases['resolve']
+    # every ELF file is parsed once, shared libraries are found through the cache
+    assert resolve['elf_parse'] == resolve['elf_cache_miss']
+    assert resolve['elf_parse'] <= len(tree.bins) + len(tree.libs) + 1
+    assert resolve['find_cache_miss'] == resolve['find_lib']
+    assert resolve['open'] >= resolve['elf_parse']
+    assert resolve['bytes_read'] > 0
+    assert stats.phases['pkg']['listdir'] >= 1
+    assert stats.phases['collect']['dpkg_lookup'] > 0
+
+    parallel = Stats()
+    assert process_elf(tree.bins, dpkg=True, root=fs, workers=2, stats=parallel) == (pkgs, files, missing)
+    # counts of worker processes are added in
+    assert parallel.phases['resolve']['elf_parse'] >= resolve['elf_parse']
+
+    stats = Stats()
+    process_elf_per_input(tree.bins, dpkg=False, root=fs, stats=stats)
+    assert list(stats.phases) == ['resolve', 'collect']
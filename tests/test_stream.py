@@ -0,0 +1,82 @@
+import os
+import pytest
+from lddcollect import process_elf, find_libs, _chunks, _make_caches, _resolve_chunk
+from lddcollect.stream import stream_records
+from lddcollect.synth import generate_tree
+from lddcollect.vfs import DirFS
+
+
+def _records(batches):
+    records = [r for batch in batches for r in batch]
+    by_type = {}
+    for r in records:
+        by_type.setdefault(r['type'], []).append(r.get('path', r.get('name')))
+    return records, by_type
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_stream_records(tmp_path, workers):
+    tree = generate_tree(str(tmp_path), libs=60, bins=20, fanout=2, depth=3, packaged=0.3)
+    fs = DirFS(tree.root)
+    # break one library of the last layer
+    os.unlink(tree.root + tree.libs[-1])
+
+    inputs = tree.bins + list(find_libs('/usr/lib', fs=fs))
+    pkgs, files, missing = process_elf(inputs, dpkg=True, root=fs)
+    assert len(missing) == 1
+
+    batches = stream_records(iter(inputs), dpkg=True, workers=workers, fs=fs, chunk_size=7)
+    records, by_type = _records(batches)
+
+    assert sorted(by_type['input']) == sorted(inputs)
+    assert sorted(by_type['file']) == sorted(files)
+    assert sorted(by_type['package']) == sorted(pkgs)
+    assert by_type['missing'] == missing
+    assert records[-1] == {'type': 'done', 'inputs': len(inputs), 'files': len(files),
+                           'packages': len(pkgs), 'missing': 1}
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_stream_input_batches(tmp_path, workers):
+    tree = generate_tree(str(tmp_path), libs=20, bins=20, depth=2)
+    fs = DirFS(tree.root)
+
+    batches = [b for b in stream_records(iter(tree.bins), dpkg=False, workers=workers, fs=fs, chunk_size=3)]
+    assert len(batches) == 8
+    # inputs come with results of their own chunk
+    for i, batch in enumerate(batches[:-1]):
+        inputs = [r['path'] for r in batch if r['type'] == 'input']
+        assert inputs == tree.bins[i * 3:i * 3 + 3]
+        assert set(inputs) <= {r['path'] for r in batch if r['type'] == 'file'}
+
+
+def test_stream_first_batch(tmp_path):
+    tree = generate_tree(str(tmp_path), libs=20, bins=10, depth=2)
+    fs = DirFS(tree.root)
+
+    pulled = []
+
+    def inputs():
+        for p in tree.bins:
+            pulled.append(p)
+            yield p
+
+    batches = stream_records(inputs(), dpkg=False, fs=fs, chunk_size=2)
+    first = next(batches)
+    # results of the first chunk come out before the rest of inputs is read
+    assert len(pulled) == 2
+    assert [r['path'] for r in first if r['type'] == 'input'] == tree.bins[:2]
+    assert any(r['type'] == 'file' for r in first)
+    batches.close()
+
+
+def test_evict_inputs(tmp_path):
+    tree = generate_tree(str(tmp_path), libs=20, bins=40, fanout=2, depth=2, host_paths=True)
+    caches = _make_caches(None)
+    for chunk in _chunks(tree.bins, 8):
+        roots, graph, _, _ = _resolve_chunk(chunk, caches=caches, evict_inputs=True)
+        assert len(roots) == len(chunk)
+    # only libraries stay cached, not the inputs
+    elf_cache = caches[0]
+    assert not set(tree.bins) & set(elf_cache)
+    assert 0 < len(elf_cache) <= len(tree.libs) + 1
@@ -0,0 +1,68 @@
+import pytest
+from lddcollect import process_elf
+from lddcollect.bench import run
+from lddcollect.elf import read_elf_info, _read_elf_info_elftools, ElfCompat
+from lddcollect.synth import elf_bytes, generate_tree, RPATH_MODES, EM_386
+from lddcollect.vfs import DirFS
+
+
+@pytest.mark.parametrize("elfclass", [32, 64])
+@pytest.mark.parametrize("little_endian", [True, False])
+def test_elf_bytes(tmp_path, elfclass, little_endian):
+    fname = str(tmp_path / "libx.so")
+    with open(fname, 'wb') as f:
+        f.write(elf_bytes(['liba.so.1', 'libb.so.2'], soname='libx.so', rpath='/opt/lib',
+                          runpath='$ORIGIN/../lib', interp='/lib/ld.so.1',
+                          elfclass=elfclass, little_endian=little_endian))
+
+    info = read_elf_info(fname)
+    assert info == _read_elf_info_elftools(fname)
+    assert info.compat == ElfCompat(elfclass, little_endian, 62 if elfclass == 64 else EM_386, 0)
+    assert info.interp == '/lib/ld.so.1'
+    assert info.needed == ('liba.so.1', 'libb.so.2')
+    assert (info.rpath, info.runpath) == ('/opt/lib', '$ORIGIN/../lib')
+
+
+@pytest.mark.parametrize("rpath", RPATH_MODES)
+def test_generate_tree(tmp_path, rpath):
+    tree = generate_tree(str(tmp_path / "root"), libs=30, bins=3, fanout=2, depth=3,
+                         rpath=rpath, symlink_chain=2, dir_size=9, packaged=0.4)
+    assert len(tree.lib_dirs) == 10
+    assert len(tree.links) == 60
+
+    fs = DirFS(tree.root)
+    _, files, missing = process_elf(tree.bins, dpkg=False, root=fs)
+    assert missing == []
+    assert set(tree.bins) <= set(files)
+    assert set(files) & set(tree.links)
+
+    pkgs, files, missing = process_elf(tree.bins, dpkg=True, root=fs)
+    assert missing == []
+    assert pkgs and set(pkgs) <= set(tree.packages.values())
+    # packaged files are replaced by package names
+    assert not set(files) & set(tree.packages)
+
+
+def test_host_paths(tmp_path):
+    tree = generate_tree(str(tmp_path), libs=10, bins=2, depth=2, host_paths=True)
+    assert all(p.startswith(str(tmp_path)) for p in tree.bins + tree.libs)
+    _, files, missing = process_elf(tree.bins, dpkg=False)
+    assert missing == []
+    assert len(files) > len(tree.bins)
+
+
+@pytest.mark.parametrize("fs_mode", ['local', 'tar'])
+def test_bench(tmp_path, fs_mode):
+    result = run(60, str(tmp_path), fs_mode, repeat=1, fanout=2)
+    assert result['missing'] == 0
+    assert result['nodes'] > result['libs']
+    assert set(result['times']) == {'generate', 'scan', 'resolve', 'pkg', 'output', 'total'}
+
+
+def test_bench_dedup(tmp_path):
+    plain = run(60, str(tmp_path), 'dir', repeat=1, fanout=2, copies=1)
+    result = run(60, str(tmp_path), 'dir', repeat=1, fanout=2, copies=1, dedup=True)
+    assert 'dedup' in result['times'] and 'dedup' not in plain['times']
+    # libraries and the program interpreter, each with one copy
+    assert result['copies'] == 2 * (result['libs'] + 1)
+    assert result['nodes'] == plain['nodes'] and result['missing'] == 0
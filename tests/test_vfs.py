@@ -0,0 +1,216 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from lddcollect import process_elf, process_elf_per_input, find_libs
+from lddcollect.synth import generate_tree
+from lddcollect.vfs import DirFS, TarFS, OCIFS, open_root, LOCAL_FS
+
+
+def _rootfs(d):
+    """ Copy python executable and libs it needs into ``d``
+    """
+    exe = os.path.realpath(sys.executable)
+    _, files, _ = process_elf(exe, dpkg=False)
+    for path in files + ['/etc/ld.so.conf']:
+        dst = d + path
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), dst)
+        else:
+            shutil.copy(path, dst)
+    if os.path.isdir('/etc/ld.so.conf.d'):
+        shutil.copytree('/etc/ld.so.conf.d', d + '/etc/ld.so.conf.d')
+    return exe, sorted(files)
+
+
+def _tar_bytes(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            elif isinstance(data, tuple):
+                info.type, info.linkname = data
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _write_oci(d, layers):
+    os.makedirs(os.path.join(d, 'blobs', 'sha256'))
+
+    def blob(data):
+        digest = hashlib.sha256(data).hexdigest()
+        with open(os.path.join(d, 'blobs', 'sha256', digest), 'wb') as f:
+            f.write(data)
+        return {'digest': 'sha256:' + digest, 'size': len(data)}
+
+    manifest = {'schemaVersion': 2, 'layers': [blob(layer) for layer in layers]}
+    with open(os.path.join(d, 'index.json'), 'wt') as f:
+        json.dump({'schemaVersion': 2,
+                   'manifests': [blob(json.dumps(manifest).encode('utf8'))]}, f)
+
+
+def test_rootfs(tmp_path):
+    d = str(tmp_path / "root")
+    exe, files = _rootfs(d)
+
+    dirfs = DirFS(d)
+    assert dirfs.realpath(exe) == exe
+    _, _files, missing = process_elf(exe, dpkg=False, root=dirfs)
+    assert sorted(_files) == files
+    assert missing == []
+
+    tar_file = str(tmp_path / "root.tar.gz")
+    with tarfile.open(tar_file, 'w:gz', compresslevel=1) as tar:
+        tar.add(d, arcname='.')
+
+    fs = open_root(tar_file)
+    assert isinstance(fs, TarFS)
+    _, _files, missing = process_elf(exe, dpkg=False, root=fs)
+    assert sorted(_files) == files
+    assert missing == []
+
+    _, _files, missing = process_elf([exe], dpkg=False, root=fs, workers=2)
+    assert sorted(_files) == files
+
+
+def test_oci_whiteout(tmp_path):
+    d = str(tmp_path / "root")
+    exe, files = _rootfs(d)
+
+    base = io.BytesIO()
+    with tarfile.open(fileobj=base, mode='w') as tar:
+        tar.add(d, arcname='')
+
+    libc = next(p for p in files if os.path.basename(p) == 'libc.so.6')
+    top = _tar_bytes([(os.path.dirname(libc).lstrip('/') + '/.wh.libc.so.6', b'')])
+
+    image = str(tmp_path / "image")
+    _write_oci(image, [base.getvalue(), top])
+    fs = open_root(image)
+    assert isinstance(fs, OCIFS)
+    assert not fs.exists(libc)
+
+    _, _files, missing = process_elf(exe, dpkg=False, root=fs)
+    assert missing == ['libc.so.6']
+    assert libc not in _files
+
+
+def test_tar_fs(tmp_path):
+    layer1 = str(tmp_path / "1.tar")
+    layer2 = str(tmp_path / "2.tar")
+    with open(layer1, 'wb') as f:
+        f.write(_tar_bytes([('usr/lib/a.txt', b'a'),
+                            ('usr/lib/b.txt', b'bb'),
+                            ('usr/share/c.txt', b'c'),
+                            ('lib', (tarfile.SYMTYPE, 'usr/lib')),
+                            ('usr/lib/hard.txt', (tarfile.LNKTYPE, 'usr/lib/b.txt'))]))
+    with open(layer2, 'wb') as f:
+        f.write(_tar_bytes([('usr/share/', None),
+                            ('usr/share/.wh..wh..opq', b''),
+                            ('usr/share/d.txt', b'd'),
+                            ('usr/lib/.wh.a.txt', b'')]))
+
+    fs = TarFS([layer1])
+    assert fs.isdir('/usr')
+    assert fs.islink('/lib')
+    assert fs.realpath('/lib/b.txt') == '/usr/lib/b.txt'
+    with fs.open('/lib/hard.txt') as f:
+        assert f.read() == b'bb'
+    with fs.open('/usr/lib/b.txt') as f:
+        f.seek(1)
+        assert f.read(10) == b'b'
+    assert sorted(fs.listdir('/usr')) == [('lib', True), ('share', True)]
+
+    fs = TarFS([layer1, layer2])
+    assert not fs.exists('/lib/a.txt')
+    assert fs.exists('/lib/b.txt')
+    assert sorted(name for name, _ in fs.listdir('/usr/share')) == ['d.txt']
+    assert fs.glob('/usr/lib/*.txt') == ['/usr/lib/b.txt', '/usr/lib/hard.txt']
+
+    assert open_root(None) is LOCAL_FS
+    assert isinstance(open_root(str(tmp_path)), DirFS)
+
+
+def test_tar_fs_threads(tmp_path):
+    tree = generate_tree(str(tmp_path / 'root'), libs=400, bins=10, depth=2)
+    tar = str(tmp_path / 'root.tar.gz')
+    with tarfile.open(tar, 'w:gz') as t:
+        t.add(tree.root, arcname='.')
+    fs = TarFS([tar])
+
+    # all threads read from the same layer file
+    expect = list(find_libs('/', fs=fs))
+    assert len(expect) >= 400
+    for _ in range(3):
+        assert list(find_libs('/', workers=16, fs=fs)) == expect
+
+    def read(path):
+        with fs.open(path) as f:
+            return f.read()
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        for path, data in zip(expect, pool.map(read, expect)):
+            with open(tree.root + path, 'rb') as f:
+                assert data == f.read(), path
+    fs.close()
+
+
+def test_tar_fs_pickle(tmp_path, monkeypatch):
+    layer = str(tmp_path / "layer.tar.gz")
+    with gzip.open(layer, 'wb') as f:
+        f.write(_tar_bytes([('usr/lib/a.txt', b'a')]))
+    fs = TarFS([layer])
+    plain = list(fs._plain.values())
+    assert len(plain) == 1 and os.path.exists(plain[0])
+
+    # copies sent to worker processes do not decompress the layer again
+    monkeypatch.setattr(gzip, 'open', None)
+    copy = pickle.loads(pickle.dumps(fs))
+    with copy.open('/usr/lib/a.txt') as f:
+        assert f.read() == b'a'
+    copy.close()
+    assert os.path.exists(plain[0])
+
+    fs.close()
+    assert not os.path.exists(plain[0])
+
+
+def test_root_closed(tmp_path, monkeypatch):
+    tree = generate_tree(str(tmp_path / 'root'), libs=10, bins=2, depth=1)
+    tar = str(tmp_path / 'root.tar.gz')
+    with tarfile.open(tar, 'w:gz') as t:
+        t.add(tree.root, arcname='.')
+    tmp = tmp_path / 'tmp'
+    tmp.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp))
+
+    closed = []
+    close = TarFS.close
+    monkeypatch.setattr(TarFS, 'close', lambda fs: closed.append(fs) or close(fs))
+
+    expect = process_elf(tree.bins, dpkg=False, root=DirFS(tree.root))
+    for _ in range(3):
+        assert process_elf(tree.bins, dpkg=False, root=tar) == expect
+        assert process_elf_per_input(tree.bins, dpkg=False, root=tar)
+    # file systems opened for a path are closed, decompressed layers removed
+    assert len(closed) == 6
+    assert list(tmp.iterdir()) == []
+
+    fs = TarFS([tar])
+    process_elf(tree.bins, dpkg=False, root=fs)
+    assert len(closed) == 6
+    fs.close()
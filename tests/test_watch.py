@@ -0,0 +1,112 @@
+import os
+import shutil
+import pytest
+from lddcollect import process_elf, process_elf_per_input, find_libs
+from lddcollect.synth import generate_tree, elf_bytes
+from lddcollect.watch import Watcher, _inotify
+
+
+def _bump_mtime(path):
+    # directory mtime might not move when changed within one clock tick
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_watch_files(tmp_path):
+    tree = generate_tree(str(tmp_path), libs=30, bins=6, fanout=2, depth=3, host_paths=True)
+    w = Watcher(tree.bins)
+    diff = w.update()
+    pkgs, files, missing = w.totals()
+    assert diff.added_files == files
+    assert sorted(w.updated) == sorted(tree.bins)
+    assert (files, missing) == tuple(sorted(x) for x in process_elf(tree.bins, dpkg=False)[1:])
+
+    assert w.update().empty
+    assert w.updated == []
+
+    # library that only some of the inputs need
+    per_input = process_elf_per_input(tree.bins, dpkg=False)
+    lib = min((lib for lib in tree.libs if lib in files),
+              key=lambda lib: sum(lib in f for _, f, _ in per_input.values()))
+    users = sorted(b for b, (_, f, _) in per_input.items() if lib in f)
+    assert len(users) < len(tree.bins)
+
+    os.utime(lib, ns=(1, 1))
+    assert w.update().empty
+    assert sorted(w.updated) == users
+
+    data = open(lib, 'rb').read()
+    os.unlink(lib)
+    _bump_mtime(os.path.dirname(lib))
+    diff = w.update()
+    soname = os.path.basename(lib).rsplit('.', 1)[0]
+    assert diff.removed_files == [lib[:-2], lib]
+    assert diff.added_missing == [soname]
+    assert diff.added_files == diff.removed_missing == []
+    assert w.totals()[2] == [soname]
+
+    with open(lib, 'wb') as f:
+        f.write(data)
+    diff = w.update()
+    assert diff.added_files == [lib[:-2], lib]
+    assert diff.removed_missing == [soname]
+    assert w.totals() == (pkgs, files, missing)
+
+    # missing input is reported once it shows up again
+    os.rename(tree.bins[0], tree.bins[0] + '.bak')
+    w.update()
+    os.rename(tree.bins[0] + '.bak', tree.bins[0])
+    w.update()
+    assert w.totals() == (pkgs, files, missing)
+
+
+def test_watch_dir(tmp_path):
+    tree = generate_tree(str(tmp_path), libs=20, bins=2, depth=2, host_paths=True)
+    top = os.path.dirname(tree.lib_dirs[0])
+    w = Watcher([top])
+    w.update()
+    inputs = sorted(find_libs(top))
+    assert sorted(w.inputs) == inputs
+    # files under the input directory are not listed
+    assert not any(f.startswith(top) for f in w.totals()[1])
+
+    extra = os.path.join(top, 'extra', 'sub')
+    os.makedirs(extra)
+    (tmp_path / extra / 'libextra.so').write_bytes(elf_bytes(soname='libextra.so'))
+    _bump_mtime(top)
+    assert w.update().empty
+    # new library and the ones in the changed directory
+    assert sorted(w.updated) == sorted([os.path.join(extra, 'libextra.so')] +
+                                       [p for p in inputs if os.path.dirname(p) == top])
+    assert os.path.join(extra, 'libextra.so') in w.inputs
+
+    shutil.rmtree(os.path.join(top, 'extra'))
+    _bump_mtime(top)
+    w.update()
+    assert sorted(w.inputs) == inputs
+
+
+def test_watch_loop(tmp_path):
+    tree = generate_tree(str(tmp_path), libs=10, bins=2, depth=1, host_paths=True)
+    w = Watcher(tree.bins)
+    changes = w.watch(interval=0.05)
+    assert next(changes).added_files == w.totals()[1]
+
+    lib = next(lib for lib in tree.libs if lib in w.totals()[1])
+    os.unlink(lib)
+    assert lib in next(changes).removed_files
+    changes.close()
+
+
+def test_inotify(tmp_path):
+    notify = _inotify()
+    if notify is None:
+        pytest.skip("inotify is not available")
+    try:
+        notify.add(str(tmp_path))
+        assert not notify.wait(0)
+        (tmp_path / 'a').write_bytes(b'')
+        assert notify.wait(1)
+        assert not notify.wait(0)
+    finally:
+        notify.close()